@@ -0,0 +1,453 @@
+"""
+Deterministic fixtures shaped like the Khan Academy responses, large enough
+to exercise the client the way a real district sized account does. The same
+scale and seed always give the same data, so benchmark runs are comparable.
+"""
+
+import json
+import random
+from datetime import datetime, timedelta
+
+# Fixture timestamps lie in the year before this date
+ANCHOR = datetime(2024, 6, 1)
+
+SCALES = {
+    # topic tree: domains x subjects x units x lessons, each lesson holding
+    # `exercises` exercises and `videos` videos
+    "small": {
+        "domains": 2,
+        "subjects": 3,
+        "units": 4,
+        "lessons": 4,
+        "exercises": 4,
+        "videos": 3,
+        "students": 60,
+        "class_size": 30,
+        "assignments": 20,
+        "events": 40,
+    },
+    "medium": {
+        "domains": 4,
+        "subjects": 5,
+        "units": 6,
+        "lessons": 6,
+        "exercises": 5,
+        "videos": 4,
+        "students": 600,
+        "class_size": 30,
+        "assignments": 60,
+        "events": 150,
+    },
+    "large": {
+        "domains": 6,
+        "subjects": 8,
+        "units": 8,
+        "lessons": 8,
+        "exercises": 6,
+        "videos": 6,
+        "students": 3000,
+        "class_size": 35,
+        "assignments": 120,
+        "events": 400,
+    },
+}
+
+_WORDS = (
+    "adding subtracting multiplying dividing fractions decimals ratios rates "
+    "percents equations expressions inequalities functions graphs slopes "
+    "intercepts systems polynomials factoring quadratics exponents radicals "
+    "triangles circles angles area volume probability statistics sequences "
+    "vectors matrices limits derivatives integrals cells energy atoms "
+    "molecules forces motion waves light electricity grammar punctuation"
+).split()
+
+_LEVELS = ("unstarted", "practiced", "mastery1", "mastery2", "mastery3")
+
+
+def format_time(dt):
+    return dt.strftime("%Y-%m-%dT%H:%M:%SZ")
+
+
+def parse_time(value):
+    return datetime.strptime(value.rstrip("Z").split(".")[0], "%Y-%m-%dT%H:%M:%S")
+
+
+def _title(rng, words=3):
+    return " ".join(rng.choice(_WORDS) for _ in range(words)).capitalize()
+
+
+def _slug(title, n):
+    return "%s-%d" % (title.lower().replace(" ", "-"), n)
+
+
+def _past(rng, days=365):
+    return ANCHOR - timedelta(seconds=rng.randrange(days * 86400))
+
+
+class Dataset:
+    """
+    All the data served by the mock server at one scale. Per student data is
+    generated on first use from a seed derived from the kaid.
+    :param: scale, a key of SCALES or a dict of the same shape
+    """
+
+    def __init__(self, scale="small", seed=0):
+        self.scale = SCALES[scale] if isinstance(scale, str) else scale
+        self.seed = seed
+        self._encoded = {}
+        self._per_student = {}
+        self._build()
+
+    def _rng(self, *key):
+        return random.Random(":".join(str(k) for k in (self.seed,) + key))
+
+    def _build(self):
+        rng = self._rng("dataset")
+        scale = self.scale
+        self.exercises = []
+        self.videos = []
+        self.topics = []
+        counter = [0]
+
+        def next_id(prefix):
+            counter[0] += 1
+            return "%s%d" % (prefix, counter[0])
+
+        def topic(title, depth, children):
+            slug = _slug(title, counter[0])
+            node = {
+                "kind": "Topic",
+                "id": next_id("x"),
+                "slug": slug,
+                "node_slug": slug,
+                "title": title,
+                "translated_title": title,
+                "description": _title(rng, 12),
+                "relative_url": "/%s" % slug,
+                "render_type": ("Domain", "Subject", "Topic", "Tutorial")[depth],
+                "hide": False,
+                "children": children,
+            }
+            self.topics.append({k: v for k, v in node.items() if k != "children"})
+            return node
+
+        def exercise():
+            if self.exercises and rng.random() < 0.1:
+                # exercises are often listed in more than one place
+                return rng.choice(self.exercises)
+            title = _title(rng)
+            name = _slug(title, counter[0])
+            node = {
+                "kind": "Exercise",
+                "id": next_id("e"),
+                "name": name,
+                "node_slug": "e/" + name,
+                "title": title,
+                "display_name": title,
+                "translated_display_name": title,
+                "description": _title(rng, 10),
+                "ka_url": "https://www.khanacademy.org/e/" + name,
+                "relative_url": "/e/" + name,
+                "prerequisites": (
+                    [e["name"] for e in rng.sample(self.exercises, 2)]
+                    if len(self.exercises) > 2
+                    else []
+                ),
+                "covers": [],
+                "tags": [],
+                "creation_date": format_time(_past(rng, 3000)),
+                "file_name": None,
+                "is_quiz": False,
+                "v_position": rng.randrange(40),
+                "h_position": rng.randrange(40),
+            }
+            self.exercises.append(node)
+            return node
+
+        def video():
+            title = _title(rng)
+            slug = _slug(title, counter[0])
+            node = {
+                "kind": "Video",
+                "id": next_id("v"),
+                "readable_id": slug,
+                "youtube_id": "%011x" % rng.getrandbits(44),
+                "node_slug": "v/" + slug,
+                "title": title,
+                "translated_title": title,
+                "description": _title(rng, 16),
+                "duration": rng.randrange(60, 1200),
+                "ka_url": "https://www.khanacademy.org/v/" + slug,
+                "date_added": format_time(_past(rng, 3000)),
+                "keywords": ", ".join(rng.sample(_WORDS, 5)),
+            }
+            self.videos.append(node)
+            return node
+
+        roots = []
+        for _ in range(scale["domains"]):
+            subjects = []
+            for _ in range(scale["subjects"]):
+                units = []
+                for _ in range(scale["units"]):
+                    lessons = []
+                    for _ in range(scale["lessons"]):
+                        children = [exercise() for _ in range(scale["exercises"])]
+                        children += [video() for _ in range(scale["videos"])]
+                        rng.shuffle(children)
+                        lessons.append(topic(_title(rng), 3, children))
+                    units.append(topic(_title(rng), 2, lessons))
+                subjects.append(topic(_title(rng), 1, units))
+            roots.append(topic(_title(rng), 0, subjects))
+        self.tree = topic("Root", 0, roots)
+        self.tree["render_type"] = "Root"
+        self.exercise_names = sorted({e["name"] for e in self.exercises})
+
+        self.students = []
+        for i in range(scale["students"]):
+            nickname = "%s %s" % (
+                rng.choice(_WORDS).title(),
+                rng.choice(_WORDS).title(),
+            )
+            kaid = "kaid_%019d" % rng.getrandbits(60)
+            self.students.append(
+                {
+                    "kaid": kaid,
+                    "id": kaid,
+                    "email": "student%d@school.example" % i,
+                    "username": "student%d" % i,
+                    "nickname": nickname,
+                    "coachNickname": nickname,
+                    "profileRoot": "/profile/%s/" % kaid,
+                    "joined": format_time(_past(rng, 1000)),
+                    "last_activity": format_time(_past(rng)),
+                    "points": rng.randrange(200000),
+                    "total_seconds_watched": rng.randrange(100000),
+                    "proficient_exercises": rng.randrange(200),
+                    "struggling_exercises": rng.randrange(10),
+                    "badge_counts": {str(b): rng.randrange(20) for b in range(6)},
+                }
+            )
+        self.kaids = [s["kaid"] for s in self.students]
+        self.students_by_kaid = {s["kaid"]: s for s in self.students}
+
+        size = scale["class_size"]
+        self.classes = {}
+        for n, start in enumerate(range(0, len(self.students), size)):
+            self.classes["class_%d" % n] = self.kaids[start : start + size]
+        self.assignments = {}
+        for class_id, kaids in self.classes.items():
+            assignments = []
+            for n in range(scale["assignments"]):
+                exercise_node = rng.choice(self.exercises)
+                due = _past(rng, 200)
+                assignments.append(
+                    {
+                        "id": "%s_assignment_%d" % (class_id, n),
+                        "dueDate": format_time(due),
+                        "assignedDate": format_time(due - timedelta(days=7)),
+                        "isDraft": False,
+                        "subjectSlug": "math",
+                        "exercise": exercise_node,
+                        "states": [
+                            {
+                                "studentKaid": kaid,
+                                "completedOn": (
+                                    format_time(due) if rng.random() < 0.7 else None
+                                ),
+                                "bestScore": {
+                                    "numAttempted": 7,
+                                    "numCorrect": rng.randrange(8),
+                                    "__typename": "AssignmentScore",
+                                },
+                                "__typename": "ItemCompletionState",
+                            }
+                            for kaid in kaids
+                        ],
+                    }
+                )
+            self.assignments[class_id] = assignments
+        self.assignments_by_id = {
+            a["id"]: (class_id, a)
+            for class_id, assignments in self.assignments.items()
+            for a in assignments
+        }
+
+    def encoded(self, name, build):
+        """Pre-encoded bytes of a static document, built once"""
+        body = self._encoded.get(name)
+        if body is None:
+            body = self._encoded[name] = json.dumps(build()).encode("utf-8")
+        return body
+
+    # REST documents
+
+    def topictree(self, kind=None):
+        """/api/v1/topictree, restricted to topics (and exercises) by kind"""
+        if kind is None:
+            return self.encoded("topictree", lambda: self.tree)
+        keep = {"Topic"} if kind == "Topic" else {"Topic", kind}
+
+        def prune(node):
+            children = node.get("children")
+            if children is None:
+                return node
+            return {
+                **node,
+                "children": [prune(c) for c in children if c["kind"] in keep],
+            }
+
+        return self.encoded("topictree:" + kind, lambda: prune(self.tree))
+
+    def topictree_v2(self):
+        """/api/v2/topics/topictree, flat lists of every kind of node"""
+        return self.encoded(
+            "topictree_v2",
+            lambda: {
+                "topics": self.topics,
+                "exercises": self.exercises,
+                "videos": self.videos,
+            },
+        )
+
+    def _student_data(self, kaid):
+        data = self._per_student.get(kaid)
+        if data is not None:
+            return data
+        rng = self._rng("student", kaid)
+        count = min(len(self.exercise_names), max(5, self.scale["events"] // 3))
+        names = rng.sample(self.exercise_names, count)
+        levels = {name: rng.choice(_LEVELS) for name in names}
+        changes = []
+        logs = {}
+        for _ in range(self.scale["events"]):
+            name = rng.choice(names)
+            when = _past(rng)
+            changes.append(
+                {
+                    "exercise_name": name,
+                    "kaid": kaid,
+                    "date": format_time(when),
+                    "from_progress": {"level": rng.choice(_LEVELS)},
+                    "to_progress": {"level": rng.choice(_LEVELS)},
+                    "is_mastery": rng.random() < 0.2,
+                }
+            )
+            logs.setdefault(name, []).append(
+                {
+                    "exercise": name,
+                    "kaid": kaid,
+                    "time_done": format_time(when),
+                    "correct": rng.random() < 0.7,
+                    "count_hints": rng.randrange(3),
+                    "count_attempts": rng.randrange(1, 4),
+                    "time_taken": rng.randrange(5, 300),
+                    "problem_number": rng.randrange(1, 40),
+                    "seed": rng.getrandbits(32),
+                    "ip_address": "10.0.%d.%d"
+                    % (rng.randrange(256), rng.randrange(256)),
+                }
+            )
+        changes.sort(key=lambda e: e["date"])
+        data = self._per_student[kaid] = {
+            "levels": levels,
+            "changes": changes,
+            "logs": logs,
+        }
+        return data
+
+    def user_exercises(self, kaid, names=None):
+        """/api/v1/user/exercises"""
+        levels = self._student_data(kaid)["levels"]
+        rng = self._rng("user_exercises", kaid)
+        by_name = {e["name"]: e for e in self.exercises}
+        result = []
+        for name in names or sorted(levels):
+            exercise_node = by_name.get(name)
+            if exercise_node is None:
+                continue
+            level = levels.get(name, "unstarted")
+            result.append(
+                {
+                    "exercise": name,
+                    "kaid": kaid,
+                    "exercise_model": exercise_node,
+                    "exercise_progress": {
+                        "level": level,
+                        "practiced": level != "unstarted",
+                    },
+                    "streak": rng.randrange(10),
+                    "longest_streak": rng.randrange(20),
+                    "total_done": rng.randrange(100),
+                    "total_correct": rng.randrange(80),
+                    "last_done": format_time(_past(rng)),
+                    "last_attempt_number": rng.randrange(1, 4),
+                    "last_count_hints": rng.randrange(3),
+                    "maximum_exercise_progress_dt": format_time(_past(rng)),
+                    "proficient_date": None,
+                    "practiced": level != "unstarted",
+                    "mastered": level == "mastery3",
+                }
+            )
+        return result
+
+    def progress_changes(self, kaid, dt_start=None, dt_end=None):
+        """/api/v1/user/exercises/progress_changes"""
+        return _window(self._student_data(kaid)["changes"], "date", dt_start, dt_end)
+
+    def problem_logs(self, kaid, exercise, dt_start=None, dt_end=None):
+        """/api/v1/user/exercises/<exercise>/log"""
+        logs = self._student_data(kaid)["logs"].get(exercise, [])
+        return _window(logs, "time_done", dt_start, dt_end)
+
+    def student_exercises(self, kaid):
+        """Names of the exercises a student has worked on"""
+        return sorted(self._student_data(kaid)["levels"])
+
+    def student_progress(self, kaid):
+        """/api/internal/user/<kaid>/progress"""
+        student = self.students_by_kaid.get(kaid)
+        if student is None:
+            return None
+        levels = self._student_data(kaid)["levels"]
+        return {
+            "students": [
+                {
+                    "kaid": kaid,
+                    "nickname": student["nickname"],
+                    "exerciseProgress": [
+                        {"exercise": name, "level": level}
+                        for name, level in sorted(levels.items())
+                    ],
+                    "pointsEarned": student["points"],
+                    "secondsWatched": student["total_seconds_watched"],
+                }
+            ]
+        }
+
+    def students_progress(self, dt_start=None, dt_end=None):
+        """/api/internal/user/students/progress, the students active in the window"""
+        return {"students": _window(self.students, "last_activity", dt_start, dt_end)}
+
+    def touch_students(self, count, when=None):
+        """
+        Mark `count` students as active at `when` (now by default), so an
+        incremental sync has something to pick up
+        """
+        when = format_time(when or datetime.utcnow())
+        for student in self.students[:count]:
+            student["last_activity"] = when
+            student["points"] += 1
+
+
+def _window(items, field, dt_start, dt_end):
+    if dt_start is None and dt_end is None:
+        return list(items)
+    start = dt_start and format_time(parse_time(dt_start))
+    end = dt_end and format_time(parse_time(dt_end))
+    return [
+        item
+        for item in items
+        if (start is None or item[field] >= start)
+        and (end is None or item[field] <= end)
+    ]
@@ -0,0 +1,665 @@
+"""
+A local stand-in for the Khan Academy api, serving the fixtures of a Dataset
+over HTTP so the client can be measured without credentials or a network:
+
+    with MockKhanServer(Dataset("medium"), latency=0.02, error_rate=0.01) as server:
+        kapi = KhanAPI(server_url=server.url)
+
+It answers the REST endpoints used by the sync and progress helpers, with an
+ETag on every 200 and a bodiless 304 to a matching If-None-Match, and the
+GraphQL operations of graphql_schema, sent one at a time, as JSON arrays, or
+merged into one document by khan_api_wrapper.batch, and as persisted queries.
+Selections are not evaluated: queries get the whole object, whatever fields
+they ask for.
+
+Benchmarks run it in a process of its own (see serve_in_process), and read
+its counters through the control endpoints, which are neither delayed nor
+failed:
+    GET /_mock/stats, requests per operation, injected errors, 304s, bytes sent
+    POST /_mock/reset, zero the counters
+    POST /_mock/touch?count=N, mark N students active now
+
+It can also be started by hand:
+    python -m benchmarks.mock_server --scale medium --port 8000
+"""
+
+import argparse
+import hashlib
+import json
+import multiprocessing
+import random
+import re
+import threading
+import time
+from http.server import BaseHTTPRequestHandler, ThreadingHTTPServer
+from urllib.parse import parse_qs, unquote, urlsplit
+
+from benchmarks.fixtures import ANCHOR, format_time
+
+# Variables of every operation, to recognise the operations of a merged batch
+_VARIABLES = {
+    "simpleCompletionQuery": {"assignmentId"},
+    "getStudentsList": {"hasClassId", "classId", "after", "pageSize"},
+    "quizAndUnitTestAttemptsQuery": {"topicId", "kaid"},
+    "ProgressByStudent": {
+        "assignmentFilters",
+        "contentKinds",
+        "classId",
+        "pageSize",
+        "after",
+    },
+    "AutoAssignableStudents": {"studentListId"},
+    "CoachAssignments": {
+        "studentListId",
+        "assignmentFilters",
+        "orderBy",
+        "pageSize",
+        "after",
+    },
+    "stopCoaching": {"kaids", "invitationIds", "coachRequestIds"},
+    "transferStudents": {
+        "fromListIds",
+        "toListIds",
+        "kaids",
+        "invitationIds",
+        "coachRequestIds",
+    },
+    "updateAutoAssign": {"studentListId", "studentKaids", "autoAssign"},
+    "publishAssignment": {"assignmentId"},
+}
+_MUTATIONS = {
+    "stopCoaching",
+    "transferStudents",
+    "updateAutoAssign",
+    "publishAssignment",
+}
+_OPERATION = re.compile(r"^\s*(query|mutation)\s+(\w+)")
+_BATCH_ALIAS = re.compile(r"\bb(\d+)_(\w+)\s*:")
+
+
+class MockKhanServer:
+    """
+    Threaded HTTP server answering from a Dataset.
+    :param: latency, seconds added to every response
+    :param: jitter, up to this many more seconds, drawn at random
+    :param: error_rate, share of the requests answered with `error_status`
+        instead, before they are looked at
+    :param: error_status, status of the injected errors. 429 and 503 carry a
+        `Retry-After: 0` header, so clients retry right away
+    :param: seed, of the latency and error draws
+    :param: port, 0 for any free port
+    """
+
+    def __init__(
+        self,
+        dataset,
+        latency=0.0,
+        jitter=0.0,
+        error_rate=0.0,
+        error_status=503,
+        seed=0,
+        host="127.0.0.1",
+        port=0,
+    ):
+        self.dataset = dataset
+        self.latency = latency
+        self.jitter = jitter
+        self.error_rate = error_rate
+        self.error_status = error_status
+        self.random = random.Random(seed)
+        self.lock = threading.Lock()
+        # operation name or path -> requests answered, and errors injected
+        self.requests = {}
+        self.errors = 0
+        self.not_modified = 0
+        self.bytes_sent = 0
+        self.persisted = {}
+        # id of a pre-encoded document -> (document, its etag)
+        self._etags = {}
+        self.httpd = ThreadingHTTPServer((host, port), _Handler)
+        self.httpd.daemon_threads = True
+        self.httpd.mock = self
+        self.thread = None
+
+    @property
+    def url(self):
+        host, port = self.httpd.server_address[:2]
+        return "http://%s:%d" % (host, port)
+
+    def start(self):
+        self.thread = threading.Thread(target=self.httpd.serve_forever, daemon=True)
+        self.thread.start()
+        return self
+
+    def stop(self):
+        self.httpd.shutdown()
+        self.httpd.server_close()
+
+    def __enter__(self):
+        return self.start()
+
+    def __exit__(self, *exc_info):
+        self.stop()
+
+    def reset_counters(self):
+        with self.lock:
+            self.requests = {}
+            self.errors = 0
+            self.not_modified = 0
+            self.bytes_sent = 0
+
+    def stats(self):
+        with self.lock:
+            return {
+                "requests": dict(self.requests),
+                "total_requests": sum(self.requests.values()),
+                "errors": self.errors,
+                "not_modified": self.not_modified,
+                "bytes_sent": self.bytes_sent,
+            }
+
+    def _draw(self):
+        """(delay, inject an error) for the next request"""
+        with self.lock:
+            delay = self.latency + (
+                self.random.uniform(0, self.jitter) if self.jitter else 0
+            )
+            error = self.error_rate > 0 and self.random.random() < self.error_rate
+            if error:
+                self.errors += 1
+        return delay, error
+
+    def _count(self, name, size, not_modified=False):
+        with self.lock:
+            self.requests[name] = self.requests.get(name, 0) + 1
+            self.bytes_sent += size
+            if not_modified:
+                self.not_modified += 1
+
+    def etag(self, body, static=False):
+        """
+        The strong ETag of an encoded body. Those of the static documents,
+        encoded once by the Dataset, are only hashed once.
+        """
+        if not static:
+            return '"%s"' % hashlib.sha1(body).hexdigest()
+        with self.lock:
+            cached = self._etags.get(id(body))
+        if cached is not None and cached[0] is body:
+            return cached[1]
+        etag = '"%s"' % hashlib.sha1(body).hexdigest()
+        with self.lock:
+            self._etags[id(body)] = (body, etag)
+        return etag
+
+    # REST
+
+    def get(self, path, query):
+        """(status, body) of a GET request"""
+        data = self.dataset
+        one = lambda key: (query.get(key) or [None])[0]
+        window = one("dt_start"), one("dt_end")
+        parts = path.strip("/").split("/")
+
+        if path == "/api/v1/topictree":
+            return 200, data.topictree(one("kind"))
+        if path == "/api/v2/topics/topictree":
+            return 200, data.topictree_v2()
+        if path == "/api/v1/user/exercises":
+            names = []
+            for value in query.get("exercises", ()):
+                names.extend(n for n in value.split(",") if n)
+            return 200, data.user_exercises(one("kaid") or data.kaids[0], names or None)
+        if path == "/api/v1/user/exercises/progress_changes":
+            return 200, data.progress_changes(one("kaid") or data.kaids[0], *window)
+        if parts[:4] == ["api", "v1", "user", "exercises"] and parts[-1] == "log":
+            exercise = unquote(parts[4])
+            return 200, data.problem_logs(
+                one("kaid") or data.kaids[0], exercise, *window
+            )
+        if path == "/api/internal/user/students/progress":
+            return 200, data.students_progress(*window)
+        if parts[:3] == ["api", "internal", "user"] and parts[-1] == "progress":
+            progress = data.student_progress(parts[3])
+            if progress is None:
+                return 404, {"error": "Not found"}
+            return 200, progress
+        if path == "/api/v1/user":
+            return 200, data.students[0]
+        return 404, {"error": "Not found: %s" % path}
+
+    # GraphQL
+
+    def graphql(self, payload):
+        """(status, body) of a GraphQL request, a payload or a list of them"""
+        if isinstance(payload, list):
+            return 200, [self._operation(p) for p in payload]
+        return 200, self._operation(payload)
+
+    def _operation(self, payload):
+        if not isinstance(payload, dict):
+            return {"errors": [{"message": "Bad request"}]}
+        query = payload.get("query")
+        persisted = (payload.get("extensions") or {}).get("persistedQuery")
+        if persisted:
+            digest = persisted.get("sha256Hash")
+            if query is None:
+                query = self.persisted.get(digest)
+                if query is None:
+                    return {
+                        "errors": [
+                            {
+                                "message": "PersistedQueryNotFound",
+                                "extensions": {"code": "PERSISTED_QUERY_NOT_FOUND"},
+                            }
+                        ]
+                    }
+            else:
+                self.persisted[digest] = query
+        match = _OPERATION.match(query or "")
+        if not match:
+            return {"errors": [{"message": "No operation"}]}
+        kind, name = match.groups()
+        variables = payload.get("variables") or {}
+        if not name.startswith("batch_"):
+            return {"data": self.resolve(name, variables)}
+
+        # an operation merged by khan_api_wrapper.batch: fields b{i}_field
+        # with variables name_i
+        data = {}
+        indexes = sorted({int(i) for i, _ in _BATCH_ALIAS.findall(query)})
+        for i in indexes:
+            suffix = "_%d" % i
+            own = {
+                key[: -len(suffix)]: value
+                for key, value in variables.items()
+                if key.endswith(suffix)
+            }
+            for field, value in self.resolve(_guess(kind, own), own).items():
+                data["b%d_%s" % (i, field)] = value
+        return {"data": data}
+
+    def resolve(self, name, variables):
+        """The data of one operation"""
+        data = self.dataset
+        coach = {"id": "coach", "kaid": "kaid_coach", "__typename": "User"}
+
+        if name == "getStudentsList":
+            after = int(variables.get("after") or 0)
+            size = int(variables.get("pageSize") or 1000)
+            if variables.get("hasClassId"):
+                kaids = data.classes.get(variables.get("classId"), [])
+            else:
+                kaids = data.kaids
+            students = [
+                {
+                    key: data.students_by_kaid[kaid][key]
+                    for key in (
+                        "kaid",
+                        "id",
+                        "email",
+                        "coachNickname",
+                        "profileRoot",
+                        "username",
+                    )
+                }
+                for kaid in kaids[after : after + size]
+            ]
+            page = {
+                "students": students,
+                "nextCursor": after + size if after + size < len(kaids) else None,
+                "__typename": "StudentsPage",
+            }
+            lists = [
+                {
+                    "id": class_id,
+                    "cacheId": class_id,
+                    "name": class_id.replace("_", " ").title(),
+                    "key": class_id,
+                    "topicTitle": None,
+                    "studentKaids": class_kaids,
+                    "isDistrictSynced": False,
+                    "__typename": "StudentList",
+                }
+                for class_id, class_kaids in data.classes.items()
+            ]
+            if variables.get("hasClassId"):
+                coach["studentList"] = {
+                    "id": variables.get("classId"),
+                    "countStudents": len(kaids),
+                    "studentsPage": page,
+                    "invitations": [],
+                    "coachRequests": [],
+                    "__typename": "StudentList",
+                }
+            else:
+                coach.update(
+                    countStudents=len(kaids),
+                    studentsPage=page,
+                    invitations=[],
+                    coachRequests=[],
+                    studentList=None,
+                )
+            coach["studentLists"] = lists
+            return {
+                "coach": coach,
+                "user": {"id": "coach", "tosForFormalTeacherStatus": True},
+            }
+
+        if name in ("ProgressByStudent", "CoachAssignments"):
+            class_id = variables.get("classId") or variables.get("studentListId")
+            assignments = data.assignments.get(class_id, [])
+            after = int(variables.get("after") or 0)
+            size = int(variables.get("pageSize") or 100)
+            page = [
+                _assignment(a, data.classes[class_id], name)
+                for a in assignments[after : after + size]
+            ]
+            more = after + size < len(assignments)
+            coach["studentList"] = {
+                "id": class_id,
+                "cacheId": class_id,
+                "studentKaidsAndNicknames": [
+                    {
+                        "id": kaid,
+                        "coachNickname": data.students_by_kaid[kaid]["nickname"],
+                    }
+                    for kaid in data.classes.get(class_id, [])
+                ],
+                "assignmentsPage": {
+                    "assignments": page,
+                    "pageInfo": {"nextCursor": str(after + size) if more else None},
+                },
+            }
+            return {"coach": coach}
+
+        if name == "simpleCompletionQuery":
+            found = data.assignments_by_id.get(variables.get("assignmentId"))
+            if found is None:
+                coach["assignment"] = None
+                return {"coach": coach}
+            class_id, assignment = found
+            states = [
+                {
+                    "student": {
+                        "id": state["studentKaid"],
+                        "kaid": state["studentKaid"],
+                        "coachNickname": data.students_by_kaid[state["studentKaid"]][
+                            "nickname"
+                        ],
+                        "profileRoot": "/profile/%s/" % state["studentKaid"],
+                    },
+                    "state": "COMPLETED" if state["completedOn"] else "UNSTARTED",
+                    "completedOn": state["completedOn"],
+                    "bestScore": state["bestScore"],
+                    "exerciseAttempts": [],
+                }
+                for state in assignment["states"]
+            ]
+            coach["assignment"] = {
+                **_assignment(assignment, data.classes[class_id], name),
+                "itemCompletionStates": states,
+                "studentList": {"id": class_id, "cacheId": class_id, "name": class_id},
+            }
+            return {"coach": coach}
+
+        if name == "AutoAssignableStudents":
+            class_id = variables.get("studentListId")
+            coach["studentList"] = {
+                "id": class_id,
+                "cacheId": class_id,
+                "name": class_id,
+                "autoAssignableStudents": [
+                    {"id": kaid, "kaid": kaid}
+                    for kaid in data.classes.get(class_id, [])
+                ],
+            }
+            return {"coach": coach}
+
+        if name == "quizAndUnitTestAttemptsQuery":
+            attempt = {
+                "id": "attempt",
+                "numAttempted": 10,
+                "numCorrect": 8,
+                "completedDate": format_time(ANCHOR),
+                "canResume": False,
+                "isCompleted": True,
+            }
+            return {
+                "user": {
+                    "id": variables.get("kaid") or "coach",
+                    "latestUnitTestAttempts": [attempt],
+                    "latestQuizAttempts": [dict(attempt, positionKey="1")],
+                }
+            }
+
+        if name in ("stopCoaching", "transferStudents"):
+            return {name: {"coach": coach, "__typename": name}}
+        if name == "updateAutoAssign":
+            return {"updateAutoAssign": {"coach": coach}}
+        if name == "publishAssignment":
+            return {
+                "updateAssignment": {
+                    "assignment": {
+                        "id": variables.get("assignmentId"),
+                        "isDraft": False,
+                    }
+                }
+            }
+        return {}
+
+
+def _guess(kind, variables):
+    """The operation of the kind whose variables best match `variables`"""
+    names = set(variables)
+    candidates = [
+        name for name in _VARIABLES if (name in _MUTATIONS) == (kind == "mutation")
+    ]
+    return max(
+        candidates,
+        key=lambda name: (len(names & _VARIABLES[name]), -len(_VARIABLES[name])),
+    )
+
+
+def _assignment(assignment, kaids, operation):
+    exercise = assignment["exercise"]
+    content = {
+        "id": exercise["id"],
+        "translatedTitle": exercise["title"],
+        "title": exercise["title"],
+        "kind": "Exercise",
+        "defaultUrlPath": exercise["relative_url"],
+        "__typename": "Exercise",
+    }
+    result = {
+        "id": assignment["id"],
+        "dueDate": assignment["dueDate"],
+        "contents": [content],
+        "__typename": "Assignment",
+    }
+    if operation == "ProgressByStudent":
+        result["itemCompletionStates"] = assignment["states"]
+    else:
+        result.update(
+            studentKaids=kaids,
+            isDraft=assignment["isDraft"],
+            subjectSlug=assignment["subjectSlug"],
+            numStudentsCompleted=sum(
+                1 for s in assignment["states"] if s["completedOn"]
+            ),
+            assignedDate=assignment["assignedDate"],
+            contentDescriptors=["Exercise:" + exercise["id"]],
+            exerciseConfig={"itemPickerStrategy": "RANDOM"},
+        )
+    return result
+
+
+class _Handler(BaseHTTPRequestHandler):
+    protocol_version = "HTTP/1.1"
+    # headers and body are written separately, which would otherwise wait
+    # for the delayed ack of the client
+    disable_nagle_algorithm = True
+
+    def log_message(self, *args):
+        pass
+
+    def _reply(self, name, status, body, headers=()):
+        if not isinstance(body, bytes):
+            body = json.dumps(body).encode("utf-8")
+        self.server.mock._count(name, len(body))
+        self.send_response(status)
+        self.send_header("Content-Type", "application/json")
+        self.send_header("Content-Length", str(len(body)))
+        for header in headers:
+            self.send_header(*header)
+        self.end_headers()
+        self.wfile.write(body)
+
+    def _not_modified(self, name, etag):
+        self.server.mock._count(name, 0, not_modified=True)
+        self.send_response(304)
+        self.send_header("ETag", etag)
+        self.end_headers()
+
+    def _injected(self, name):
+        mock = self.server.mock
+        delay, error = mock._draw()
+        if delay:
+            time.sleep(delay)
+        if not error:
+            return False
+        headers = ()
+        if mock.error_status in (429, 503):
+            headers = (("Retry-After", "0"),)
+        self._reply(name, mock.error_status, {"error": "Injected error"}, headers)
+        return True
+
+    def _control(self, url):
+        """Answer the /_mock/ endpoints, True if it was one"""
+        if not url.path.startswith("/_mock/"):
+            return False
+        mock = self.server.mock
+        body = {}
+        if url.path == "/_mock/stats":
+            body = mock.stats()
+        elif url.path == "/_mock/reset":
+            mock.reset_counters()
+        elif url.path == "/_mock/touch":
+            count = int(parse_qs(url.query).get("count", ["1"])[0])
+            mock.dataset.touch_students(count)
+        raw = json.dumps(body).encode("utf-8")
+        self.send_response(200)
+        self.send_header("Content-Type", "application/json")
+        self.send_header("Content-Length", str(len(raw)))
+        self.end_headers()
+        self.wfile.write(raw)
+        return True
+
+    def do_GET(self):
+        url = urlsplit(self.path)
+        if self._control(url) or self._injected(url.path):
+            return
+        mock = self.server.mock
+        status, body = mock.get(url.path, parse_qs(url.query))
+        if status != 200:
+            self._reply(url.path, status, body)
+            return
+        static = isinstance(body, bytes)
+        if not static:
+            body = json.dumps(body).encode("utf-8")
+        etag = mock.etag(body, static)
+        if _matches(self.headers.get("If-None-Match"), etag):
+            self._not_modified(url.path, etag)
+            return
+        self._reply(url.path, status, body, (("ETag", etag),))
+
+    def do_POST(self):
+        url = urlsplit(self.path)
+        raw = self.rfile.read(int(self.headers.get("Content-Length") or 0))
+        if self._control(url) or self._injected(url.path):
+            return
+        if url.path != "/api/internal/graphql":
+            self._reply(url.path, 404, {"error": "Not found"})
+            return
+        try:
+            payload = json.loads(raw)
+        except ValueError:
+            self._reply(url.path, 400, {"errors": [{"message": "Invalid JSON"}]})
+            return
+        status, body = self.server.mock.graphql(payload)
+        name = payload.get("operationName") if isinstance(payload, dict) else "batch"
+        self._reply(name or url.path, status, body)
+
+
+def _matches(if_none_match, etag):
+    """True if an If-None-Match header lists `etag`, weakly compared"""
+    if not if_none_match:
+        return False
+    for tag in if_none_match.split(","):
+        tag = tag.strip()
+        if tag == "*" or tag.replace("W/", "", 1) == etag:
+            return True
+    return False
+
+
+def _serve(conn, scale, seed, options):
+    from benchmarks.fixtures import Dataset
+
+    dataset = Dataset(scale, seed)
+    # encode the big documents before the first request is timed
+    for kind in (None, "Topic", "Exercise", "Video"):
+        dataset.topictree(kind)
+    dataset.topictree_v2()
+    server = MockKhanServer(dataset, seed=seed, **options)
+    conn.send(server.url)
+    conn.close()
+    server.httpd.serve_forever()
+
+
+def serve_in_process(scale="small", seed=0, **options):
+    """
+    Start a MockKhanServer in a child process, so it does not compete with
+    the client for the GIL or show in its memory use.
+    Returns (process, url). Stop it with process.terminate().
+    """
+    parent, child = multiprocessing.Pipe()
+    process = multiprocessing.Process(
+        target=_serve, args=(child, scale, seed, options), daemon=True
+    )
+    process.start()
+    url = parent.recv()
+    return process, url
+
+
+def main(argv=None):
+    from benchmarks.fixtures import SCALES, Dataset
+
+    parser = argparse.ArgumentParser(description=__doc__.split("\n\n")[0])
+    parser.add_argument("--scale", choices=sorted(SCALES), default="small")
+    parser.add_argument("--seed", type=int, default=0)
+    parser.add_argument("--host", default="127.0.0.1")
+    parser.add_argument("--port", type=int, default=8000)
+    parser.add_argument("--latency", type=float, default=0.0)
+    parser.add_argument("--jitter", type=float, default=0.0)
+    parser.add_argument("--error-rate", type=float, default=0.0)
+    parser.add_argument("--error-status", type=int, default=503)
+    args = parser.parse_args(argv)
+    server = MockKhanServer(
+        Dataset(args.scale, args.seed),
+        latency=args.latency,
+        jitter=args.jitter,
+        error_rate=args.error_rate,
+        error_status=args.error_status,
+        seed=args.seed,
+        host=args.host,
+        port=args.port,
+    )
+    print("Serving the %s dataset on %s" % (args.scale, server.url))
+    try:
+        server.httpd.serve_forever()
+    except KeyboardInterrupt:
+        pass
+
+
+if __name__ == "__main__":
+    main()
@@ -0,0 +1,486 @@
+"""
+Offline benchmarks of the client against the mock server. Nothing leaves the
+machine and no credentials are needed:
+
+    python -m benchmarks.run --scale medium
+    python -m benchmarks.run --latency 0.02 --error-rate 0.02 --json after.json
+    python -m benchmarks.run --only rest_throughput --compare before.json
+
+Every benchmark runs `--repeat` times and reports the median of each metric.
+With --json the results are saved, and --compare prints the change of every
+metric against such a file.
+"""
+
+import argparse
+import asyncio
+import importlib.util
+import json
+import os
+import platform
+import statistics
+import subprocess
+import sys
+import tracemalloc
+from concurrent.futures import ThreadPoolExecutor
+from itertools import cycle, islice
+from time import perf_counter
+from urllib.request import Request, urlopen
+
+from benchmarks.fixtures import SCALES
+from benchmarks.mock_server import serve_in_process
+from khan_api_wrapper import codec
+from khan_api_wrapper.cache import ResponseCache
+from khan_api_wrapper.khan import KhanAPI
+from khan_api_wrapper.sync import ActivitySync, MemoryStateStore, RosterSync
+
+
+class Server:
+    """The mock server of a run, reached over its control endpoints"""
+
+    def __init__(self, url):
+        self.url = url
+
+    def _call(self, path, method="GET"):
+        request = Request(
+            self.url + path, method=method, data=b"" if method == "POST" else None
+        )
+        with urlopen(request) as response:
+            return json.loads(response.read())
+
+    def stats(self):
+        return self._call("/_mock/stats")
+
+    def reset(self):
+        self._call("/_mock/reset", "POST")
+
+    def touch(self, count):
+        self._call("/_mock/touch?count=%d" % count, "POST")
+
+
+def _client(server, args, **kwargs):
+    return KhanAPI(server_url=server.url, pool_maxsize=max(10, args.workers), **kwargs)
+
+
+def _latencies(summary):
+    """p50 / p99 of the total time of all calls, from a HistogramSummary"""
+    totals = [stats["phases"].get("total", {}) for stats in summary.summary().values()]
+    if not totals:
+        return {}
+    return {
+        "p50_ms": 1000 * max(t.get("p50") or 0 for t in totals),
+        "p99_ms": 1000 * max(t.get("p99") or 0 for t in totals),
+    }
+
+
+def _served(server, before):
+    after = server.stats()
+    return {
+        "server_requests": after["total_requests"] - before["total_requests"],
+        "injected_errors": after["errors"] - before["errors"],
+        "mb_received": (after["bytes_sent"] - before["bytes_sent"]) / 1e6,
+    }
+
+
+def bench_rest_throughput(server, args, kaids):
+    """get_student_progress from `workers` threads, one pooled session"""
+    api = _client(server, args)
+    summary = api.instrumentation.add_summary()
+    calls = list(islice(cycle(kaids), args.requests))
+    before = server.stats()
+    start = perf_counter()
+    with ThreadPoolExecutor(args.workers) as pool:
+        results = list(pool.map(api.get_student_progress, calls))
+    seconds = perf_counter() - start
+    api.close()
+    assert all("kaid" in r for r in results)
+    return {
+        "calls": len(calls),
+        "seconds": seconds,
+        "calls_per_s": len(calls) / seconds,
+        **_latencies(summary),
+        **_served(server, before),
+    }
+
+
+def bench_async_throughput(server, args, kaids):
+    """get_student_progress on AsyncKhanAPI, `workers` calls in flight"""
+    if importlib.util.find_spec("aiohttp") is None:
+        return None
+    from khan_api_wrapper.async_khan import AsyncKhanAPI
+
+    calls = list(islice(cycle(kaids), args.requests))
+
+    async def run():
+        async with AsyncKhanAPI(server_url=server.url, limit=args.workers) as api:
+            semaphore = asyncio.Semaphore(args.workers)
+
+            async def fetch(kaid):
+                async with semaphore:
+                    return await api.get_student_progress(kaid)
+
+            return await asyncio.gather(*(fetch(kaid) for kaid in calls))
+
+    before = server.stats()
+    start = perf_counter()
+    results = asyncio.run(run())
+    seconds = perf_counter() - start
+    assert all("kaid" in r for r in results)
+    return {
+        "calls": len(calls),
+        "seconds": seconds,
+        "calls_per_s": len(calls) / seconds,
+        **_served(server, before),
+    }
+
+
+def bench_graphql_throughput(server, args, assignment_ids):
+    """
+    simpleCompletionQuery for many assignments: one request per query from
+    `workers` threads, then merged into batches of 20
+    """
+    api = _client(server, args)
+    ids = list(islice(cycle(assignment_ids), args.requests))
+    before = server.stats()
+    start = perf_counter()
+    with ThreadPoolExecutor(args.workers) as pool:
+        single = list(pool.map(api.simple_completion_query, ids))
+    single_seconds = perf_counter() - start
+    single_served = _served(server, before)
+
+    before = server.stats()
+    start = perf_counter()
+    batched = api.simple_completion_queries(ids, max_batch_size=20)
+    batched_seconds = perf_counter() - start
+    batched_served = _served(server, before)
+    api.close()
+    assert len(single) == len(batched) == len(ids)
+    return {
+        "queries": len(ids),
+        "single_queries_per_s": len(ids) / single_seconds,
+        "single_requests": single_served["server_requests"],
+        "batched_queries_per_s": len(ids) / batched_seconds,
+        "batched_requests": batched_served["server_requests"],
+    }
+
+
+def _traced(fn):
+    """(result, seconds, peak MB allocated) of fn()"""
+    tracemalloc.start()
+    start = perf_counter()
+    try:
+        result = fn()
+        seconds = perf_counter() - start
+        peak = tracemalloc.get_traced_memory()[1] / 1e6
+    finally:
+        tracemalloc.stop()
+    return result, seconds, peak
+
+
+def bench_topictree_memory(server, args, _):
+    """
+    Time and peak memory of reading the exercises of the topic trees, whole
+    or streamed. Without ijson only streamed_v1 streams, with the pure python
+    parser, the other iterators walking the decoded body. tracemalloc slows
+    the calls down, so compare these times with each other only.
+    """
+    api = _client(server, args)
+    exercises = api.iter_all_exercise_names_and_titles
+    runs = {
+        "decoded_v1": lambda: len(api.topictree("Exercise")["children"]),
+        "walked_v1": lambda: sum(1 for _ in exercises()),
+        "streamed_v1": lambda: sum(1 for _ in exercises(fallback=True)),
+        "index_v1": lambda: len(api.get_topic_tree_index()),
+        "streamed_v2": lambda: sum(1 for _ in api.iter_exercises_v2()),
+    }
+    metrics = {}
+    before = server.stats()
+    for name, fn in runs.items():
+        _, seconds, peak = _traced(fn)
+        metrics[name + "_seconds"] = seconds
+        metrics[name + "_peak_mb"] = peak
+    metrics["mb_received"] = _served(server, before)["mb_received"]
+    api.close()
+    return metrics
+
+
+def bench_cache_revalidation(server, args, _):
+    """
+    The Exercise topic tree fetched again and again, without a cache and with
+    one revalidating it on every call (a ttl of 0), which the server answers
+    with a bodiless 304 since the tree does not change
+    """
+    calls = max(1, args.requests // 25)
+    clients = {
+        "uncached": _client(server, args),
+        "revalidated": _client(
+            server, args, cache=ResponseCache(ttls={"/api/v1/topictree": 0})
+        ),
+    }
+    metrics = {"calls": calls}
+    for name, api in clients.items():
+        before = server.stats()
+        start = perf_counter()
+        for _ in range(calls):
+            api.topictree("Exercise")
+        metrics[name + "_seconds"] = perf_counter() - start
+        after = server.stats()
+        metrics[name + "_mb_received"] = _served(server, before)["mb_received"]
+        metrics[name + "_not_modified"] = after["not_modified"] - before["not_modified"]
+        api.close()
+    return metrics
+
+
+def bench_sync_end_to_end(server, args, kaids, class_ids):
+    """
+    A nightly sync: the roster (full, then incremental after some students
+    were active), the progress changes of `--sync-students` students, and
+    the progress of every class through the rest and graphql sources
+    """
+    api = _client(server, args)
+    metrics = {}
+    before = server.stats()
+    start = perf_counter()
+
+    phase = perf_counter()
+    roster = RosterSync(api, MemoryStateStore(), coach="benchmark")
+    roster.sync(full=True)
+    metrics["roster_full_seconds"] = perf_counter() - phase
+    server.touch(max(1, len(kaids) // 20))
+    phase = perf_counter()
+    delta = roster.sync()
+    metrics["roster_incremental_seconds"] = perf_counter() - phase
+    metrics["roster_changed"] = len(delta.added) + len(delta.updated)
+
+    phase = perf_counter()
+    activity = ActivitySync(api, MemoryStateStore())
+    students = kaids[: args.sync_students]
+    metrics["progress_changes"] = activity.sync_progress_changes(
+        students, lambda kaid, change: None
+    )
+    metrics["activity_seconds"] = perf_counter() - phase
+
+    phase = perf_counter()
+    rest = sum(
+        1
+        for class_id in class_ids[:2]
+        for result in api.iter_class_progress(
+            source="rest", class_id=class_id, max_workers=args.workers
+        )
+        if result.ok
+    )
+    metrics["class_progress_rest_seconds"] = perf_counter() - phase
+    phase = perf_counter()
+    graphql = sum(
+        1
+        for class_id in class_ids
+        for result in api.iter_class_progress(source="graphql", class_id=class_id)
+        if result.ok
+    )
+    metrics["class_progress_graphql_seconds"] = perf_counter() - phase
+    metrics["students_progress"] = rest + graphql
+
+    metrics["total_seconds"] = perf_counter() - start
+    metrics.update(_served(server, before))
+    api.close()
+    return metrics
+
+
+# Run in a fresh interpreter by bench_import_time, printing its timings
+_COLD_START = """
+import sys, json
+from time import perf_counter
+before = set(sys.modules)
+start = perf_counter()
+import khan_api_wrapper.khan as khan
+imported = perf_counter()
+loaded = set(sys.modules) - before
+api = khan.KhanAPI(server_url=sys.argv[1])
+built = perf_counter()
+api.get_student_progress(sys.argv[2])
+called = perf_counter()
+print(json.dumps({
+    "import_ms": 1000 * (imported - start),
+    "construct_ms": 1000 * (built - imported),
+    "first_call_ms": 1000 * (called - built),
+    "modules_imported": len(loaded),
+    "heavy_modules_imported": len(loaded & set(sys.argv[3:])),
+}))
+"""
+
+# Modules a client only calling public endpoints should not pay for at import
+HEAVY_MODULES = (
+    "requests",
+    "rauth",
+    "urllib3",
+    "asyncio",
+    "sqlite3",
+    "orjson",
+    "concurrent.futures",
+    "khan_api_wrapper.graphql_schema",
+)
+
+
+def bench_import_time(server, args, kaids):
+    """
+    Cold start of a short lived process: importing khan_api_wrapper.khan,
+    creating a client and making one public call, each in a new interpreter
+    """
+    root = os.path.dirname(os.path.dirname(os.path.abspath(__file__)))
+    command = [sys.executable, "-c", _COLD_START, server.url, kaids[0]]
+    runs = []
+    for _ in range(5):
+        start = perf_counter()
+        output = subprocess.run(
+            command + list(HEAVY_MODULES),
+            cwd=root,
+            check=True,
+            capture_output=True,
+            text=True,
+        ).stdout
+        process_ms = 1000 * (perf_counter() - start)
+        runs.append({**json.loads(output), "process_ms": process_ms})
+    return _median(runs)
+
+
+BENCHMARKS = {
+    "import_time": bench_import_time,
+    "rest_throughput": bench_rest_throughput,
+    "async_throughput": bench_async_throughput,
+    "graphql_throughput": bench_graphql_throughput,
+    "topictree_memory": bench_topictree_memory,
+    "cache_revalidation": bench_cache_revalidation,
+    "sync_end_to_end": bench_sync_end_to_end,
+}
+
+
+def _median(runs):
+    return {
+        key: statistics.median(run[key] for run in runs)
+        for key in runs[0]
+        if all(isinstance(run.get(key), (int, float)) for run in runs)
+    }
+
+
+def _discover(server, args):
+    """The kaids, class ids and assignment ids the fixtures hold"""
+    api = _client(server, args)
+    students = list(api.iter_students(pageSize=1000, fields=["kaid"]))
+    lists = api.get_students_list(pageSize=1)["data"]["coach"]["studentLists"]
+    class_ids = [student_list["id"] for student_list in lists]
+    assignment_ids = [
+        assignment["id"]
+        for class_id in class_ids[:2]
+        for assignment in api.iter_progress_by_student(class_id, fields=["id"])
+    ]
+    api.close()
+    return [s["kaid"] for s in students], class_ids, assignment_ids
+
+
+def run(args):
+    process, url = serve_in_process(
+        args.scale,
+        args.seed,
+        latency=args.latency,
+        jitter=args.jitter,
+        error_rate=args.error_rate,
+        error_status=args.error_status,
+    )
+    server = Server(url)
+    results = {}
+    try:
+        kaids, class_ids, assignment_ids = _discover(server, args)
+        inputs = {
+            "import_time": (kaids,),
+            "rest_throughput": (kaids,),
+            "async_throughput": (kaids,),
+            "graphql_throughput": (assignment_ids,),
+            "topictree_memory": (None,),
+            "cache_revalidation": (None,),
+            "sync_end_to_end": (kaids, class_ids),
+        }
+        for name, bench in BENCHMARKS.items():
+            if args.only and name not in args.only:
+                continue
+            runs = []
+            for _ in range(args.repeat):
+                result = bench(server, args, *inputs[name])
+                if result is None:
+                    break
+                runs.append(result)
+            if runs:
+                results[name] = _median(runs)
+                print(_format(name, results[name], args.baseline), flush=True)
+            else:
+                print("%s: skipped, aiohttp is not installed\n" % name)
+    finally:
+        process.terminate()
+        process.join()
+    return results
+
+
+def _format(name, metrics, baseline=None):
+    lines = [name]
+    previous = (baseline or {}).get("results", {}).get(name, {})
+    for key, value in metrics.items():
+        line = "  %-34s %14.3f" % (key, value)
+        old = previous.get(key)
+        if isinstance(old, (int, float)) and old:
+            line += "  %+7.1f%%" % (100.0 * (value - old) / old)
+        lines.append(line)
+    return "\n".join(lines) + "\n"
+
+
+def main(argv=None):
+    parser = argparse.ArgumentParser(description=__doc__.split("\n\n")[0])
+    parser.add_argument("--scale", choices=sorted(SCALES), default="small")
+    parser.add_argument("--seed", type=int, default=0)
+    parser.add_argument("--only", nargs="+", choices=sorted(BENCHMARKS))
+    parser.add_argument("--repeat", type=int, default=3)
+    parser.add_argument(
+        "--requests", type=int, default=500, help="calls per throughput run"
+    )
+    parser.add_argument(
+        "--workers", type=int, default=8, help="threads or calls in flight"
+    )
+    parser.add_argument("--sync-students", type=int, default=100)
+    parser.add_argument(
+        "--latency", type=float, default=0.0, help="seconds per response"
+    )
+    parser.add_argument("--jitter", type=float, default=0.0)
+    parser.add_argument("--error-rate", type=float, default=0.0)
+    parser.add_argument("--error-status", type=int, default=503)
+    parser.add_argument(
+        "--codec", default="auto", help="json codec: auto, orjson or stdlib"
+    )
+    parser.add_argument("--json", help="save the results to this file")
+    parser.add_argument("--compare", help="results file of a previous run")
+    args = parser.parse_args(argv)
+    args.baseline = None
+    args.codec = codec.set_codec(args.codec).name
+    if args.compare:
+        with open(args.compare) as f:
+            args.baseline = json.load(f)
+
+    config = {
+        key: value
+        for key, value in vars(args).items()
+        if key not in ("json", "compare", "baseline")
+    }
+    print("Benchmarks, %s\n" % ", ".join("%s=%s" % item for item in config.items()))
+    results = run(args)
+    if args.json:
+        with open(args.json, "w") as f:
+            json.dump(
+                {
+                    "config": config,
+                    "python": sys.version.split()[0],
+                    "platform": platform.platform(),
+                    "results": results,
+                },
+                f,
+                indent=2,
+            )
+
+
+if __name__ == "__main__":
+    main()
@@ -0,0 +1,2 @@
+# Makes the repository root importable, so `pytest` runs the tests against
+# khan_api_wrapper and benchmarks without installing them.
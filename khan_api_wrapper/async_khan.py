@@ -0,0 +1,595 @@
+import asyncio
+import os
+from importlib.util import find_spec
+from datetime import datetime
+from time import perf_counter, time
+from khan_api_wrapper.khan import (
+    KhanAPI,
+    SERVER_URL,
+    _exercise_chunks,
+    _iter_chunks,
+    _merge_chunk_results,
+)
+from khan_api_wrapper import codec
+from khan_api_wrapper.cache import ResponseCache
+from khan_api_wrapper.streaming import (
+    has_ijson,
+    iter_events,
+    iter_items,
+    iter_tree_nodes,
+    iter_value_events,
+)
+from khan_api_wrapper.oauth import OAuth1Signer, flatten_params
+from khan_api_wrapper.graphql import (
+    get_operation,
+    persisted_query_error,
+    PERSISTED_QUERY_NOT_SUPPORTED,
+)
+from khan_api_wrapper.pagination import apaginate
+from khan_api_wrapper.batch import plan_batches
+from khan_api_wrapper.singleflight import AsyncSingleFlight, request_key
+from khan_api_wrapper.instrumentation import Instrumentation
+from khan_api_wrapper.progress import aiter_class_progress
+from khan_api_wrapper.topic_tree import TopicTree
+from khan_api_wrapper.scheduler import (
+    RequestScheduler,
+    endpoint_class,
+    GRAPHQL_QUERY,
+    GRAPHQL_MUTATION,
+)
+
+
+class _Response:
+    """The parts of an aiohttp response still needed once it is released"""
+
+    __slots__ = ("status_code", "headers", "content")
+
+    def __init__(self, status_code, headers, content):
+        self.status_code = status_code
+        self.headers = headers
+        self.content = content
+
+
+async def _timed_read(request, probe):
+    """Read a response, recording the phases of the attempt on the probe"""
+    probe.record.connect = None
+    started = perf_counter()
+    async with request as r:
+        headers_at = perf_counter()
+        content = await r.read()
+        probe.attempt(headers_at - started, perf_counter() - headers_at)
+        return _Response(r.status, r.headers, content)
+
+
+async def _connection_start(session, context, params):
+    if context.trace_request_ctx is not None:
+        context.connection_started = perf_counter()
+
+
+async def _connection_end(session, context, params):
+    probe = context.trace_request_ctx
+    if probe is not None:
+        probe.record.connect = perf_counter() - context.connection_started
+
+
+class AsyncKhanAPI:
+    """
+    asyncio version of KhanAPI. Every endpoint method of KhanAPI is available
+    here as a coroutine, and all requests share one pooled aiohttp session, so
+    many calls can be in flight at once:
+
+        async with AsyncKhanAPI(key, secret, token, token_secret) as kapi:
+            users = await asyncio.gather(*(kapi.user({"kaid": k}) for k in kaids))
+
+    Requires aiohttp, which can be installed with
+    `pip install khan_api_wrapper[async]`
+    """
+
+    def __init__(
+        self,
+        consumer_key=None,
+        consumer_secret=None,
+        access_token=None,
+        access_token_secret=None,
+        limit=100,
+        limit_per_host=30,
+        keepalive_timeout=15,
+        rate_limit=None,
+        scheduler=None,
+        cache=None,
+        cache_buster=False,
+        persisted_queries=False,
+        tokens=None,
+        coalesce=False,
+        instrumentation=None,
+        server_url=None,
+    ):
+        """
+        :param: limit, total number of simultaneous connections in the pool
+        :param: limit_per_host, simultaneous connections to the same host
+        :param: keepalive_timeout, seconds an idle connection is kept open
+        :param: rate_limit, most requests per second, or None for no limit
+        :param: scheduler, a RequestScheduler to use instead of the default one
+        :param: cache, a ResponseCache for the static catalog endpoints, or
+            True for an in memory one, see KhanAPI
+        :param: cache_buster, add the `_` timestamp param to graphql requests
+        :param: persisted_queries, send graphql queries by hash, see
+            KhanAPI.graphql
+        :param: tokens, a TokenManager handing out the access tokens, see
+            KhanAPI
+        :param: coalesce, let identical GET requests and GraphQL queries in
+            flight at the same time share one network call, see KhanAPI
+        :param: instrumentation, an Instrumentation to share between clients,
+            see KhanAPI
+        :param: server_url, where the api calls are sent
+        """
+        if find_spec("aiohttp") is None:
+            raise ImportError(
+                "AsyncKhanAPI requires aiohttp. Install it with `pip install khan_api_wrapper[async]`"
+            )
+        self.tokens = tokens
+        if tokens is not None:
+            access_token, access_token_secret = tokens.get()
+        self.authorized = False
+        if access_token and access_token_secret:
+            if consumer_key == None or consumer_secret == None:
+                raise ValueError(
+                    "consumer_key and consumer_secret must be provided if access tokens are provided"
+                )
+            self.signer = OAuth1Signer(
+                consumer_key, consumer_secret, access_token, access_token_secret
+            )
+            self.authorized = True
+        self.limit = limit
+        self.limit_per_host = limit_per_host
+        self.keepalive_timeout = keepalive_timeout
+        self.session = None
+        self.scheduler = scheduler or RequestScheduler(rate=rate_limit)
+        self.stats = self.scheduler.stats
+        self.cache = ResponseCache() if cache is True else cache or None
+        self.cache_buster = cache_buster
+        self.persisted_queries = persisted_queries
+        self.singleflight = (
+            AsyncSingleFlight() if coalesce is True else coalesce or None
+        )
+        # cached responses and coalesced requests are keyed on who asked
+        self.identity = access_token if self.authorized else None
+        if tokens is not None:
+            self.identity = tokens.key
+        self.instrumentation = instrumentation or Instrumentation()
+        self.server_url = server_url or SERVER_URL
+        self.get_resource = self.get
+
+    async def __aenter__(self):
+        return self
+
+    async def __aexit__(self, *exc_info):
+        await self.close()
+
+    def _get_session(self):
+        # The session has to be created inside the running event loop
+        if self.session is None or self.session.closed:
+            import aiohttp
+
+            connector = aiohttp.TCPConnector(
+                limit=self.limit,
+                limit_per_host=self.limit_per_host,
+                keepalive_timeout=self.keepalive_timeout,
+            )
+            # times new connections of the requests being instrumented
+            trace = aiohttp.TraceConfig()
+            trace.on_connection_create_start.append(_connection_start)
+            trace.on_connection_create_end.append(_connection_end)
+            self.session = aiohttp.ClientSession(
+                connector=connector, trace_configs=[trace]
+            )
+        return self.session
+
+    async def close(self):
+        """Close the pooled connections"""
+        if self.session is not None:
+            await self.session.close()
+            self.session = None
+
+    def _query(self, method, url, params):
+        if self.authorized:
+            return self.signer.sign(method, url, params)
+        return flatten_params(params)
+
+    async def _check_tokens(self):
+        if self.tokens is not None and self.tokens.needs_refresh():
+            # a refresh may log in, so it runs off the event loop
+            loop = asyncio.get_running_loop()
+            token, secret = await loop.run_in_executor(None, self.tokens.get)
+            self.signer.access_token = token
+            self.signer.access_token_secret = secret
+
+    async def _token_rejected(self):
+        """
+        True once new tokens are on the signer after a 401, see
+        TokenManager.rejected
+        """
+        if self.tokens is None or not self.authorized:
+            return False
+        loop = asyncio.get_running_loop()
+        token = self.signer.access_token
+        if not await loop.run_in_executor(None, self.tokens.rejected, token):
+            return False
+        token, secret = await loop.run_in_executor(None, self.tokens.get)
+        self.signer.access_token = token
+        self.signer.access_token_secret = secret
+        return True
+
+    async def _request(self, request_class, method, url, params, decode=True, **kwargs):
+        """
+        The decoded response, or its raw body if not `decode`. GET requests
+        of the urls given a ttl go through the cache, see KhanAPI.get.
+        """
+        probe = self.instrumentation.probe(method, url, kwargs.get("data"))
+        if probe is None:
+            return await self._send(
+                request_class, method, url, params, None, decode, kwargs
+            )
+        with probe:
+            return await self._send(
+                request_class, method, url, params, probe, decode, kwargs
+            )
+
+    async def _send(self, request_class, method, url, params, probe, decode, kwargs):
+        await self._check_tokens()
+        ttl = None
+        if method == "GET" and self.cache is not None:
+            ttl = self.cache.ttl(url)
+        if ttl is not None:
+            key = self.cache.key(url, params, self.identity)
+            entry, fresh = self.cache.lookup(key)
+            if fresh:
+                if probe is not None:
+                    probe.record.cache = "hit"
+                return self._read_body(entry["body"], probe, decode)
+            # revalidated with a conditional request, see KhanAPI._fetch
+            headers = self.cache.conditional_headers(entry)
+            if headers:
+                kwargs = {**kwargs, "headers": headers}
+        url = self.server_url + url
+        session = self._get_session()
+
+        async def send():
+            # both attempts are timed when the tokens are renewed after a 401
+            response = await attempt()
+            if response.status_code == 401 and await self._token_rejected():
+                response = await attempt()
+            return response
+
+        async def send_signed():
+            # signed again on every attempt so each retry has a fresh nonce
+            query = self._query(method, url, params)
+            if probe is not None:
+                return await _timed_read(
+                    session.request(
+                        method, url, params=query, trace_request_ctx=probe, **kwargs
+                    ),
+                    probe,
+                )
+            async with session.request(method, url, params=query, **kwargs) as r:
+                return _Response(r.status, r.headers, await r.read())
+
+        attempt = send_signed if probe is None else probe.wrap_async(send_signed)
+        response = await self.scheduler.send_async(request_class, send)
+        if probe is not None:
+            probe.received(response, len(response.content))
+            if ttl is not None:
+                probe.record.cache = "miss"
+        if ttl is not None and response.status_code == 304 and entry is not None:
+            self.cache.revalidated(key, entry, ttl, response.headers)
+            if probe is not None:
+                probe.record.cache = "revalidated"
+            return self._read_body(entry["body"], probe, decode)
+        if not decode:
+            data = response.content
+        else:
+            data = self._read_json(response)
+            if probe is not None:
+                probe.decoded()
+        if ttl is not None and response.status_code == 200:
+            self.cache.set(key, response.content, ttl, response.headers)
+        return data
+
+    def _read_body(self, body, probe, decode):
+        """A cached body, decoded if asked to"""
+        if not decode:
+            return body
+        data = codec.loads(body)
+        if probe is not None:
+            probe.decoded()
+        return data
+
+    def _read_json(self, response):
+        try:
+            return codec.loads(response.content)
+        except ValueError:
+            # Same handling as KhanAPI: a server error is handed back to the
+            # programmer, anything else is printed for debugging.
+            if response.status_code == 500:
+                print("500 error receieved. You should do something with it!")
+                return {"error": 500}
+            print("#" * 50)
+            print("Status Code: ", response.status_code)
+            print("Content-Type: ", response.headers.get("content-type"))
+            print("Text:")
+            print(response.content.decode("utf-8", "replace"))
+            print("#" * 50)
+            raise
+
+    async def get(self, url, params={}):
+        send = lambda: self._request(endpoint_class(url), "GET", url, params)
+        if self.singleflight is not None:
+            key = request_key("GET", url, params, identity=self.identity)
+            return await self.singleflight.do(key, send)
+        return await send()
+
+    async def post(self, url, params, data, headers=None, request_class=None):
+        return await self._request(
+            request_class or endpoint_class(url),
+            "POST",
+            url,
+            params,
+            data=data,
+            headers=headers,
+        )
+
+    async def post_graphql(self, params={}, data={}, mutation=False):
+        """
+        Retrieve resources using the graphql schema
+        """
+        headers = {"content-type": "application/json"}
+        request_class = GRAPHQL_MUTATION if mutation else GRAPHQL_QUERY
+        url = "/api/internal/graphql"
+        send = lambda: self.post(url, params, data, headers, request_class)
+        if self.singleflight is not None and not mutation:
+            key = request_key("POST", url, params, data, self.identity)
+            return await self.singleflight.do(key, send)
+        return await send()
+
+    async def graphql(self, operation, variables, opname=False):
+        """
+        Send a GraphQL operation, see KhanAPI.graphql
+        """
+        op = get_operation(operation)
+        params = self._graphql_params(op.name if opname else None)
+        if not self.persisted_queries:
+            return await self.post_graphql(
+                params, op.payload(variables), op.is_mutation
+            )
+
+        response = await self.post_graphql(
+            params, op.payload(variables, "hash"), op.is_mutation
+        )
+        error = persisted_query_error(response)
+        if error is None:
+            return response
+        if error == PERSISTED_QUERY_NOT_SUPPORTED:
+            self.persisted_queries = False
+            return await self.post_graphql(
+                params, op.payload(variables), op.is_mutation
+            )
+        return await self.post_graphql(
+            params, op.payload(variables, "register"), op.is_mutation
+        )
+
+    async def graphql_batch(self, requests, max_batch_size=20, mode="alias"):
+        """
+        Send many GraphQL operations in batched requests, see
+        KhanAPI.graphql_batch. The batches are sent concurrently.
+        """
+
+        async def send(chunk):
+            if mode == "alias":
+                response = await self.graphql(chunk.operation, chunk.merged_variables())
+            else:
+                response = await self.post_graphql(
+                    self._graphql_params(), chunk.payload(), chunk.is_mutation
+                )
+            return chunk.split(response)
+
+        chunks = list(plan_batches(requests, max_batch_size, mode))
+        if any(chunk.is_mutation for chunk in chunks):
+            # mutations keep the order they were given in
+            split = [await send(chunk) for chunk in chunks]
+        else:
+            split = await asyncio.gather(*(send(chunk) for chunk in chunks))
+        return [response for responses in split for response in responses]
+
+    # Paged queries yield async generators, used as
+    #   async for student in kapi.iter_students(): ...
+    _paginate = staticmethod(apaginate)
+
+    # Methods that need to work with the response before returning it
+
+    async def get_student_list(self, params={}):
+        params = {
+            "dt_start": "1970-01-01T00:00:00.000Z",
+            "dt_end": datetime.utcnow().replace(microsecond=0).isoformat() + "Z",
+            **params,
+        }
+
+        r = await self.get_resource("/api/internal/user/students/progress", params)
+        return r["students"]
+
+    async def get_student_progress(self, kaid, params={}):
+        endpoint = "/api/internal/user/{}/progress".format(kaid)
+        response = await self.get_resource(endpoint, params)
+        if "students" in response:
+            return response["students"][0]
+        return response
+
+    def iter_class_progress(
+        self,
+        kaids=None,
+        class_id=None,
+        source="rest",
+        max_workers=8,
+        params=None,
+        graphql_threshold=30,
+        **graphql_kwargs
+    ):
+        """
+        Async generator version of KhanAPI.iter_class_progress:
+            async for result in kapi.iter_class_progress(class_id=class_id): ...
+        """
+        return aiter_class_progress(
+            self,
+            kaids,
+            class_id,
+            source,
+            max_workers,
+            params,
+            graphql_threshold,
+            **graphql_kwargs,
+        )
+
+    async def get_many_exercises(self, exercises, kaid):
+        """
+        Same as KhanAPI.get_many_exercises, but the chunks are fetched
+        concurrently on the event loop.
+        """
+        url = "/api/v1/user/exercises"
+        chunks = list(_exercise_chunks(exercises))
+        results = await asyncio.gather(
+            *(
+                self.get_resource(url, {"exercises": ",".join(chunk), "kaid": kaid})
+                for chunk in chunks
+            ),
+            return_exceptions=True,
+        )
+        return _merge_chunk_results(chunks, results)
+
+    # Topic tree readers. The body is downloaded without blocking the event
+    # loop, then parsed while the nodes are read, so the decoded tree is never
+    # held as a whole.
+
+    async def stream(self, url, params={}, chunk_size=65536):
+        """
+        Async generator of the JSON parse events of a response body, see
+        KhanAPI.stream. The raw body is downloaded first, then parsed as the
+        events are read.
+        """
+        body = await self._request(endpoint_class(url), "GET", url, params, False)
+        for event in iter_events(_iter_chunks(body, chunk_size)):
+            yield event
+
+    async def _tree_events(self, url, params={}, fallback=False):
+        """The parse events of a large response, see KhanAPI._tree_events"""
+        if fallback or has_ijson():
+            body = await self._request(endpoint_class(url), "GET", url, params, False)
+            return iter_events(_iter_chunks(body, 65536))
+        return iter_value_events(await self.get(url, params))
+
+    async def iter_topictree(self, kind=None, fallback=False):
+        """
+        Async generator version of KhanAPI.iter_topictree:
+            async for node in kapi.iter_topictree("Exercise"): ...
+        """
+        events = await self._tree_events("/api/v1/topictree", {"kind": kind}, fallback)
+        for node in iter_tree_nodes(events):
+            yield node
+
+    async def get_topic_tree_index(
+        self, kind="Exercise", path=None, max_age=None, fallback=False
+    ):
+        """Same as KhanAPI.get_topic_tree_index"""
+        if path and os.path.exists(path):
+            if max_age is None or time() - os.path.getmtime(path) < max_age:
+                return TopicTree.load(path)
+        events = await self._tree_events("/api/v1/topictree", {"kind": kind}, fallback)
+        tree = TopicTree.from_depth_nodes(iter_tree_nodes(events, with_depth=True))
+        if path:
+            tree.save(path)
+        return tree
+
+    async def iter_all_exercise_names_and_titles(self, fallback=False):
+        """Async generator version of KhanAPI.iter_all_exercise_names_and_titles"""
+        seen = set()
+        async for node in self.iter_topictree("Exercise", fallback):
+            if node.get("kind") == "Exercise" and node["id"] not in seen:
+                seen.add(node["id"])
+                yield {"name": node["name"], "title": node["title"]}
+
+    async def get_all_exercise_names_and_titles(self):
+        return [
+            exercise async for exercise in self.iter_all_exercise_names_and_titles()
+        ]
+
+    async def get_all_exercise_names_and_titles_v2(self):
+        tree = await self.get_resource("/api/v2/topics/topictree")
+        return tree["exercises"]
+
+    async def iter_exercises_v2(self, fallback=False):
+        """Async generator version of KhanAPI.iter_exercises_v2"""
+        endpoint = "/api/v2/topics/topictree"
+        events = await self._tree_events(endpoint, fallback=fallback)
+        for exercise in iter_items(events, "exercises.item"):
+            yield exercise
+
+    async def iter_topics_v2(self, fallback=False):
+        """Async generator version of KhanAPI.iter_topics_v2"""
+        endpoint = "/api/v2/topics/topictree"
+        events = await self._tree_events(endpoint, fallback=fallback)
+        for topic in iter_items(events, "topics.item"):
+            yield topic
+
+
+# These KhanAPI methods only build a request and return the result of
+# get_resource or post_graphql, so on this class they return the coroutine of
+# the async transport unchanged and can be shared as is.
+_PASSTHROUGH_METHODS = (
+    "_graphql_params",
+    "badges",
+    "badges_categories",
+    "badges_categories_category",
+    "exercises",
+    "exercises_exercise_name",
+    "exercises_exercise_followup_exercises",
+    "exercises_exercise_videos",
+    "exercises_perseus_autocomplete",
+    "playlists_exercises",
+    "playlists_videos",
+    "topic",
+    "topic_exercises",
+    "topic_videos",
+    "topictree",
+    "user",
+    "user_exercises",
+    "user_exercises_name",
+    "user_exercises_followup_exercises",
+    "user_exercises_log",
+    "user_exercises_progress_changes",
+    "user_progress_summary",
+    "user_students",
+    "get_mission",
+    "get_progress_info",
+    "get_missions",
+    "get_all_math_exercises",
+    "roster_sync",
+    "activity_sync",
+    "join_class",
+    "simple_completion_query",
+    "simple_completion_queries",
+    "batch",
+    "get_students_list",
+    "get_progress_by_student",
+    "auto_assignable_students",
+    "coach_assignments",
+    "quiz_unit_test_attempts_query",
+    "iter_students",
+    "iter_progress_by_student",
+    "iter_coach_assignments",
+    "stop_coaching",
+    "transfer_students",
+    "update_auto_assign",
+    "bulk_roster",
+    "publish_assignment",
+)
+
+for _name in _PASSTHROUGH_METHODS:
+    setattr(AsyncKhanAPI, _name, getattr(KhanAPI, _name))
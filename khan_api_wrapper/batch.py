@@ -0,0 +1,159 @@
+"""
+Batching of GraphQL operations, so that many small queries (for example one
+simpleCompletionQuery per assignment of a gradebook) cost one round trip per
+batch instead of one each.
+
+Two ways of batching are supported:
+    "alias", the operations are merged into a single document, with their
+        top level fields aliased and their variables renamed. Works with any
+        GraphQL server, and with persisted queries.
+    "array", the payloads are sent as a JSON array and the server answers
+        with an array of responses. Only for servers that accept it.
+"""
+
+from functools import lru_cache
+from khan_api_wrapper.graphql import (
+    get_operation,
+    merge_operations,
+    merged_variables,
+    split_merged_response,
+)
+
+MODES = ("alias", "array")
+
+
+@lru_cache(maxsize=64)
+def _merged(operations):
+    # the merged document only depends on the sequence of operations, so it is
+    # generated (and hashed) once for every recurring shape of batch
+    return merge_operations(operations)
+
+
+class BatchRequest:
+    """One chunk of a batch, ready to be sent"""
+
+    def __init__(self, operations, variables, mode):
+        self.operations = operations
+        self.variables = variables
+        self.mode = mode
+        self.is_mutation = operations[0].is_mutation
+
+    @property
+    def operation(self):
+        """The merged Operation to send in "alias" mode"""
+        return _merged(tuple(self.operations))
+
+    def merged_variables(self):
+        """The variables of the merged Operation, see merged_variables"""
+        return merged_variables(
+            [
+                op.used_variables(variables)
+                for op, variables in zip(self.operations, self.variables)
+            ]
+        )
+
+    def payload(self):
+        """The request body in "array" mode"""
+        return "[%s]" % ",".join(
+            op.payload(variables)
+            for op, variables in zip(self.operations, self.variables)
+        )
+
+    def split(self, response):
+        """Return one response per operation of the chunk"""
+        if self.mode == "alias":
+            return split_merged_response(response, len(self.operations))
+        if isinstance(response, list) and len(response) == len(self.operations):
+            return response
+        # a single error answering the whole array
+        return [response] * len(self.operations)
+
+
+def plan_batches(requests, max_batch_size=20, mode="alias"):
+    """
+    Split (operation, variables) requests into chunks of at most
+    `max_batch_size` operations. Queries and mutations are never mixed in a
+    chunk, and the order of the requests is kept.
+    """
+    if mode not in MODES:
+        raise ValueError("Unknown batch mode %r, use one of %s" % (mode, MODES))
+    if max_batch_size < 1:
+        raise ValueError("max_batch_size must be at least 1")
+    operations = []
+    variables = []
+    for operation, op_variables in requests:
+        op = get_operation(operation)
+        if operations and (
+            len(operations) == max_batch_size
+            or op.is_mutation != operations[0].is_mutation
+        ):
+            yield BatchRequest(operations, variables, mode)
+            operations, variables = [], []
+        operations.append(op)
+        variables.append(op_variables)
+    if operations:
+        yield BatchRequest(operations, variables, mode)
+
+
+class GraphQLBatch:
+    """
+    Collects GraphQL operations and sends them in as few requests as
+    possible. Create it with KhanAPI.batch():
+
+        with kapi.batch() as batch:
+            for assignment_id in assignment_ids:
+                batch.add("simpleCompletionQuery", {"assignmentId": assignment_id})
+        responses = batch.results
+
+    Each response is shaped as if the operation had been sent on its own.
+    With AsyncKhanAPI use `async with` or `await batch.execute_async()`.
+    """
+
+    def __init__(self, client, max_batch_size=20, mode="alias"):
+        self.client = client
+        self.max_batch_size = max_batch_size
+        self.mode = mode
+        self.requests = []
+        self.results = None
+
+    def __len__(self):
+        return len(self.requests)
+
+    def add(self, operation, variables):
+        """
+        Queue an operation, returning its position in the results
+        :param: operation, operation name or Operation
+        :param: variables, dict of the operation variables
+        """
+        self.requests.append((get_operation(operation), variables))
+        return len(self.requests) - 1
+
+    def execute(self):
+        """Send the queued operations and return their responses, in order"""
+        self.results = self.client.graphql_batch(
+            self.requests, self.max_batch_size, self.mode
+        )
+        self.requests = []
+        return self.results
+
+    async def execute_async(self):
+        """execute for AsyncKhanAPI"""
+        self.results = await self.client.graphql_batch(
+            self.requests, self.max_batch_size, self.mode
+        )
+        self.requests = []
+        return self.results
+
+    def __enter__(self):
+        return self
+
+    def __exit__(self, exc_type, *exc_info):
+        if exc_type is None:
+            self.execute()
+
+    async def __aenter__(self):
+        return self
+
+    async def __aexit__(self, exc_type, *exc_info):
+        if exc_type is None:
+            await self.execute_async()
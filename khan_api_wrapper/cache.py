@@ -0,0 +1,260 @@
+import hashlib
+import json
+import os
+import threading
+from collections import OrderedDict
+from time import time
+from khan_api_wrapper.oauth import flatten_params
+
+HOUR = 3600
+DAY = 24 * HOUR
+
+# Url prefix -> seconds a response stays fresh. Only urls matching one of these
+# prefixes are cached, so per user endpoints (/api/v1/user...,
+# /api/internal/user...) are never cached unless asked for explicitly.
+DEFAULT_TTLS = {
+    "/api/v1/topictree": DAY,
+    "/api/v2/topics/topictree": DAY,
+    "/api/internal/exercises/math_topics_and_exercises": DAY,
+    "/api/v1/badges/categories": DAY,
+    "/api/v1/exercises/": DAY,
+    "/api/v1/playlists/": 6 * HOUR,
+    "/api/v1/topic/": 6 * HOUR,
+}
+
+
+class CacheStats:
+    """
+    Counters of a ResponseCache. `revalidations` counts stale entries that
+    the server confirmed unchanged with a 304, which are also counted as
+    misses.
+    """
+
+    def __init__(self):
+        self.lock = threading.Lock()
+        self.hits = 0
+        self.misses = 0
+        self.stores = 0
+        self.revalidations = 0
+
+    def record(self, hits=0, misses=0, stores=0, revalidations=0):
+        with self.lock:
+            self.hits += hits
+            self.misses += misses
+            self.stores += stores
+            self.revalidations += revalidations
+
+    @property
+    def hit_ratio(self):
+        lookups = self.hits + self.misses
+        return self.hits / lookups if lookups else 0.0
+
+    def snapshot(self):
+        with self.lock:
+            return {
+                "hits": self.hits,
+                "misses": self.misses,
+                "stores": self.stores,
+                "revalidations": self.revalidations,
+            }
+
+
+class MemoryCache:
+    """
+    Thread safe in memory LRU backend.
+    :param: maxsize, most entries kept
+    :param: max_bytes, optional bound on the total size of the stored bodies
+    """
+
+    def __init__(self, maxsize=128, max_bytes=None):
+        self.maxsize = maxsize
+        self.max_bytes = max_bytes
+        self.entries = OrderedDict()
+        self.size = 0
+        self.lock = threading.Lock()
+
+    def get(self, key):
+        with self.lock:
+            entry = self.entries.get(key)
+            if entry is not None:
+                self.entries.move_to_end(key)
+            return entry
+
+    def set(self, key, entry):
+        with self.lock:
+            old = self.entries.pop(key, None)
+            if old is not None:
+                self.size -= len(old["body"])
+            self.entries[key] = entry
+            self.size += len(entry["body"])
+            while len(self.entries) > self.maxsize or (
+                self.max_bytes is not None
+                and self.size > self.max_bytes
+                and len(self.entries) > 1
+            ):
+                _, evicted = self.entries.popitem(last=False)
+                self.size -= len(evicted["body"])
+
+    def delete(self, key):
+        with self.lock:
+            entry = self.entries.pop(key, None)
+            if entry is not None:
+                self.size -= len(entry["body"])
+
+    def clear(self):
+        with self.lock:
+            self.entries.clear()
+            self.size = 0
+
+
+class DiskCache:
+    """
+    On disk backend storing one file per entry in `directory`: a json header
+    line followed by the raw response body. Safe to share between processes,
+    as entries are written to a temporary file and renamed into place.
+    :param: max_entries, optional bound on the number of files, the least
+        recently written ones are removed first
+    """
+
+    def __init__(self, directory, max_entries=None):
+        self.directory = directory
+        self.max_entries = max_entries
+        os.makedirs(directory, exist_ok=True)
+
+    def _path(self, key):
+        return os.path.join(self.directory, key + ".cache")
+
+    def get(self, key):
+        try:
+            with open(self._path(key), "rb") as f:
+                header = json.loads(f.readline())
+                header["body"] = f.read()
+        except (OSError, ValueError):
+            return None
+        return header
+
+    def set(self, key, entry):
+        header = {k: v for k, v in entry.items() if k != "body"}
+        path = self._path(key)
+        tmp = "%s.%d.%d.tmp" % (path, os.getpid(), threading.get_ident())
+        with open(tmp, "wb") as f:
+            f.write(json.dumps(header).encode("utf-8") + b"\n")
+            f.write(entry["body"])
+        os.replace(tmp, path)
+        if self.max_entries is not None:
+            self._prune()
+
+    def _prune(self):
+        files = [
+            os.path.join(self.directory, name)
+            for name in os.listdir(self.directory)
+            if name.endswith(".cache")
+        ]
+        if len(files) <= self.max_entries:
+            return
+        files.sort(key=lambda path: os.stat(path).st_mtime)
+        for path in files[: len(files) - self.max_entries]:
+            try:
+                os.remove(path)
+            except OSError:
+                pass
+
+    def delete(self, key):
+        try:
+            os.remove(self._path(key))
+        except OSError:
+            pass
+
+    def clear(self):
+        for name in os.listdir(self.directory):
+            if name.endswith(".cache"):
+                self.delete(name[: -len(".cache")])
+
+
+class ResponseCache:
+    """
+    Caches the raw bodies of GET responses for the urls given a ttl. Entries
+    are keyed on the identity making the call as well as the url and params,
+    so data fetched by one user is never served to another.
+    :param: backend, MemoryCache (the default), DiskCache or any object with
+        the same get/set/delete/clear methods
+    :param: ttls, dict of url prefix -> seconds, merged over DEFAULT_TTLS. Use
+        a ttl of None to stop caching a prefix, or 0 to keep the response but
+        revalidate it with the server on every call
+    """
+
+    def __init__(self, backend=None, ttls=None):
+        self.backend = backend if backend is not None else MemoryCache()
+        self.ttls = {**DEFAULT_TTLS, **(ttls or {})}
+        # longest prefixes first, so the most specific ttl wins
+        self.prefixes = sorted(self.ttls, key=len, reverse=True)
+        self.stats = CacheStats()
+
+    def ttl(self, url):
+        """Seconds a response from `url` stays fresh, or None to not cache"""
+        for prefix in self.prefixes:
+            if url.startswith(prefix):
+                return self.ttls[prefix]
+        return None
+
+    def key(self, url, params, identity=None):
+        # the `_` cache busting timestamp would make every key unique
+        params = [(k, v) for k, v in flatten_params(params) if k != "_"]
+        raw = json.dumps([identity, url, sorted(params)])
+        return hashlib.sha256(raw.encode("utf-8")).hexdigest()
+
+    def lookup(self, key):
+        """
+        Return (entry, fresh). A stale entry is still returned so it can be
+        revalidated with conditional_headers.
+        """
+        entry = self.backend.get(key)
+        fresh = entry is not None and entry["expires"] > time()
+        self.stats.record(hits=int(fresh), misses=int(not fresh))
+        return entry, fresh
+
+    def get(self, key):
+        """Return the stored entry if it is still fresh, otherwise None"""
+        entry, fresh = self.lookup(key)
+        return entry if fresh else None
+
+    def conditional_headers(self, entry):
+        """Headers asking the server to only send the body if it changed"""
+        headers = {}
+        if entry is not None:
+            if entry.get("etag"):
+                headers["If-None-Match"] = entry["etag"]
+            if entry.get("last_modified"):
+                headers["If-Modified-Since"] = entry["last_modified"]
+        return headers or None
+
+    def set(self, key, body, ttl, headers=None):
+        """
+        Store a response body along with the validators found in its headers
+        """
+        headers = headers or {}
+        self.backend.set(
+            key,
+            {
+                "body": body,
+                "expires": time() + ttl,
+                "etag": headers.get("ETag"),
+                "last_modified": headers.get("Last-Modified"),
+            },
+        )
+        self.stats.record(stores=1)
+
+    def revalidated(self, key, entry, ttl, headers=None):
+        """Mark a stale entry fresh again after the server answered 304"""
+        headers = headers or {}
+        entry = {
+            **entry,
+            "expires": time() + ttl,
+            "etag": headers.get("ETag") or entry.get("etag"),
+            "last_modified": headers.get("Last-Modified") or entry.get("last_modified"),
+        }
+        self.backend.set(key, entry)
+        self.stats.record(revalidations=1)
+
+    def clear(self):
+        self.backend.clear()
@@ -0,0 +1,96 @@
+"""
+The JSON codec shared by every request body and response of KhanAPI and
+AsyncKhanAPI, and by the GraphQL payloads of khan_api_wrapper.graphql.
+orjson is used when it is installed (`pip install khan_api_wrapper[fast]`),
+the standard library json module otherwise. Responses are decoded from the
+raw bytes of the body, orjson doing so without an intermediate text copy.
+
+    from khan_api_wrapper import codec
+    codec.set_codec("stdlib")  # "orjson", "auto", or an object like StdlibCodec
+"""
+
+import json
+
+
+class StdlibCodec:
+    """The json module of the standard library"""
+
+    name = "stdlib"
+
+    def loads(self, data):
+        # json.loads takes bytes, detecting their utf-8, -16 or -32 encoding
+        return json.loads(data)
+
+    def dumps(self, obj):
+        return json.dumps(obj)
+
+
+class OrjsonCodec:
+    """
+    orjson, several times faster than the standard library both ways. Raises
+    ImportError if orjson is not installed.
+    """
+
+    name = "orjson"
+
+    def __init__(self):
+        import orjson
+
+        self._loads = orjson.loads
+        self._dumps = orjson.dumps
+        # json.dumps turns int keys into strings, orjson refuses them otherwise
+        self._options = orjson.OPT_NON_STR_KEYS
+
+    def loads(self, data):
+        return self._loads(data)
+
+    def dumps(self, obj):
+        return self._dumps(obj, option=self._options).decode("utf-8")
+
+
+CODECS = {"stdlib": StdlibCodec, "orjson": OrjsonCodec}
+
+
+def _best():
+    try:
+        return OrjsonCodec()
+    except ImportError:
+        return StdlibCodec()
+
+
+# chosen on first use, importing orjson only when something is decoded
+_codec = None
+
+
+def set_codec(codec):
+    """
+    Change the codec used everywhere.
+    :param: codec, "auto" for orjson if installed, "orjson", "stdlib", or any
+        object with loads(bytes or str) and dumps(obj) returning a str
+    Returns the codec now in use.
+    """
+    global _codec
+    if codec == "auto":
+        codec = _best()
+    elif isinstance(codec, str):
+        codec = CODECS[codec]()
+    _codec = codec
+    return codec
+
+
+def get_codec():
+    """The codec in use"""
+    global _codec
+    if _codec is None:
+        _codec = _best()
+    return _codec
+
+
+def loads(data):
+    """Decode a JSON document, given as bytes (preferably) or str"""
+    return (_codec or get_codec()).loads(data)
+
+
+def dumps(obj):
+    """Encode obj as a JSON str"""
+    return (_codec or get_codec()).dumps(obj)
@@ -0,0 +1,411 @@
+"""
+Columnar tables of the results analysed in bulk: assignment completion
+(simple_completion_query, get_progress_by_student / iter_progress_by_student)
+and user exercise rows (user_exercises, get_many_exercises). Each value is
+appended straight to the column it belongs to, with no dict per row:
+
+- ids (kaids, exercise names, assignment ids, states) are dictionary
+  encoded, as int32 codes into a list of the distinct values
+- counts and flags are float64, NaN when missing
+- dates are int64 milliseconds since the epoch, UTC, with numpy's NaT value
+  when missing
+
+The tables convert to NumPy arrays, to pyarrow (dictionary arrays for the
+ids) and to pandas (categoricals), each imported only when used
+(`pip install khan_api_wrapper[columnar]` for numpy and pyarrow). Large
+exports are written chunk by chunk, never holding the whole result:
+
+    tables = columnar.iter_progress_tables(kapi.iter_progress_by_student(class_id))
+    columnar.write_parquet(tables, "progress.parquet")
+    columnar.write_csv(columnar.iter_user_exercise_tables(rows), "exercises.csv")
+
+The records of khan_api_wrapper.models are accepted wherever dicts are.
+"""
+
+import csv
+from array import array
+from datetime import datetime, timezone
+from itertools import islice
+from khan_api_wrapper.graphql import dig
+
+# numpy's NaT, the int64 minimum
+NAT = -(2**63)
+NAN = float("nan")
+EPOCH = datetime(1970, 1, 1, tzinfo=timezone.utc)
+
+DICTIONARY = "dictionary"
+NUMBER = "number"
+BOOLEAN = "boolean"
+DATE = "date"
+TEXT = "text"
+
+
+def epoch_ms(value):
+    """
+    Milliseconds since the epoch of an api timestamp ("2019-01-08T06:59:59Z")
+    or datetime, NAT for None or anything else
+    """
+    if value.__class__ is str:
+        try:
+            value = datetime.fromisoformat(value.replace("Z", "+00:00"))
+        except ValueError:
+            return NAT
+    if not isinstance(value, datetime):
+        return NAT
+    if value.tzinfo is None:
+        value = value.replace(tzinfo=timezone.utc)
+    delta = value - EPOCH
+    return (delta.days * 86400 + delta.seconds) * 1000 + delta.microseconds // 1000
+
+
+def format_ms(value):
+    """The api timestamp of epoch milliseconds, None for NAT"""
+    if value == NAT:
+        return None
+    seconds, ms = divmod(value, 1000)
+    text = datetime.fromtimestamp(seconds, timezone.utc).strftime("%Y-%m-%dT%H:%M:%S")
+    return text + (".%03dZ" % ms if ms else "Z")
+
+
+class Column:
+    """The values of one field, stored according to its kind"""
+
+    __slots__ = ("name", "kind", "data", "categories", "_codes")
+
+    def __init__(self, name, kind):
+        self.name = name
+        self.kind = kind
+        self.categories = None
+        if kind == DICTIONARY:
+            self.data = array("i")
+            self.categories = []
+            self._codes = {}
+        elif kind in (NUMBER, BOOLEAN):
+            self.data = array("d")
+        elif kind == DATE:
+            self.data = array("q")
+        elif kind == TEXT:
+            self.data = []
+        else:
+            raise ValueError("Unknown column kind %r" % kind)
+
+    def __len__(self):
+        return len(self.data)
+
+    def append(self, value):
+        kind = self.kind
+        if kind == DICTIONARY:
+            if value is None:
+                self.data.append(-1)
+                return
+            code = self._codes.get(value)
+            if code is None:
+                code = self._codes[value] = len(self.categories)
+                self.categories.append(value)
+            self.data.append(code)
+        elif kind == DATE:
+            self.data.append(epoch_ms(value))
+        elif kind == TEXT:
+            self.data.append(value)
+        else:
+            self.data.append(NAN if value is None else float(value))
+
+    def values(self):
+        """The column as a list of python values, None for missing ones"""
+        kind = self.kind
+        if kind == DICTIONARY:
+            categories = self.categories
+            return [categories[code] if code >= 0 else None for code in self.data]
+        if kind == DATE:
+            return [format_ms(value) for value in self.data]
+        if kind == TEXT:
+            return list(self.data)
+        if kind == BOOLEAN:
+            return [None if value != value else value == 1.0 for value in self.data]
+        return [
+            None if value != value else int(value) if value.is_integer() else value
+            for value in self.data
+        ]
+
+    def to_numpy(self):
+        """
+        ndarray of the column: the int32 codes of a dictionary column (-1 when
+        missing, see `categories`), float64, datetime64[ms] or object
+        """
+        import numpy
+
+        # copies, since an array can not grow while numpy shares its buffer
+        if self.kind == DICTIONARY:
+            return numpy.frombuffer(self.data, dtype=numpy.int32).copy()
+        if self.kind == DATE:
+            values = numpy.frombuffer(self.data, dtype=numpy.int64).copy()
+            return values.view("datetime64[ms]")
+        if self.kind == TEXT:
+            return numpy.array(self.data, dtype=object)
+        return numpy.frombuffer(self.data, dtype=numpy.float64).copy()
+
+    def to_arrow(self):
+        import numpy
+        import pyarrow
+
+        values = self.to_numpy()
+        if self.kind == DICTIONARY:
+            indices = pyarrow.array(values, mask=values < 0, type=pyarrow.int32())
+            return pyarrow.DictionaryArray.from_arrays(
+                indices, pyarrow.array(self.categories, type=pyarrow.string())
+            )
+        if self.kind == DATE:
+            return pyarrow.array(
+                values.view(numpy.int64), mask=numpy.isnat(values)
+            ).cast(pyarrow.timestamp("ms", tz="UTC"))
+        if self.kind == TEXT:
+            return pyarrow.array(self.data)
+        array_ = pyarrow.array(values, mask=numpy.isnan(values))
+        if self.kind == BOOLEAN:
+            return array_.cast(pyarrow.bool_())
+        return array_
+
+    def to_pandas(self):
+        import pandas
+
+        values = self.to_numpy()
+        if self.kind == DICTIONARY:
+            return pandas.Categorical.from_codes(values, self.categories)
+        if self.kind == DATE:
+            return pandas.DatetimeIndex(values).tz_localize("UTC")
+        if self.kind == BOOLEAN:
+            return pandas.array(self.values(), dtype="boolean")
+        return values
+
+
+class Table:
+    """
+    Columns of equal length, built by appending rows of values in the order
+    of `schema`, a list of (name, kind)
+    """
+
+    def __init__(self, schema):
+        self.schema = list(schema)
+        self.columns = {name: Column(name, kind) for name, kind in self.schema}
+        self._appends = [column.append for column in self.columns.values()]
+
+    def __len__(self):
+        return len(next(iter(self.columns.values())))
+
+    def __getitem__(self, name):
+        return self.columns[name]
+
+    @property
+    def names(self):
+        return [name for name, _ in self.schema]
+
+    def append(self, values):
+        for append, value in zip(self._appends, values):
+            append(value)
+
+    def rows(self):
+        """The rows as tuples of python values"""
+        return zip(*(column.values() for column in self.columns.values()))
+
+    def to_numpy(self):
+        """
+        {name: ndarray}, dictionary columns as their codes, the values of
+        which are in table[name].categories
+        """
+        return {name: column.to_numpy() for name, column in self.columns.items()}
+
+    def to_arrow(self):
+        """pyarrow.Table, the ids as dictionary arrays and the dates as UTC timestamps"""
+        import pyarrow
+
+        return pyarrow.table(
+            {name: column.to_arrow() for name, column in self.columns.items()}
+        )
+
+    def to_pandas(self):
+        """pandas.DataFrame, the ids as categoricals"""
+        import pandas
+
+        return pandas.DataFrame(
+            {name: column.to_pandas() for name, column in self.columns.items()}
+        )
+
+
+def _chunks(rows, schema, chunk_size):
+    """
+    Tables of at most chunk_size rows (all of them if None), filled with the
+    value tuples of rows
+    """
+    rows = iter(rows)
+    while True:
+        table = Table(schema)
+        append = table.append
+        for values in islice(rows, chunk_size):
+            append(values)
+        if not len(table):
+            return
+        yield table
+
+
+def _one(rows, schema):
+    return next(_chunks(rows, schema, None), None) or Table(schema)
+
+
+# Assignment completion
+
+
+COMPLETION_SCHEMA = [
+    ("assignment_id", DICTIONARY),
+    ("due_date", DATE),
+    ("student_kaid", DICTIONARY),
+    ("state", DICTIONARY),
+    ("completed_on", DATE),
+    ("num_correct", NUMBER),
+    ("num_attempted", NUMBER),
+]
+
+
+def _completion_rows(assignments):
+    for assignment in assignments:
+        assignment_id = assignment.get("id")
+        due_date = assignment.get("dueDate")
+        for state in assignment.get("itemCompletionStates") or ():
+            kaid = state.get("studentKaid")
+            if kaid is None:
+                kaid = (state.get("student") or {}).get("kaid")
+            score = state.get("bestScore") or {}
+            yield (
+                assignment_id,
+                due_date,
+                kaid,
+                state.get("state"),
+                state.get("completedOn"),
+                score.get("numCorrect"),
+                score.get("numAttempted"),
+            )
+
+
+def iter_progress_tables(assignments, chunk_size=50000):
+    """
+    Tables of COMPLETION_SCHEMA, one row per student and assignment, of at
+    most chunk_size rows, from assignments with their itemCompletionStates,
+    e.g. those of iter_progress_by_student
+    """
+    return _chunks(_completion_rows(assignments), COMPLETION_SCHEMA, chunk_size)
+
+
+def progress_table(assignments):
+    """iter_progress_tables in a single table"""
+    return _one(_completion_rows(assignments), COMPLETION_SCHEMA)
+
+
+def progress_by_student_table(response):
+    """The table of COMPLETION_SCHEMA of a get_progress_by_student response"""
+    return progress_table(
+        dig(response, "coach", "studentList", "assignmentsPage", "assignments")
+    )
+
+
+def completion_table(response):
+    """The table of COMPLETION_SCHEMA of a simple_completion_query response"""
+    return progress_table([dig(response, "coach", "assignment")])
+
+
+# User exercises
+
+
+USER_EXERCISES_SCHEMA = [
+    ("kaid", DICTIONARY),
+    ("exercise", DICTIONARY),
+    ("level", DICTIONARY),
+    ("total_done", NUMBER),
+    ("total_correct", NUMBER),
+    ("streak", NUMBER),
+    ("longest_streak", NUMBER),
+    ("practiced", BOOLEAN),
+    ("mastered", BOOLEAN),
+    ("last_done", DATE),
+    ("proficient_date", DATE),
+    ("maximum_exercise_progress_dt", DATE),
+]
+
+
+def _user_exercise_rows(rows):
+    for row in rows:
+        yield (
+            row.get("kaid"),
+            row.get("exercise"),
+            (row.get("exercise_progress") or {}).get("level"),
+            row.get("total_done"),
+            row.get("total_correct"),
+            row.get("streak"),
+            row.get("longest_streak"),
+            row.get("practiced"),
+            row.get("mastered"),
+            row.get("last_done"),
+            row.get("proficient_date"),
+            row.get("maximum_exercise_progress_dt"),
+        )
+
+
+def iter_user_exercise_tables(rows, chunk_size=50000):
+    """
+    Tables of USER_EXERCISES_SCHEMA of at most chunk_size rows, from the rows
+    of user_exercises or get_many_exercises, of one or many students
+    """
+    return _chunks(_user_exercise_rows(rows), USER_EXERCISES_SCHEMA, chunk_size)
+
+
+def user_exercises_table(rows):
+    """iter_user_exercise_tables in a single table"""
+    return _one(_user_exercise_rows(rows), USER_EXERCISES_SCHEMA)
+
+
+# Writers
+
+
+def write_csv(tables, file):
+    """
+    Write tables with the same schema, e.g. the chunks of iter_progress_tables,
+    as one csv file with a header. Missing values are empty.
+    :param: file, a path or a text file
+    Returns the number of rows written.
+    """
+    if isinstance(file, str):
+        with open(file, "w", newline="", encoding="utf-8") as f:
+            return write_csv(tables, f)
+    writer = csv.writer(file)
+    count = 0
+    header_written = False
+    for table in tables:
+        if not header_written:
+            writer.writerow(table.names)
+            header_written = True
+        writer.writerows(table.rows())
+        count += len(table)
+    return count
+
+
+def write_parquet(tables, path, **options):
+    """
+    Write tables with the same schema, e.g. the chunks of iter_progress_tables,
+    as one Parquet file, each table a row group. Requires pyarrow.
+    :param: options, passed on to pyarrow.parquet.ParquetWriter, e.g.
+        compression="zstd"
+    Returns the number of rows written.
+    """
+    import pyarrow.parquet
+
+    writer = None
+    count = 0
+    try:
+        for table in tables:
+            arrow = table.to_arrow()
+            if writer is None:
+                writer = pyarrow.parquet.ParquetWriter(path, arrow.schema, **options)
+            writer.write_table(arrow)
+            count += len(table)
+    finally:
+        if writer is not None:
+            writer.close()
+    return count
@@ -0,0 +1,356 @@
+"""
+GraphQL operations with their request payloads prepared ahead of time. The
+static part of a payload (operation name, query text and its hash) is
+serialised once, so sending an operation only costs encoding its variables.
+
+Operations can also be sent as persisted queries (the protocol introduced by
+Apollo): only the sha256 hash of the query is sent, and the full text is only
+uploaded when the server answers that it does not know the hash yet.
+"""
+
+import hashlib
+import json
+import re
+import threading
+from collections.abc import Mapping
+from khan_api_wrapper import codec
+
+_OPERATION_NAME = re.compile(r"^\s*(query|mutation)\s+(\w+)")
+
+# Errors returned by servers implementing persisted queries
+PERSISTED_QUERY_NOT_FOUND = "PersistedQueryNotFound"
+PERSISTED_QUERY_NOT_SUPPORTED = "PersistedQueryNotSupported"
+
+
+class Operation:
+    """
+    A named query or mutation document.
+    :param: document, the GraphQL document, starting with its operation
+    :param: name, the operation name, read from the document if not given
+    """
+
+    def __init__(self, document, name=None):
+        match = _OPERATION_NAME.match(document)
+        if not match:
+            raise ValueError("Document does not start with a named operation")
+        self.document = document
+        self.name = name or match.group(2)
+        self.is_mutation = match.group(1) == "mutation"
+        self.sha256 = hashlib.sha256(document.encode("utf-8")).hexdigest()
+        # variables no longer defined by the document, left out of payloads.
+        # Set on the trimmed operations of khan_api_wrapper.projection
+        self.unused_variables = frozenset()
+
+        name_json = json.dumps(self.name)
+        query_json = json.dumps(document)
+        extensions = '{"persistedQuery":{"version":1,"sha256Hash":"%s"}}' % self.sha256
+        # Everything but the variables, which are appended by payload()
+        self._prefixes = {
+            "full": '{"operationName":%s,"query":%s,"variables":'
+            % (name_json, query_json),
+            "hash": '{"operationName":%s,"extensions":%s,"variables":'
+            % (name_json, extensions),
+            "register": '{"operationName":%s,"query":%s,"extensions":%s,"variables":'
+            % (name_json, query_json, extensions),
+        }
+
+    def __repr__(self):
+        return "<Operation %s>" % self.name
+
+    def used_variables(self, variables):
+        """The variables without those the document no longer defines"""
+        if not self.unused_variables:
+            return variables
+        return {
+            key: value
+            for key, value in variables.items()
+            if key not in self.unused_variables
+        }
+
+    def payload(self, variables, mode="full"):
+        """
+        Return the JSON request body for this operation.
+        :param: variables, dict of the operation variables
+        :param: mode, "full" to send the query text, "hash" to only send its
+            persisted query hash, or "register" to send both so the server
+            stores the query under its hash
+        """
+        variables = self.used_variables(variables)
+        return self._prefixes[mode] + codec.dumps(variables) + "}"
+
+
+class GraphQLError(Exception):
+    """Raised when a GraphQL response does not hold the data asked for"""
+
+    def __init__(self, message, response=None):
+        super().__init__(message)
+        self.response = response
+
+
+def dig(response, *path):
+    """
+    Return the value at `path` under response["data"], raising GraphQLError
+    with the errors of the response if it is missing.
+    """
+    value = response.get("data") if isinstance(response, dict) else None
+    for key in path:
+        if not isinstance(value, dict) or value.get(key) is None:
+            errors = response.get("errors") if isinstance(response, dict) else None
+            raise GraphQLError(
+                "No %s in response: %s" % (".".join(path), errors or response),
+                response,
+            )
+        value = value[key]
+    return value
+
+
+def persisted_query_error(response):
+    """
+    Return PERSISTED_QUERY_NOT_FOUND or PERSISTED_QUERY_NOT_SUPPORTED if the
+    response is a persisted query refusal, otherwise None
+    """
+    if not isinstance(response, dict):
+        return None
+    for error in response.get("errors") or ():
+        if not isinstance(error, dict):
+            continue
+        code = (error.get("extensions") or {}).get("code")
+        message = error.get("message")
+        if PERSISTED_QUERY_NOT_FOUND in (message, code) or (
+            code == "PERSISTED_QUERY_NOT_FOUND"
+        ):
+            return PERSISTED_QUERY_NOT_FOUND
+        if PERSISTED_QUERY_NOT_SUPPORTED in (message, code) or (
+            code == "PERSISTED_QUERY_NOT_SUPPORTED"
+        ):
+            return PERSISTED_QUERY_NOT_SUPPORTED
+    return None
+
+
+class _Operations(Mapping):
+    """
+    The operations of graphql_schema by operation name, each built the first
+    time it is used, so that importing the client does not load the schema
+    documents or hash them
+    """
+
+    def __init__(self, documents):
+        # operation name -> name of its document in graphql_schema
+        self._documents = documents
+        self._operations = {}
+        self._lock = threading.Lock()
+
+    def __getitem__(self, name):
+        operation = self._operations.get(name)
+        if operation is None:
+            document = self._documents[name]
+            from khan_api_wrapper import graphql_schema
+
+            with self._lock:
+                operation = self._operations.get(name)
+                if operation is None:
+                    operation = Operation(getattr(graphql_schema, document), name)
+                    self._operations[name] = operation
+        return operation
+
+    def __iter__(self):
+        return iter(self._documents)
+
+    def __len__(self):
+        return len(self._documents)
+
+
+OPERATIONS = _Operations(
+    {
+        "simpleCompletionQuery": "simpleCompletionQuery",
+        "getStudentsList": "getStudentsList",
+        "quizAndUnitTestAttemptsQuery": "quizAndUnitTestAttemptsQuery",
+        "ProgressByStudent": "progressByStudent",
+        "AutoAssignableStudents": "AutoAssignableStudents",
+        "CoachAssignments": "CoachAssignments",
+        "stopCoaching": "stopCoaching",
+        "transferStudents": "transferStudents",
+        "updateAutoAssign": "updateAutoAssign",
+        "publishAssignment": "publishAssignment",
+    }
+)
+
+
+def get_operation(operation):
+    """Return the Operation for an operation name, or the Operation given"""
+    if isinstance(operation, Operation):
+        return operation
+    try:
+        return OPERATIONS[operation]
+    except KeyError:
+        raise ValueError("Unknown GraphQL operation: %s" % operation)
+
+
+def _split_document(document):
+    """
+    Split an operation document into (operation type, name, variable
+    definitions, selection set body, trailing fragments)
+    """
+    match = re.match(r"\s*(query|mutation)\s+(\w+)\s*(\((.*?)\))?\s*\{", document, re.S)
+    if not match:
+        raise ValueError("Document does not start with a named operation")
+    end = _closing_brace(document, match.end())
+    body = document[match.end() : end - 1]
+    return match.group(1), match.group(2), match.group(4) or "", body, document[end:]
+
+
+def _closing_brace(text, pos):
+    """Position after the brace closing the selection set opened before pos"""
+    depth = 1
+    while depth:
+        if text[pos] == "{":
+            depth += 1
+        elif text[pos] == "}":
+            depth -= 1
+        pos += 1
+    return pos
+
+
+def _split_fragments(text):
+    """Return {fragment name: fragment text} of the fragments in `text`"""
+    return {
+        match.group(1): text[match.start() : _closing_brace(text, match.end())]
+        for match in re.finditer(r"fragment\s+(\w+)\s+on\s+\w+\s*\{", text)
+    }
+
+
+_NAME = re.compile(r"[_A-Za-z]\w*")
+
+
+def _alias_top_level_fields(body, prefix):
+    """
+    Prefix the alias of every top level field of a selection set body, adding
+    an alias to fields that have none: `coach {` -> `b0_coach: coach {`
+    """
+    out = []
+    depth = paren = 0
+    pos = 0
+    # the last significant character seen at the top level
+    previous = ""
+    while pos < len(body):
+        char = body[pos]
+        top = depth == 0 and paren == 0
+        if char in "{}()":
+            depth += {"{": 1, "}": -1}.get(char, 0)
+            paren += {"(": 1, ")": -1}.get(char, 0)
+        elif char == "." and top:
+            raise ValueError("Top level fragment spreads can not be batched")
+        elif top and _NAME.match(char):
+            name = _NAME.match(body, pos).group()
+            pos += len(name)
+            # a name after "@" is a directive, after ":" the field of an alias
+            if previous in ("@", ":"):
+                out.append(name)
+            elif body[pos:].lstrip().startswith(":"):
+                out.append(prefix + name)
+            else:
+                out.append("%s%s: %s" % (prefix, name, name))
+            previous = name[-1]
+            continue
+        if top and not char.isspace():
+            previous = char
+        out.append(char)
+        pos += 1
+    return "".join(out)
+
+
+def merge_operations(operations):
+    """
+    Merge several operations into one document, so they run in a single
+    request. Every operation i gets its variables renamed `$name_i` and its
+    top level fields aliased `b{i}_field`, and fragments are shared.
+    :param: operations, list of Operation, all queries or all mutations
+    Returns the merged Operation. Use merged_variables and split_merged_response
+    to build its variables and split its response.
+    """
+    kinds = set()
+    definitions = []
+    bodies = []
+    fragments = {}
+    names = []
+    for i, op in enumerate(operations):
+        kind, name, var_defs, body, rest = _split_document(op.document)
+        kinds.add(kind)
+        names.append(name)
+        var_names = set(re.findall(r"\$(\w+)", var_defs))
+
+        def rename(match):
+            if match.group(1) in var_names:
+                return "$%s_%d" % (match.group(1), i)
+            return match.group()
+
+        if var_defs:
+            definitions.append(re.sub(r"\$(\w+)", rename, var_defs))
+        body = re.sub(r"\$(\w+)", rename, body)
+        bodies.append(_alias_top_level_fields(body, "b%d_" % i))
+        for fragment, text in _split_fragments(rest).items():
+            if fragments.setdefault(fragment, text) != text:
+                raise ValueError("Conflicting definitions of fragment %s" % fragment)
+    if len(kinds) != 1:
+        raise ValueError("Queries and mutations can not be merged")
+
+    name = "batch_%d_%s" % (len(operations), "_".join(sorted(set(names))))
+    document = "%s %s%s {%s}\n%s" % (
+        kinds.pop(),
+        name,
+        "(%s)" % ", ".join(definitions) if definitions else "",
+        "".join(bodies),
+        "\n".join(fragments.values()),
+    )
+    return Operation(document)
+
+
+def merged_variables(variables_list):
+    """Rename the variables of each operation to match merge_operations"""
+    return {
+        "%s_%d" % (key, i): value
+        for i, variables in enumerate(variables_list)
+        for key, value in variables.items()
+    }
+
+
+def split_merged_response(response, count):
+    """
+    Split the response of a merged operation back into one response per
+    operation, each shaped as if the operation had been sent on its own.
+    Top level keys other than data and errors, like those of an error body
+    that is not GraphQL, are copied to every response.
+    """
+    if not isinstance(response, dict):
+        return [response] * count
+    data = response.get("data")
+    rest = {k: v for k, v in response.items() if k not in ("data", "errors")}
+    results = [{**rest, "data": {} if data is not None else None} for _ in range(count)]
+    for alias, value in (data or {}).items():
+        unaliased = _unalias(alias, count)
+        if unaliased:
+            results[unaliased[0]]["data"][unaliased[1]] = value
+    for error in response.get("errors") or ():
+        path = error.get("path") if isinstance(error, dict) else None
+        unaliased = _unalias(path[0], count) if path else None
+        if unaliased:
+            index, field = unaliased
+            targets = [results[index]]
+            error = {**error, "path": [field] + list(path[1:])}
+        else:
+            # not about a single operation, every one of them gets it
+            targets = results
+        for result in targets:
+            result.setdefault("errors", []).append(error)
+    return results
+
+
+_ALIAS = re.compile(r"b(\d+)_(.+)")
+
+
+def _unalias(alias, count):
+    """(operation index, field) of an alias set by merge_operations, or None"""
+    match = _ALIAS.fullmatch(str(alias))
+    if not match or int(match.group(1)) >= count:
+        return None
+    return int(match.group(1)), match.group(2)
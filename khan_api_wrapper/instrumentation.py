@@ -0,0 +1,435 @@
+"""
+Per call measurements of the requests made by KhanAPI and AsyncKhanAPI,
+handed to callbacks as CallRecords:
+
+    summary = kapi.instrumentation.add_summary()
+    kapi.instrumentation.add_callback(lambda record: statsd.timing(...))
+    ...
+    print(summary.report())
+
+Calls are tagged with their operation: the GraphQL operationName, or the
+REST path with its variable segments replaced, e.g. /api/v1/topic/{slug}.
+Paths matching no template are tagged OTHER, so ids and names never end up
+in the tags. Nothing is measured while no callback is attached.
+
+Latency phases, in seconds:
+    wait, time spent on the rate limiter and between retries
+    ttfb, from sending the last attempt to receiving its headers
+    connect, the part of ttfb spent opening a new connection (AsyncKhanAPI
+        only)
+    download, reading the body
+    decode, decoding the JSON (and storing it in the cache)
+    total, the whole call
+"""
+
+import re
+import threading
+from time import perf_counter
+
+# Templates of the REST paths built by the client methods, tried in order.
+# {name} stands for one path segment.
+PATH_TEMPLATES = (
+    "/api/v1/badges",
+    "/api/v1/badges/categories",
+    "/api/v1/badges/categories/{category}",
+    "/api/v1/exercises",
+    "/api/v1/exercises/perseus_autocomplete",
+    "/api/v1/exercises/{name}/followup_exercises",
+    "/api/v1/exercises/{name}/videos",
+    "/api/v1/exercises/{name}",
+    "/api/v1/playlists/{slug}/exercises",
+    "/api/v1/playlists/{slug}/videos",
+    "/api/v1/topic/{slug}/exercises",
+    "/api/v1/topic/{slug}/videos",
+    "/api/v1/topic/{slug}",
+    "/api/v1/topictree",
+    "/api/v1/user",
+    "/api/v1/user/exercises",
+    "/api/v1/user/exercises/progress_changes",
+    "/api/v1/user/exercises/{name}/followup_exercises",
+    "/api/v1/user/exercises/{name}/log",
+    "/api/v1/user/exercises/{name}",
+    "/api/v1/user/progress_summary",
+    "/api/v1/user/students",
+    "/api/v2/topics/topictree",
+    "/api/internal/exercises/math_topics_and_exercises",
+    "/api/internal/graphql",
+    "/api/internal/user/joinclass/{class_code}",
+    "/api/internal/user/mission/{mission}",
+    "/api/internal/user/missions",
+    "/api/internal/user/students/progress",
+    "/api/internal/user/missions/progress_info",
+    "/api/internal/user/{kaid}/progress",
+)
+
+# The tag of the paths matching no template
+OTHER = "other"
+
+_OPERATION_NAME = re.compile(r'"operationName"\s*:\s*"([^"]+)"')
+GRAPHQL_PATH = "/api/internal/graphql"
+
+
+def _compile(template):
+    pattern = re.sub(r"\\\{\w+\\\}", "[^/]+", re.escape(template))
+    return re.compile(pattern + "$")
+
+
+class Instrumentation:
+    """
+    Hands a CallRecord of every call to the attached callbacks. Can be shared
+    between clients.
+    :param: templates, REST path templates tried before PATH_TEMPLATES
+    """
+
+    def __init__(self, templates=()):
+        self.callbacks = []
+        self.templates = [
+            (_compile(template), template)
+            for template in tuple(templates) + PATH_TEMPLATES
+        ]
+        self.operations = {}
+        self.lock = threading.Lock()
+
+    def add_callback(self, callback):
+        """Call callback(record) after every call"""
+        self.callbacks.append(callback)
+        return callback
+
+    def remove_callback(self, callback):
+        self.callbacks.remove(callback)
+
+    def add_summary(self):
+        """Attach and return a HistogramSummary"""
+        return self.add_callback(HistogramSummary())
+
+    def operation(self, method, url, data=None):
+        """The operation tag of a request"""
+        if url == GRAPHQL_PATH and data:
+            head = data[:300] if isinstance(data, (str, bytes)) else ""
+            if isinstance(head, bytes):
+                head = head.decode("utf-8", "replace")
+            match = _OPERATION_NAME.search(head)
+            if match:
+                return match.group(1)
+        path = url.split("?", 1)[0]
+        name = self.operations.get(path)
+        if name is None:
+            name = OTHER
+            for pattern, template in self.templates:
+                if pattern.match(path):
+                    name = template
+                    break
+            with self.lock:
+                if len(self.operations) < 10000:
+                    self.operations[path] = name
+        return name
+
+    def probe(self, method, url, data=None):
+        """
+        Return a Probe measuring a call, or None when no callback is attached
+        """
+        if not self.callbacks:
+            return None
+        return Probe(self, method, url, data)
+
+    def emit(self, record):
+        for callback in list(self.callbacks):
+            try:
+                callback(record)
+            except Exception:
+                # a broken metrics callback should never break the call
+                pass
+
+
+class CallRecord:
+    """The measurements of one call, see the module docstring for the phases"""
+
+    __slots__ = (
+        "operation",
+        "method",
+        "url",
+        "status",
+        "request_bytes",
+        "response_bytes",
+        "attempts",
+        "cache",
+        "error",
+        "wait",
+        "connect",
+        "ttfb",
+        "download",
+        "decode",
+        "total",
+    )
+
+    def __init__(self, operation, method, url):
+        self.operation = operation
+        self.method = method
+        self.url = url
+        self.status = None
+        self.request_bytes = 0
+        self.response_bytes = 0
+        # requests sent, 0 for a cache hit. A request sent again with new
+        # tokens after a 401 counts as a retry
+        self.attempts = 0
+        # "hit", "miss", "revalidated", or None when the url is not cached
+        self.cache = None
+        # the exception the call raised, if any
+        self.error = None
+        self.wait = 0.0
+        self.connect = None
+        self.ttfb = None
+        self.download = None
+        self.decode = None
+        self.total = 0.0
+
+    @property
+    def retries(self):
+        return max(self.attempts - 1, 0)
+
+    def as_dict(self):
+        return {name: getattr(self, name) for name in self.__slots__}
+
+    def __repr__(self):
+        return "<CallRecord %s %s %.3fs>" % (self.operation, self.status, self.total)
+
+
+class Probe:
+    """
+    Collects the timestamps of one call. Used as a context manager around
+    the call, which emits the record when it exits.
+    """
+
+    def __init__(self, instrumentation, method, url, data=None):
+        self.instrumentation = instrumentation
+        self.record = CallRecord(
+            instrumentation.operation(method, url, data), method, url
+        )
+        if isinstance(data, (str, bytes)):
+            self.record.request_bytes = len(data)
+        self.start = perf_counter()
+        self.attempt_time = 0.0
+        self.last_attempt = 0.0
+        self.received_at = None
+        self.decoded_at = None
+
+    def wrap(self, send):
+        """Wrap the send function given to the scheduler, to time attempts"""
+
+        def timed():
+            self.record.attempts += 1
+            started = perf_counter()
+            try:
+                return send()
+            finally:
+                self.last_attempt = perf_counter() - started
+                self.attempt_time += self.last_attempt
+
+        return timed
+
+    def wrap_async(self, send):
+        async def timed():
+            self.record.attempts += 1
+            started = perf_counter()
+            try:
+                return await send()
+            finally:
+                self.last_attempt = perf_counter() - started
+                self.attempt_time += self.last_attempt
+
+        return timed
+
+    def attempt(self, ttfb, download):
+        """Phases of the last attempt, when the transport measured them"""
+        self.record.ttfb = ttfb
+        self.record.download = download
+
+    def received(self, response, body_size=0):
+        """The final response arrived, with its body unless streamed"""
+        self.received_at = perf_counter()
+        record = self.record
+        record.status = getattr(response, "status_code", None) or getattr(
+            response, "status", None
+        )
+        record.response_bytes = body_size
+        if record.ttfb is None:
+            # a requests response, elapsed runs until the headers are parsed
+            elapsed = getattr(response, "elapsed", None)
+            if elapsed is not None:
+                record.ttfb = elapsed.total_seconds()
+        record.wait = max(self.received_at - self.start - self.attempt_time, 0.0)
+
+    def streamed(self, body_size):
+        """The body of a streamed response has been read"""
+        self.record.response_bytes = body_size
+        self.record.download = perf_counter() - self.received_at
+
+    def decoded(self):
+        self.decoded_at = perf_counter()
+
+    def __enter__(self):
+        return self
+
+    def __exit__(self, exc_type, exc, tb):
+        end = perf_counter()
+        record = self.record
+        # a stream the caller stopped reading is not an error
+        record.error = exc if exc_type is not GeneratorExit else None
+        record.total = end - self.start
+        if self.received_at is not None:
+            if record.download is None and record.ttfb is not None:
+                # whatever the last attempt spent after the headers
+                record.download = max(self.last_attempt - record.ttfb, 0.0)
+            if self.decoded_at is not None:
+                record.decode = self.decoded_at - self.received_at
+        elif self.decoded_at is not None:
+            # answered from the cache
+            record.decode = self.decoded_at - self.start
+        self.instrumentation.emit(record)
+        return False
+
+
+# Upper bounds of the latency histogram buckets, 1ms to about 65s
+BUCKETS = tuple(0.001 * 2**i for i in range(17))
+
+
+class _Histogram:
+    __slots__ = ("counts", "total", "count")
+
+    def __init__(self):
+        self.counts = [0] * (len(BUCKETS) + 1)
+        self.total = 0.0
+        self.count = 0
+
+    def add(self, value):
+        self.count += 1
+        self.total += value
+        for i, bound in enumerate(BUCKETS):
+            if value <= bound:
+                self.counts[i] += 1
+                return
+        self.counts[-1] += 1
+
+    def quantile(self, q):
+        """Upper bound of the bucket holding the q quantile"""
+        if not self.count:
+            return None
+        rank = q * self.count
+        seen = 0
+        for i, count in enumerate(self.counts):
+            seen += count
+            if seen >= rank:
+                return BUCKETS[i] if i < len(BUCKETS) else float("inf")
+        return float("inf")
+
+
+class HistogramSummary:
+    """
+    Callback aggregating CallRecords per operation: counts, errors, status
+    codes, cache outcomes, retries, bytes, and a histogram of every latency
+    phase. Thread safe.
+    """
+
+    PHASES = ("total", "wait", "ttfb", "connect", "download", "decode")
+
+    def __init__(self):
+        self.lock = threading.Lock()
+        self.operations = {}
+
+    def __call__(self, record):
+        with self.lock:
+            stats = self.operations.get(record.operation)
+            if stats is None:
+                stats = self.operations[record.operation] = {
+                    "count": 0,
+                    "errors": 0,
+                    "retries": 0,
+                    "request_bytes": 0,
+                    "response_bytes": 0,
+                    "statuses": {},
+                    "cache": {},
+                    "phases": {phase: _Histogram() for phase in self.PHASES},
+                }
+            stats["count"] += 1
+            stats["errors"] += record.error is not None
+            stats["retries"] += record.retries
+            stats["request_bytes"] += record.request_bytes
+            stats["response_bytes"] += record.response_bytes
+            if record.status is not None:
+                stats["statuses"][record.status] = (
+                    stats["statuses"].get(record.status, 0) + 1
+                )
+            if record.cache is not None:
+                stats["cache"][record.cache] = stats["cache"].get(record.cache, 0) + 1
+            for phase in self.PHASES:
+                value = getattr(record, phase)
+                if value is not None:
+                    stats["phases"][phase].add(value)
+
+    def summary(self):
+        """
+        dict of operation -> counters, and for every phase measured its
+        count, sum and estimated p50 / p90 / p99
+        """
+        with self.lock:
+            result = {}
+            for operation, stats in self.operations.items():
+                phases = {
+                    phase: {
+                        "count": histogram.count,
+                        "sum": histogram.total,
+                        "p50": histogram.quantile(0.5),
+                        "p90": histogram.quantile(0.9),
+                        "p99": histogram.quantile(0.99),
+                    }
+                    for phase, histogram in stats["phases"].items()
+                    if histogram.count
+                }
+                result[operation] = {
+                    **{k: v for k, v in stats.items() if k != "phases"},
+                    "statuses": dict(stats["statuses"]),
+                    "cache": dict(stats["cache"]),
+                    "phases": phases,
+                }
+            return result
+
+    def report(self):
+        """The summary as a text table, slowest operations (by total time) first"""
+        summary = self.summary()
+        rows = sorted(
+            summary.items(),
+            key=lambda item: -item[1]["phases"].get("total", {}).get("sum", 0.0),
+        )
+        lines = [
+            "%-48s %7s %6s %7s %9s %9s %9s %12s"
+            % (
+                "operation",
+                "calls",
+                "errors",
+                "retries",
+                "total s",
+                "p50 s",
+                "p99 s",
+                "bytes in",
+            )
+        ]
+        for operation, stats in rows:
+            total = stats["phases"].get("total", {})
+            lines.append(
+                "%-48s %7d %6d %7d %9.3f %9.3f %9.3f %12d"
+                % (
+                    operation[:48],
+                    stats["count"],
+                    stats["errors"],
+                    stats["retries"],
+                    total.get("sum", 0.0),
+                    total.get("p50") or 0.0,
+                    total.get("p99") or 0.0,
+                    stats["response_bytes"],
+                )
+            )
+        return "\n".join(lines)
+
+    def reset(self):
+        with self.lock:
+            self.operations = {}
@@ -1,9 +1,43 @@
-from rauth import OAuth1Service
 from time import time
 from datetime import datetime
-import json
-import requests
-from khan_api_wrapper import graphql_schema as gql
+import os
+import threading
+from khan_api_wrapper import codec
+from khan_api_wrapper.graphql import (
+    get_operation,
+    persisted_query_error,
+    PERSISTED_QUERY_NOT_SUPPORTED,
+)
+from khan_api_wrapper.batch import GraphQLBatch, plan_batches
+from khan_api_wrapper.roster import BulkRoster
+from khan_api_wrapper.progress import iter_class_progress
+from khan_api_wrapper.tokens import TokenManager
+from khan_api_wrapper.singleflight import SingleFlight, request_key
+from khan_api_wrapper.instrumentation import Instrumentation
+from khan_api_wrapper.sync import ActivitySync, RosterSync, MemoryStateStore
+from khan_api_wrapper.cache import ResponseCache
+from khan_api_wrapper.pagination import (
+    paginate,
+    students_page,
+    assignments_page,
+    students_fields,
+    assignments_fields,
+)
+from khan_api_wrapper.projection import project
+from khan_api_wrapper.topic_tree import TopicTree
+from khan_api_wrapper.streaming import (
+    has_ijson,
+    iter_events,
+    iter_items,
+    iter_tree_nodes,
+    iter_value_events,
+)
+from khan_api_wrapper.scheduler import (
+    RequestScheduler,
+    endpoint_class,
+    GRAPHQL_QUERY,
+    GRAPHQL_MUTATION,
+)
 
 SERVER_URL = "https://www.khanacademy.org"
 REQUEST_TOKEN_URL = SERVER_URL + "/api/auth2/request_token"
@@ -12,12 +46,88 @@ AUTHORIZE_URL = SERVER_URL + "/api/auth2/authorize"
 BASE_URL = SERVER_URL + "/api/auth2"
 
 
+def _mount_pool(session, pool_connections, pool_maxsize, pool_block):
+    """Give the session an adapter with the requested connection pool limits"""
+    from requests.adapters import HTTPAdapter
+
+    adapter = HTTPAdapter(
+        pool_connections=pool_connections,
+        pool_maxsize=pool_maxsize,
+        pool_block=pool_block,
+    )
+    session.mount("https://", adapter)
+    session.mount("http://", adapter)
+
+
+def _iter_chunks(body, chunk_size):
+    view = memoryview(body)
+    for start in range(0, len(view), chunk_size):
+        yield view[start : start + chunk_size]
+
+
+def _exercise_chunks(exercises, limit=1500):
+    """
+    Split a list of exercise names into sorted lists whose comma joined length
+    stays below `limit`, so each chunk fits in the url of a single request.
+    The list passed in is left untouched.
+    """
+    chunk = []
+    length = 0
+    for exercise in sorted(set(exercises)):
+        length += len(exercise) + 1
+        if chunk and length >= limit:
+            yield chunk
+            chunk = []
+            length = len(exercise) + 1
+        chunk.append(exercise)
+    if chunk:
+        yield chunk
+
+
+def _merge_chunk_results(chunks, results):
+    """
+    Tie the responses of a chunked request together in chunk order. Raises
+    PartialResultError if any chunk failed, carrying the data of the chunks
+    that succeeded.
+    """
+    out = []
+    errors = {}
+    for chunk, result in zip(chunks, results):
+        if isinstance(result, list):
+            out.extend(result)
+        else:
+            errors[tuple(chunk)] = result
+    if errors:
+        raise PartialResultError(out, errors)
+    return out
+
+
+def _projected(operation, fields):
+    """The operation trimmed to `fields`, or the whole operation"""
+    return project(operation, fields) if fields else operation
+
+
+class PartialResultError(Exception):
+    """
+    Raised when some of the requests a method is split into fail.
+    :attr: results, the combined data of the requests that succeeded
+    :attr: errors, dict of failed piece -> exception or error response
+    """
+
+    def __init__(self, results, errors):
+        super().__init__("%d request(s) failed" % len(errors))
+        self.results = results
+        self.errors = errors
+
+
 class KhanAcademySignIn:
     """
     Class to set up the rauth service and use it to retrieve the access tokens
     """
 
     def __init__(self, consumer_key, consumer_secret, khan_identifier, khan_password):
+        from rauth import OAuth1Service
+
         self.service = OAuth1Service(
             name="Grade Syncer",
             consumer_key=consumer_key,
@@ -51,6 +161,8 @@ class KhanAcademySignIn:
         # Posting to the authorize url will then authenticate the request token
         # and secret, and make available the retrieval of the access token and
         # secret
+        import requests
+
         requests.post(AUTHORIZE_URL, data=data)
 
         # Get access token and secret
@@ -61,6 +173,13 @@ class KhanAcademySignIn:
         # Now we give the user the access token and secret as a tuple
         return oauth_session.access_token, oauth_session.access_token_secret
 
+    def token_manager(self, store=None, **kwargs):
+        """
+        Return a TokenManager calling authorize_self only when the tokens in
+        `store` are missing or about to expire, see khan_api_wrapper.tokens
+        """
+        return TokenManager(self, store, **kwargs)
+
 
 class KhanAPI:
     """
@@ -75,7 +194,58 @@ class KhanAPI:
         consumer_secret=None,
         access_token=None,
         access_token_secret=None,
+        pool_connections=10,
+        pool_maxsize=10,
+        pool_block=False,
+        keep_alive=True,
+        rate_limit=None,
+        scheduler=None,
+        cache=None,
+        cache_buster=False,
+        persisted_queries=False,
+        tokens=None,
+        coalesce=False,
+        instrumentation=None,
+        server_url=None,
     ):
+        """
+        The connection pool options are handed to the requests HTTPAdapter:
+        :param: pool_connections, number of per host pools to keep
+        :param: pool_maxsize, max connections kept open to a single host
+        :param: pool_block, wait for a free connection instead of opening an
+            extra one when pool_maxsize connections are busy
+        :param: keep_alive, set False to close the connection after each call
+        requests and rauth are only imported, and the session only created,
+        by the first call, keeping the import and construction of the client
+        cheap for short lived processes.
+        Every request goes through a RequestScheduler, which retries failed
+        calls with backoff. Its counters are available as `self.stats`.
+        :param: rate_limit, most requests per second, or None for no limit
+        :param: scheduler, a RequestScheduler to use instead of the default
+            one, e.g. with custom retry policies or shared between clients
+        :param: cache, a ResponseCache for the static catalog endpoints, or
+            True for an in memory one with the default ttls
+        :param: cache_buster, add the `_` timestamp param the Khan Academy
+            site sends with graphql requests. Not needed by the api.
+        :param: persisted_queries, send graphql queries by hash instead of
+            uploading their full text on every call, see khan_api_wrapper.graphql
+        :param: tokens, a TokenManager handing out the access token and secret
+            instead of passing them, see khan_api_wrapper.tokens. They are
+            replaced on the session whenever the manager refreshes them.
+        :param: coalesce, let identical GET requests and GraphQL queries made
+            at the same time from several threads share one network call and
+            its decoded result, see khan_api_wrapper.singleflight. True, or a
+            SingleFlight to share between clients.
+        :param: instrumentation, an Instrumentation to share between clients,
+            a new one is available as `self.instrumentation` otherwise. Its
+            callbacks get the timings, sizes, status, retries and cache outcome
+            of every call, see khan_api_wrapper.instrumentation.
+        :param: server_url, where the api calls are sent, e.g. a local stand-in
+            server such as the one of the benchmarks
+        """
+        self.tokens = tokens
+        if tokens is not None:
+            access_token, access_token_secret = tokens.get()
         self.authorized = False
         # We need an access token and secret to make authorized calls
         # Otherwise we can only access open endpoints
@@ -84,6 +254,60 @@ class KhanAPI:
                 raise ValueError(
                     "consumer_key and consumer_secret must be provided if access tokens are provided"
                 )
+            self.authorized = True
+        self.service = None
+        self._session = None
+        self._session_lock = threading.Lock()
+        self._session_options = (
+            consumer_key,
+            consumer_secret,
+            access_token,
+            access_token_secret,
+            pool_connections,
+            pool_maxsize,
+            pool_block,
+            keep_alive,
+        )
+        self.scheduler = scheduler or RequestScheduler(rate=rate_limit)
+        self.stats = self.scheduler.stats
+        self.cache = ResponseCache() if cache is True else cache or None
+        # cached responses are keyed on who asked for them
+        self.identity = access_token if self.authorized else None
+        if tokens is not None:
+            # stays the same when the tokens are refreshed
+            self.identity = tokens.key
+        self.cache_buster = cache_buster
+        self.persisted_queries = persisted_queries
+        self.singleflight = SingleFlight() if coalesce is True else coalesce or None
+        self.instrumentation = instrumentation or Instrumentation()
+        self.server_url = server_url or SERVER_URL
+        self.get_resource = self.get
+
+    @property
+    def session(self):
+        """The requests session, created on first use"""
+        if self._session is None:
+            with self._session_lock:
+                if self._session is None:
+                    self._session = self._new_session()
+        return self._session
+
+    def _new_session(self):
+        import requests
+
+        (
+            consumer_key,
+            consumer_secret,
+            access_token,
+            access_token_secret,
+            pool_connections,
+            pool_maxsize,
+            pool_block,
+            keep_alive,
+        ) = self._session_options
+        if self.authorized:
+            from rauth import OAuth1Service
+
             self.service = OAuth1Service(
                 name="khan_oauth",
                 consumer_key=consumer_key,
@@ -93,15 +317,198 @@ class KhanAPI:
                 authorize_url=AUTHORIZE_URL,
                 base_url=BASE_URL,
             )
-            self.session = self.service.get_session((access_token, access_token_secret))
-            self.authorized = True
-        self.get_resource = self.get
+            session = self.service.get_session((access_token, access_token_secret))
+        else:
+            # Public endpoints still go through a session so that connections
+            # are reused instead of paying a handshake on every call
+            session = requests.Session()
+        _mount_pool(session, pool_connections, pool_maxsize, pool_block)
+        if not keep_alive:
+            session.headers["Connection"] = "close"
+        return session
+
+    def __enter__(self):
+        return self
+
+    def __exit__(self, *exc_info):
+        self.close()
+
+    def close(self):
+        """Close the pooled connections"""
+        if self._session is not None:
+            self._session.close()
+
+    def _check_tokens(self):
+        """Put the new access tokens on the session once they are refreshed"""
+        if self.tokens is not None and self.tokens.needs_refresh():
+            token, secret = self.tokens.get()
+            self.session.access_token = token
+            self.session.access_token_secret = secret
+
+    def _renewing(self, send, probe=None):
+        """
+        send, sent once more with new tokens if the server rejects the current
+        ones with a 401, see TokenManager.rejected. Both attempts are timed
+        by `probe`.
+        """
+        if probe is not None:
+            send = probe.wrap(send)
+        if self.tokens is None or not self.authorized:
+            return send
+
+        def send_renewing():
+            response = send()
+            if response.status_code == 401 and self.tokens.rejected(
+                self.session.access_token
+            ):
+                token, secret = self.tokens.get()
+                self.session.access_token = token
+                self.session.access_token_secret = secret
+                response.close()
+                response = send()
+            return response
+
+        return send_renewing
 
     def get(self, url, params={}):
+        if self.singleflight is not None:
+            key = request_key("GET", url, params, identity=self.identity)
+            return self.singleflight.do(key, lambda: self._get(url, params))
+        return self._get(url, params)
+
+    def _get(self, url, params):
+        probe = self.instrumentation.probe("GET", url)
+        if probe is None:
+            return self._fetch(url, params)
+        with probe:
+            return self._fetch(url, params, probe)
+
+    def _fetch(self, url, params, probe=None):
+        self._check_tokens()
+        ttl = self.cache.ttl(url) if self.cache is not None else None
+        headers = None
+        if ttl is not None:
+            key = self.cache.key(url, params, self.identity)
+            entry, fresh = self.cache.lookup(key)
+            if fresh:
+                data = codec.loads(entry["body"])
+                if probe is not None:
+                    probe.record.cache = "hit"
+                    probe.decoded()
+                return data
+            # A stale entry is revalidated with a conditional request, so an
+            # unchanged resource costs a 304 instead of the whole body
+            headers = self.cache.conditional_headers(entry)
+
+        send = self._renewing(
+            lambda: self.session.get(
+                self.server_url + url, params=params, headers=headers
+            ),
+            probe,
+        )
+        response = self.scheduler.send(endpoint_class(url), send)
+        if probe is not None:
+            probe.received(response, len(response.content))
+            if ttl is not None:
+                probe.record.cache = "miss"
+        if ttl is not None and response.status_code == 304 and entry is not None:
+            self.cache.revalidated(key, entry, ttl, response.headers)
+            data = codec.loads(entry["body"])
+            if probe is not None:
+                probe.record.cache = "revalidated"
+                probe.decoded()
+            return data
+        data = self._read_get_response(response)
+        if probe is not None:
+            probe.decoded()
+        if ttl is not None and response.status_code == 200:
+            self.cache.set(key, response.content, ttl, response.headers)
+        return data
+
+    def stream(self, url, params={}, chunk_size=65536):
+        """
+        Like get, but return the JSON parse events of the response body while
+        it downloads, for use with khan_api_wrapper.streaming.iter_items or
+        iter_tree_nodes. Without ijson installed, parsing takes 15 to 30 times
+        longer than get does, see khan_api_wrapper.streaming.
+        """
+        return iter_events(self._iter_body(url, params, chunk_size))
+
+    def _tree_events(self, url, params={}, fallback=False):
+        """
+        The parse events of a large response, streamed if ijson is installed
+        or `fallback` accepts the slow pure python parser, from the body
+        decoded whole otherwise
+        """
+        if fallback or has_ijson():
+            return self.stream(url, params)
+        return iter_value_events(self.get(url, params))
+
+    def _iter_body(self, url, params, chunk_size):
+        probe = self.instrumentation.probe("GET", url)
+        if probe is None:
+            yield from self._iter_fetch(url, params, chunk_size)
+            return
+        with probe:
+            yield from self._iter_fetch(url, params, chunk_size, probe)
+
+    def _iter_fetch(self, url, params, chunk_size, probe=None):
+        self._check_tokens()
+        ttl = self.cache.ttl(url) if self.cache is not None else None
+        headers = None
+        if ttl is not None:
+            key = self.cache.key(url, params, self.identity)
+            entry, fresh = self.cache.lookup(key)
+            if fresh:
+                if probe is not None:
+                    probe.record.cache = "hit"
+                yield from _iter_chunks(entry["body"], chunk_size)
+                return
+            headers = self.cache.conditional_headers(entry)
+
+        send = self._renewing(
+            lambda: self.session.get(
+                self.server_url + url, params=params, headers=headers, stream=True
+            ),
+            probe,
+        )
+        response = self.scheduler.send(endpoint_class(url), send)
+        if probe is not None:
+            probe.received(response)
+            if ttl is not None:
+                probe.record.cache = "miss"
+        with response:
+            if ttl is not None and response.status_code == 304 and entry is not None:
+                self.cache.revalidated(key, entry, ttl, response.headers)
+                if probe is not None:
+                    probe.record.cache = "revalidated"
+                yield from _iter_chunks(entry["body"], chunk_size)
+                return
+            response.raise_for_status()
+            # only keep the raw bytes when they are going into the cache
+            body = bytearray() if ttl is not None else None
+            last = None
+            size = 0
+            for chunk in response.iter_content(chunk_size):
+                if body is not None:
+                    body += chunk
+                if last is not None:
+                    yield last
+                last = chunk
+                size += len(chunk)
+            if probe is not None:
+                probe.streamed(size)
+            # store before the last chunk is handed out, as the parser may
+            # stop pulling chunks once the document is complete
+            if body is not None:
+                self.cache.set(key, bytes(body), ttl, response.headers)
+            if last is not None:
+                yield last
+
+    def _read_get_response(self, response):
         if self.authorized:
-            response = self.session.get(SERVER_URL + url, params=params)
             try:
-                return response.json()
+                return codec.loads(response.content)
             except ValueError:
                 # Checking if it was a server error, in which case we will let
                 # the programmer deal with a workaround. Otherwise, print the
@@ -119,17 +526,39 @@ class KhanAPI:
 
         else:
 
-            return requests.get(SERVER_URL + url, params=params).json()
+            return codec.loads(response.content)
 
-    def post(self, url, params, data, headers=None):
+    def post(self, url, params, data, headers=None, request_class=None):
+        """
+        :param: request_class, the endpoint class used to pick the retry
+            policy, see khan_api_wrapper.scheduler. Guessed from the url if
+            not given.
+        """
+        probe = self.instrumentation.probe("POST", url, data)
+        if probe is None:
+            return self._post(url, params, data, headers, request_class)
+        with probe:
+            return self._post(url, params, data, headers, request_class, probe)
+
+    def _post(self, url, params, data, headers, request_class, probe=None):
+        self._check_tokens()
         if headers:
-            response = self.session.post(
-                SERVER_URL + url, data=data, params=params, headers=headers
+            send = lambda: self.session.post(
+                self.server_url + url, data=data, params=params, headers=headers
             )
         else:
-            response = self.session.post(SERVER_URL + url, data=data, params=params)
+            send = lambda: self.session.post(
+                self.server_url + url, data=data, params=params
+            )
+        send = self._renewing(send, probe)
+        response = self.scheduler.send(request_class or endpoint_class(url), send)
+        if probe is not None:
+            probe.received(response, len(response.content))
         try:
-            return response.json()
+            data = codec.loads(response.content)
+            if probe is not None:
+                probe.decoded()
+            return data
         except ValueError:
             # Checking if it was a server error, in which case we will let
             # the programmer deal with a workaround. Otherwise, print the
@@ -236,6 +665,21 @@ class KhanAPI:
         """
         return self.get_resource("/api/v1/topictree", params={"kind": kind})
 
+    def iter_topictree(self, kind=None, fallback=False):
+        """
+        Streaming version of topictree. Yields every node of the tree, without
+        its children, as soon as it is parsed. Children are yielded before
+        their parent, and memory use does not grow with the size of the tree.
+        Streaming needs ijson: without it the body is decoded whole first,
+        since the pure python parser takes 15 to 30 times longer.
+        :param: kind, same as for topictree
+        :param: fallback, stream with the pure python parser when ijson is
+            missing, trading time for flat memory use
+        """
+        return iter_tree_nodes(
+            self._tree_events("/api/v1/topictree", {"kind": kind}, fallback)
+        )
+
     # USER. All User methods require authentication
     def user(self, identifier={}):
         """Retrieve data about a user. If no identifier is provided, it will
@@ -288,6 +732,15 @@ class KhanAPI:
         """
         return self.get_resource("/api/v1/user/exercises/progress_changes", params)
 
+    def activity_sync(self, store=None, **kwargs):
+        """
+        Return an ActivitySync, handing out only the progress changes and
+        problem logs that are new since its previous run.
+        :param: store, where the per (student, exercise) cursors are kept,
+            e.g. khan_api_wrapper.sync.JsonStateStore(path). In memory if None.
+        """
+        return ActivitySync(self, store or MemoryStateStore(), **kwargs)
+
     def user_progress_summary(self, kind, identifier={}):
         """
         Return progress for a content type with started and completed lists.
@@ -342,6 +795,16 @@ class KhanAPI:
         r = self.get_resource("/api/internal/user/students/progress", params)
         return r["students"]
 
+    def roster_sync(self, store=None, **kwargs):
+        """
+        Return a RosterSync keeping a local snapshot of get_student_list up to
+        date, only asking for the students changed since its last sync.
+        :param: store, where the snapshot and its high-water mark are kept,
+            e.g. khan_api_wrapper.sync.JsonStateStore(path). In memory if None.
+        Other keywords are passed to RosterSync.
+        """
+        return RosterSync(self, store or MemoryStateStore(), **kwargs)
+
     def get_student_progress(self, kaid, params={}):
         endpoint = "/api/internal/user/{}/progress".format(kaid)
         response = self.get_resource(endpoint, params)
@@ -349,6 +812,41 @@ class KhanAPI:
             return response["students"][0]
         return response
 
+    def iter_class_progress(
+        self,
+        kaids=None,
+        class_id=None,
+        source="rest",
+        max_workers=8,
+        params=None,
+        graphql_threshold=30,
+        **graphql_kwargs
+    ):
+        """
+        Yield a StudentProgress for every student of a class as soon as it is
+        fetched, with up to `max_workers` requests at once. A failed student
+        yields a StudentProgress holding the error, see
+        khan_api_wrapper.progress.
+        :param: kaids, the students to fetch, the students of class_id if None
+        :param: class_id, the class the students are in
+        :param: source, "rest" for get_student_progress of every student,
+            "graphql" for the ProgressByStudent assignment completions of the
+            class, or "auto" for graphql when a class_id is given with no
+            kaids, or with more than `graphql_threshold` of them
+        :param: params, passed to get_student_progress
+        Other keywords are passed to iter_progress_by_student.
+        """
+        return iter_class_progress(
+            self,
+            kaids,
+            class_id,
+            source,
+            max_workers,
+            params,
+            graphql_threshold,
+            **graphql_kwargs
+        )
+
     def get_all_math_exercises(self):
         """
         This is an internal method found by watching network calls on the
@@ -359,76 +857,104 @@ class KhanAPI:
         """
         return self.get_resource("/api/internal/exercises/math_topics_and_exercises")
 
-    def get_many_exercises(self, exercises, kaid):
+    def get_many_exercises(self, exercises, kaid, max_workers=4):
         """
         Since the api restricts the url length to 2048 characters, and making a
         request for many exercises will often exceed this limit, this function will
         truncate the url below the limit, and tie the responses together.
         This function fetches as exercise1,exercise2,... instead of
         exercise=exercise1&exercise=exercise2,...
+        The chunks are fetched concurrently by up to `max_workers` threads and
+        returned in sorted exercise order. If some chunks fail, a
+        PartialResultError holding the data of the others is raised.
         """
-        exercises.sort()
-        out = []
-        tmp_lst = []
-        params = {"exercises": [], "kaid": kaid}
-        while exercises:
-            s = ""
-            tmp_lst = []
-            for exercise in exercises:
-                t = s + "," + exercise
-                if len(t) < 1500:
-                    s += "," + exercise
-                    tmp_lst.append(exercise)
-                else:
-                    break
-            exercises = [x for x in exercises if x not in tmp_lst]
-            url = "/api/v1/user/exercises"
-            params["exercises"] = ",".join(tmp_lst)
-            response = self.get_resource(url, params)
-            data = response
-            for datum in data:
-                out.append(datum)
-        return out
+        url = "/api/v1/user/exercises"
+        chunks = list(_exercise_chunks(exercises))
+
+        def fetch(chunk):
+            try:
+                return self.get_resource(
+                    url, {"exercises": ",".join(chunk), "kaid": kaid}
+                )
+            except Exception as e:
+                return e
+
+        from concurrent.futures import ThreadPoolExecutor
+
+        with ThreadPoolExecutor(max_workers=max_workers) as pool:
+            results = list(pool.map(fetch, chunks))
+        return _merge_chunk_results(chunks, results)
 
     def get_all_exercise_names_and_titles(self):
         """
         (DEPRECATED) This seems to have missing exercises when compared with v2
-        This will recurse through the data returned by the topics endpoint to
+        This will walk through the data returned by the topics endpoint to
         parse a list of all the exercise names and titles available on Khan Academy
         """
+        return list(self.iter_all_exercise_names_and_titles())
 
-        def parse_data(data):
-            if type(data) == list:
-                return_dict = {}
-                for child in data:
-                    children = child.get("children")
-                    if children:
-                        return_dict = {**return_dict, **parse_data(children)}
-                    elif child.get("kind") == "Exercise":
-                        return_dict[child["id"]] = {
-                            "name": child["name"],
-                            "title": child["title"],
-                        }
-                return return_dict
-
-            children = data.get("children")
-            if children:
-                return parse_data(children)
-
-            if data.get("kind") == "Exercise":
-                return {data["id"]: {"name": data["name"], "title": data["title"]}}
-
-        topics = self.topictree("Exercise")
-        return list(parse_data(topics).values())
+    def iter_all_exercise_names_and_titles(self, fallback=False):
+        """
+        Streaming version of get_all_exercise_names_and_titles, yielding
+        {"name", "title"} dicts while the topic tree downloads.
+        :param: fallback, see iter_topictree
+        """
+        seen = set()
+        for node in self.iter_topictree("Exercise", fallback):
+            if node.get("kind") == "Exercise" and node["id"] not in seen:
+                seen.add(node["id"])
+                yield {"name": node["name"], "title": node["title"]}
+
+    def get_topic_tree_index(
+        self, kind="Exercise", path=None, max_age=None, fallback=False
+    ):
+        """
+        Return a TopicTree index of the v1 topic tree, built while the tree
+        streams in. See khan_api_wrapper.topic_tree.
+        :param: kind, same as for topictree
+        :param: fallback, see iter_topictree
+        :param: path, optional file to keep the index in. If it exists (and is
+            not older than `max_age` seconds) the index is loaded from it
+            instead of being fetched, otherwise the fresh index is saved there
+        """
+        if path and os.path.exists(path):
+            if max_age is None or time() - os.path.getmtime(path) < max_age:
+                return TopicTree.load(path)
+        nodes = iter_tree_nodes(
+            self._tree_events("/api/v1/topictree", {"kind": kind}, fallback),
+            with_depth=True,
+        )
+        tree = TopicTree.from_depth_nodes(nodes)
+        if path:
+            tree.save(path)
+        return tree
 
     def get_all_exercise_names_and_titles_v2(self):
         """
         This uses the /api/v2/ version of the topic tree. It takes longer, but
         the list of exercises is larger.
         """
+        return list(self.iter_exercises_v2())
+
+    def iter_exercises_v2(self, fallback=False):
+        """
+        Streaming version of get_all_exercise_names_and_titles_v2, yielding
+        the exercises of the v2 topic tree one at a time without building the
+        rest of the tree.
+        :param: fallback, see iter_topictree
+        """
+        endpoint = "/api/v2/topics/topictree"
+        return iter_items(
+            self._tree_events(endpoint, fallback=fallback), "exercises.item"
+        )
+
+    def iter_topics_v2(self, fallback=False):
+        """
+        Yield the topics of the v2 topic tree one at a time
+        :param: fallback, see iter_topictree
+        """
         endpoint = "/api/v2/topics/topictree"
-        tree = self.get_resource(endpoint)
-        return tree["exercises"]
+        return iter_items(self._tree_events(endpoint, fallback=fallback), "topics.item")
 
     def join_class(self, class_code):
         """
@@ -441,76 +967,150 @@ class KhanAPI:
     ###  GRAPHQL endpoints  ####################################################
     ############################################################################
 
-    def post_graphql(self, params={}, data={}):
+    def post_graphql(self, params={}, data={}, mutation=False):
         """
         Retrieve resources using the graphql schema
+        :param: mutation, True if `data` holds a mutation, so it is retried
+            with the more careful GRAPHQL_MUTATION policy
         """
         headers = {"content-type": "application/json"}
+        request_class = GRAPHQL_MUTATION if mutation else GRAPHQL_QUERY
+        url = "/api/internal/graphql"
+        if isinstance(data, str):
+            # the codec may leave non ascii characters in, which http.client
+            # would encode as latin-1
+            data = data.encode("utf-8")
+        send = lambda: self.post(url, params, data, headers, request_class)
+        # mutations are never coalesced, each one has to reach the server
+        if self.singleflight is not None and not mutation:
+            key = request_key("POST", url, params, data, self.identity)
+            return self.singleflight.do(key, send)
+        return send()
+
+    def graphql(self, operation, variables, opname=False):
+        """
+        Send a GraphQL operation and return the decoded response.
+        :param: operation, the name of an operation from graphql_schema (see
+            khan_api_wrapper.graphql.OPERATIONS) or an Operation
+        :param: variables, dict of the operation variables
+        :param: opname, also send the operation name as the `opname` url
+            param, as the Khan Academy site does for some operations
+        With persisted_queries enabled, only the hash of the query is sent,
+        and the full text only when the server does not know the hash yet.
+        """
+        op = get_operation(operation)
+        params = self._graphql_params(op.name if opname else None)
+        if not self.persisted_queries:
+            return self.post_graphql(params, op.payload(variables), op.is_mutation)
 
-        return self.post("/api/internal/graphql", params, data, headers)
+        response = self.post_graphql(
+            params, op.payload(variables, "hash"), op.is_mutation
+        )
+        error = persisted_query_error(response)
+        if error is None:
+            return response
+        if error == PERSISTED_QUERY_NOT_SUPPORTED:
+            self.persisted_queries = False
+            return self.post_graphql(params, op.payload(variables), op.is_mutation)
+        return self.post_graphql(
+            params, op.payload(variables, "register"), op.is_mutation
+        )
 
-    # QUERIES
+    def graphql_batch(self, requests, max_batch_size=20, mode="alias"):
+        """
+        Send many GraphQL operations in as few requests as possible, and return
+        one response per operation, in order.
+        :param: requests, iterable of (operation, variables)
+        :param: max_batch_size, most operations sent in one request
+        :param: mode, "alias" to merge the operations into one document, or
+            "array" to send a JSON array of payloads (see khan_api_wrapper.batch)
+        """
+        responses = []
+        for chunk in plan_batches(requests, max_batch_size, mode):
+            if mode == "alias":
+                response = self.graphql(chunk.operation, chunk.merged_variables())
+            else:
+                response = self.post_graphql(
+                    self._graphql_params(), chunk.payload(), chunk.is_mutation
+                )
+            responses.extend(chunk.split(response))
+        return responses
 
-    def simple_completion_query(self, assignment_id):
-        data = {
-            "operationName": "simpleCompletionQuery",
-            "variables": {"assignmentId": assignment_id},
-            "query": gql.simpleCompletionQuery,
-        }
+    def batch(self, max_batch_size=20, mode="alias"):
+        """Return a GraphQLBatch collecting operations for graphql_batch"""
+        return GraphQLBatch(self, max_batch_size, mode)
 
-        params = {"lang": "en", "_": round(time() * 1000)}
+    _paginate = staticmethod(paginate)
 
-        return self.post_graphql(params, json.dumps(data))
+    def _graphql_params(self, opname=None):
+        params = {"lang": "en"}
+        if opname:
+            params["opname"] = opname
+        if self.cache_buster:
+            params["_"] = round(time() * 1000)
+        return params
 
-    def get_students_list(self, hasClassId=False, classId="", pageSize=1000):
-        data = {
-            "operationName": "getStudentsList",
-            "variables": {
-                "hasClassId": hasClassId,
-                "classId": classId,
-                "pageSize": pageSize,
-            },
-            "query": gql.getStudentsList,
-        }
+    # QUERIES
 
-        params = {"lang": "en", "_": round(time() * 1000)}
+    def simple_completion_query(self, assignment_id):
+        variables = {"assignmentId": assignment_id}
+
+        return self.graphql("simpleCompletionQuery", variables)
+
+    def simple_completion_queries(self, assignment_ids, max_batch_size=20):
+        """simple_completion_query for many assignments, in batched requests"""
+        return self.graphql_batch(
+            (
+                ("simpleCompletionQuery", {"assignmentId": assignment_id})
+                for assignment_id in assignment_ids
+            ),
+            max_batch_size,
+        )
+
+    def get_students_list(
+        self, hasClassId=False, classId="", pageSize=1000, after=None, fields=None
+    ):
+        """
+        :param: fields, optional response paths to ask for instead of the
+            whole query, see khan_api_wrapper.projection
+        """
+        variables = {
+            "hasClassId": hasClassId,
+            "classId": classId,
+            "pageSize": pageSize,
+            "after": after,
+        }
 
-        return self.post_graphql(params, json.dumps(data))
+        return self.graphql(_projected("getStudentsList", fields), variables)
 
     def get_progress_by_student(
-        self, class_id, dueAfter=None, dueBefore=None, contentKinds=None, pageSize=None
+        self,
+        class_id,
+        dueAfter=None,
+        dueBefore=None,
+        contentKinds=None,
+        pageSize=None,
+        after=None,
+        fields=None,
     ):
-
-        data = {
-            "operationName": "ProgressByStudent",
-            "query": gql.progressByStudent,
-            "variables": {
-                "classId": class_id,
-                "assignmentFilters": {"dueAfter": dueAfter, "dueBefore": dueBefore},
-                "contentKinds": contentKinds,
-                "pageSize": pageSize,
-            },
+        """
+        :param: fields, optional response paths to ask for instead of the
+            whole query, see khan_api_wrapper.projection
+        """
+        variables = {
+            "classId": class_id,
+            "assignmentFilters": {"dueAfter": dueAfter, "dueBefore": dueBefore},
+            "contentKinds": contentKinds,
+            "pageSize": pageSize,
+            "after": after,
         }
 
-        params = {"lang": "en", "_": round(time() * 1000)}
-
-        return self.post_graphql(params, json.dumps(data))
+        return self.graphql(_projected("ProgressByStudent", fields), variables)
 
     def auto_assignable_students(self, student_list_id):
+        variables = {"studentListId": student_list_id}
 
-        data = {
-            "operationName": "AutoAssignableStudents",
-            "query": gql.AutoAssignableStudents,
-            "variables": {"studentListId": student_list_id},
-        }
-
-        params = {
-            "lang": "en",
-            "_": round(time() * 1000),
-            "opname": "AutoAssignableStudents",
-        }
-
-        return self.post_graphql(params, json.dumps(data))
+        return self.graphql("AutoAssignableStudents", variables, opname=True)
 
     def coach_assignments(self, student_list_id, **kwargs):
         """
@@ -521,48 +1121,103 @@ class KhanAPI:
             isDraft: Boolean,
             orderBy: String of type "DUE_DATE_ASC",
             pageSize: Int 
+            after: cursor of the page to fetch, see iter_coach_assignments
+            fields: response paths to ask for instead of the whole query, see
+                khan_api_wrapper.projection
         """
-        data = {
-            "operationName": "CoachAssignments",
-            "query": gql.CoachAssignments,
-            "variables": {
-                "after": None,
-                "assignmentFilters": {
-                    "dueAfter": kwargs.get("dueAfter"),
-                    "dueBefore": kwargs.get("dueBefore"),
-                    "isDraft": kwargs.get("isDraft", False),
-                },
+        variables = {
+            "after": kwargs.get("after"),
+            "assignmentFilters": {
                 "dueAfter": kwargs.get("dueAfter"),
                 "dueBefore": kwargs.get("dueBefore"),
                 "isDraft": kwargs.get("isDraft", False),
-                "orderBy": kwargs.get("orderBy", "DUE_DATE_ASC"),
-                "pageSize": kwargs.get("pageSize", 100),
-                "studentListId": student_list_id,
             },
+            "dueAfter": kwargs.get("dueAfter"),
+            "dueBefore": kwargs.get("dueBefore"),
+            "isDraft": kwargs.get("isDraft", False),
+            "orderBy": kwargs.get("orderBy", "DUE_DATE_ASC"),
+            "pageSize": kwargs.get("pageSize", 100),
+            "studentListId": student_list_id,
         }
 
-        params = {"lang": "en", "_": round(time() * 1000), "opname": "CoachAssignments"}
-
-        return self.post_graphql(params, json.dumps(data))
+        operation = _projected("CoachAssignments", kwargs.get("fields"))
+        return self.graphql(operation, variables, opname=True)
 
     def quiz_unit_test_attempts_query(self, topic_id, **kwargs):
         """
         Get the progress of the logged in user of quiz and unit tests for the
         given topic id. 
         """
-        data = {
-            "operationName": "quizAndUnitTestAttemptsQuery",
-            "query": gql.quizAndUnitTestAttemptsQuery,
-            "variables": {"topicId": topic_id},
-        }
+        variables = {"topicId": topic_id}
 
-        params = {
-            "lang": "en",
-            "_": round(time() * 1000),
-            "opname": "quizAndUnitTestAttemptsQuery",
-        }
+        return self.graphql("quizAndUnitTestAttemptsQuery", variables, opname=True)
+
+    # PAGED QUERIES
+    # These follow the page cursors of the queries above, fetching one page at
+    # a time. With prefetch=True the next page is requested while the current
+    # one is being consumed.
+
+    def iter_students(
+        self, hasClassId=False, classId="", pageSize=100, prefetch=False, fields=None
+    ):
+        """
+        Yield every student of the coach, or of the class `classId` if
+        hasClassId is True, following the pages of get_students_list.
+        :param: fields, optional list of the student fields to ask for, e.g.
+            ["kaid", "coachNickname"]
+        """
+        paths = students_fields(fields) if fields else None
+        return self._paginate(
+            lambda after: self.get_students_list(
+                hasClassId, classId, pageSize, after, paths
+            ),
+            students_page,
+            prefetch,
+        )
 
-        return self.post_graphql(params, json.dumps(data))
+    def iter_progress_by_student(
+        self,
+        class_id,
+        dueAfter=None,
+        dueBefore=None,
+        contentKinds=None,
+        pageSize=50,
+        prefetch=False,
+        fields=None,
+    ):
+        """
+        Yield every assignment of a class, with the completion states of its
+        students, following the pages of get_progress_by_student.
+        :param: fields, optional list of the assignment fields to ask for, e.g.
+            ["id", "itemCompletionStates.studentKaid"]
+        """
+        paths = assignments_fields(fields) if fields else None
+        return self._paginate(
+            lambda after: self.get_progress_by_student(
+                class_id, dueAfter, dueBefore, contentKinds, pageSize, after, paths
+            ),
+            assignments_page,
+            prefetch,
+        )
+
+    def iter_coach_assignments(
+        self, student_list_id, prefetch=False, fields=None, **kwargs
+    ):
+        """
+        Yield every assignment of a class, following the pages of
+        coach_assignments. Takes the same filtering keywords.
+        :param: fields, optional list of the assignment fields to ask for
+        """
+        kwargs.pop("after", None)
+        if fields:
+            kwargs["fields"] = assignments_fields(fields)
+        return self._paginate(
+            lambda after: self.coach_assignments(
+                student_list_id, after=after, **kwargs
+            ),
+            assignments_page,
+            prefetch,
+        )
 
     # MUTATIONS
 
@@ -571,15 +1226,9 @@ class KhanAPI:
         A method to remove inactive students from being coached.
         :param: kaids, list of kaids you want to stop coaching
         """
-        data = {
-            "operationName": "stopCoaching",
-            "variables": {"coachRequestIds": [], "invitationIds": [], "kaids": kaids},
-            "query": gql.stopCoaching,
-        }
-
-        params = {"lang": "en", "_": round(time() * 1000)}
+        variables = {"coachRequestIds": [], "invitationIds": [], "kaids": kaids}
 
-        return self.post_graphql(params, json.dumps(data))
+        return self.graphql("stopCoaching", variables)
 
     def transfer_students(self, fromListIds, toListIds, kaids):
         """
@@ -589,15 +1238,15 @@ class KhanAPI:
         :param: kaids, list of kaids that are being transferred
         if toListIds = [], will remove kaids from the course
         """
-        data = {
-            "operationName": "transferStudents",
-            "variables": {"coachRequestIds": [], "invitationIds": [], "kaids": kaids},
-            "query": gql.transferStudents,
+        variables = {
+            "fromListIds": fromListIds,
+            "toListIds": toListIds,
+            "coachRequestIds": [],
+            "invitationIds": [],
+            "kaids": kaids,
         }
 
-        params = {"lang": "en", "_": round(time() * 1000)}
-
-        return self.post_graphql(params, json.dumps(data))
+        return self.graphql("transferStudents", variables)
 
     def update_auto_assign(self, student_list_id, student_kaids, auto_assign=True):
         """
@@ -607,19 +1256,20 @@ class KhanAPI:
         :param: student_kaids, a list of kaids for students being included
         :param: auto_assign, boolean to determine if these students should be included
         """
-        data = {
-            "operationName": "updateAutoAssign",
-            "query": gql.updateAutoAssign,
-            "variables": {
-                "studentListId": student_list_id,
-                "studentKaids": student_kaids,
-                "autoAssign": auto_assign,
-            },
+        variables = {
+            "studentListId": student_list_id,
+            "studentKaids": student_kaids,
+            "autoAssign": auto_assign,
         }
 
-        params = {"lang": "en", "_": round(time() * 1000), "opname": "updateAutoAssign"}
+        return self.graphql("updateAutoAssign", variables, opname=True)
 
-        return self.post_graphql(params, json.dumps(data))
+    def bulk_roster(self, batch_size=50, max_workers=4):
+        """
+        Return a BulkRoster, to transfer, remove or stop coaching many students
+        in concurrent batches, with a per kaid report of what failed.
+        """
+        return BulkRoster(self, batch_size, max_workers)
 
     def publish_assignment(self, assignment_id):
         """
@@ -628,17 +1278,6 @@ class KhanAPI:
         of saved assignment ids can be found using coach_assignments method, passing
         isDraft=True keyword.
         """
-        data = {
-            "operationName": "publishAssignment",
-            "query": gql.publishAssignment,
-            "variables": {"assignmentId": assignment_id},
-        }
-
-        params = {
-            "lang": "en",
-            "_": round(time() * 1000),
-            "opname": "publishAssignment",
-        }
-
-        return self.post_graphql(params, json.dumps(data))
+        variables = {"assignmentId": assignment_id}
 
+        return self.graphql("publishAssignment", variables, opname=True)
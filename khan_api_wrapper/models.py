@@ -0,0 +1,384 @@
+"""
+Compact typed records for the results held in memory in large numbers:
+students, user exercise rows and assignment completion states. A record
+keeps its fields in __slots__ instead of a dict, interns the ids repeated
+across records, and converts dates to datetimes on first access only, so a
+large result set takes a fraction of the memory of the decoded JSON.
+
+    students = models.students(kapi.get_student_list())
+    states = models.completion_states(kapi.simple_completion_query(assignment_id))
+    for state in states:
+        state.student.kaid, state.completedOn, state.bestScore.numCorrect
+
+The lists returned are RecordLists over the raw payload: a dict becomes a
+record the first time it is accessed, or all at once with materialize(), and
+the raw dicts are freed once the payload itself is no longer referenced.
+Attributes keep the names of the payload keys, the graphql __typename is kept
+in `typename`, and keys a model does not know in `extra`. Records also support
+record["key"] and record.get("key"), so code written against the dicts keeps
+working, except that dates come back as datetimes.
+"""
+
+import sys
+from collections.abc import Sequence
+from datetime import datetime, timezone
+from khan_api_wrapper.graphql import dig
+
+
+def parse_date(value):
+    """
+    datetime of an api timestamp such as "2019-01-08T06:59:59.999Z", in UTC,
+    or the value itself if it is not one
+    """
+    if not isinstance(value, str):
+        return value
+    try:
+        date = datetime.fromisoformat(value.replace("Z", "+00:00"))
+    except ValueError:
+        return value
+    if date.tzinfo is None:
+        date = date.replace(tzinfo=timezone.utc)
+    return date
+
+
+class _LazyDate:
+    """Field holding a timestamp string, replaced by its datetime when read"""
+
+    __slots__ = ("slot",)
+
+    def __init__(self, slot):
+        self.slot = slot
+
+    def __get__(self, record, owner=None):
+        if record is None:
+            return self
+        value = self.slot.__get__(record)
+        if value.__class__ is str:
+            value = parse_date(value)
+            self.slot.__set__(record, value)
+        return value
+
+    def __set__(self, record, value):
+        self.slot.__set__(record, value)
+
+
+class Record:
+    """
+    Base of the models. Subclasses list their fields in __slots__, with
+    a leading underscore for the date fields, which are then read through a
+    lazy datetime conversion. `nested` maps a field to the model of its
+    value, or to [model] for a list of them, and `interned` names the string
+    fields worth interning.
+    """
+
+    __slots__ = ("typename", "extra")
+    nested = {}
+    interned = ()
+
+    def __init_subclass__(cls, **kwargs):
+        super().__init_subclass__(**kwargs)
+        keys = []
+        for klass in reversed(cls.__mro__[:-2]):
+            for slot in klass.__dict__.get("__slots__", ()):
+                key = slot[1:] if slot.startswith("_") else slot
+                if slot != key:
+                    setattr(cls, key, _LazyDate(klass.__dict__[slot]))
+                keys.append(key)
+        cls._keys = tuple(keys)
+        cls._known = frozenset(keys + ["__typename"])
+
+    @classmethod
+    def from_dict(cls, data):
+        record = cls.__new__(cls)
+        nested = cls.nested
+        interned = cls.interned
+        for key in cls._keys:
+            value = data.get(key)
+            if value is not None:
+                if key in nested:
+                    value = _convert(nested[key], value)
+                elif key in interned and value.__class__ is str:
+                    value = sys.intern(value)
+            object.__setattr__(record, key, value)
+        typename = data.get("__typename")
+        record.typename = sys.intern(typename) if typename is not None else None
+        extra = None
+        if not cls._known.issuperset(data):
+            extra = {k: v for k, v in data.items() if k not in cls._known}
+        record.extra = extra
+        return record
+
+    def to_dict(self):
+        """
+        The record as a dict, with dates back in the api format. Fields that
+        are None are left out, the payload not telling them from missing keys.
+        """
+        data = {}
+        for key in self._keys:
+            value = getattr(self, key)
+            if value is None:
+                continue
+            if isinstance(value, Record):
+                value = value.to_dict()
+            elif isinstance(value, list):
+                value = [v.to_dict() if isinstance(v, Record) else v for v in value]
+            elif isinstance(value, datetime):
+                value = _format_date(value)
+            data[key] = value
+        if self.typename is not None:
+            data["__typename"] = self.typename
+        if self.extra:
+            data.update(self.extra)
+        return data
+
+    def __getitem__(self, key):
+        if key == "__typename":
+            return self.typename
+        if key in self._known:
+            return getattr(self, key)
+        if self.extra and key in self.extra:
+            return self.extra[key]
+        raise KeyError(key)
+
+    def get(self, key, default=None):
+        try:
+            value = self[key]
+        except KeyError:
+            return default
+        return default if value is None else value
+
+    def __contains__(self, key):
+        if key in self._known:
+            return self[key] is not None
+        return bool(self.extra and key in self.extra)
+
+    def __eq__(self, other):
+        if other.__class__ is not self.__class__:
+            return NotImplemented
+        return self.to_dict() == other.to_dict()
+
+    __hash__ = None
+
+    def __repr__(self):
+        shown = ", ".join(
+            "%s=%r" % (key, getattr(self, key))
+            for key in self._keys[:3]
+            if not isinstance(getattr(self, key), (list, Record))
+        )
+        return "<%s %s>" % (self.__class__.__name__, shown)
+
+
+def _format_date(value):
+    text = value.astimezone(timezone.utc).replace(tzinfo=None).isoformat()
+    if value.microsecond:
+        text = text[:-3]
+    return text + "Z"
+
+
+def _convert(model, value):
+    if isinstance(model, list):
+        return (
+            [_convert(model[0], v) for v in value] if isinstance(value, list) else value
+        )
+    if value.__class__ is dict:
+        return model.from_dict(value)
+    return value
+
+
+class RecordList(Sequence):
+    """
+    List of records over the raw dicts of a payload, each dict converted when
+    it is first accessed. Safe to share between threads: at worst an item
+    read by two of them at once is converted twice.
+    """
+
+    __slots__ = ("model", "items")
+
+    def __init__(self, model, items):
+        self.model = model
+        # a copy, so that the payload given, possibly shared with the other
+        # callers of a coalesced request, is left as it is
+        self.items = list(items)
+
+    def __len__(self):
+        return len(self.items)
+
+    def __getitem__(self, index):
+        if isinstance(index, slice):
+            return [self[i] for i in range(*index.indices(len(self.items)))]
+        item = self.items[index]
+        if item.__class__ is dict:
+            item = self.items[index] = self.model.from_dict(item)
+        return item
+
+    def __iter__(self):
+        for index in range(len(self.items)):
+            yield self[index]
+
+    def materialize(self):
+        """Convert every item now, freeing the raw dicts. Returns self"""
+        for index in range(len(self.items)):
+            self[index]
+        return self
+
+    def to_dicts(self):
+        return [item.to_dict() for item in self]
+
+    def __repr__(self):
+        return "<RecordList of %d %s>" % (len(self.items), self.model.__name__)
+
+
+# Models
+
+
+class Score(Record):
+    __slots__ = ("numCorrect", "numAttempted")
+
+
+class StudentRef(Record):
+    """The student of a completion state"""
+
+    __slots__ = ("id", "kaid", "coachNickname", "profileRoot")
+    interned = ("id", "kaid", "coachNickname", "profileRoot")
+
+
+class ExerciseAttempt(Record):
+    __slots__ = ("id", "isCompleted", "numAttempted", "numCorrect", "_lastAttemptDate")
+
+
+class CompletionState(Record):
+    """
+    An entry of itemCompletionStates, from simpleCompletionQuery (with a
+    `student`) or ProgressByStudent (with a `studentKaid`)
+    """
+
+    __slots__ = (
+        "student",
+        "studentKaid",
+        "state",
+        "_completedOn",
+        "bestScore",
+        "exerciseAttempts",
+    )
+    nested = {
+        "student": StudentRef,
+        "bestScore": Score,
+        "exerciseAttempts": [ExerciseAttempt],
+    }
+    interned = ("studentKaid", "state")
+
+    @property
+    def kaid(self):
+        """The kaid of the student, whichever query this came from"""
+        if self.studentKaid is not None:
+            return self.studentKaid
+        return self.student.kaid if self.student is not None else None
+
+
+class Content(Record):
+    __slots__ = ("id", "translatedTitle", "title", "kind", "defaultUrlPath")
+    interned = ("id", "kind")
+
+
+class Assignment(Record):
+    """An assignment of simpleCompletionQuery, ProgressByStudent or CoachAssignments"""
+
+    __slots__ = (
+        "id",
+        "_assignedDate",
+        "_dueDate",
+        "isDraft",
+        "subjectSlug",
+        "contents",
+        "itemCompletionStates",
+        "studentKaids",
+        "studentList",
+    )
+    nested = {"contents": [Content], "itemCompletionStates": [CompletionState]}
+    interned = ("subjectSlug",)
+
+
+class Student(Record):
+    """
+    A student of get_student_list, or of the students pages of
+    getStudentsList
+    """
+
+    __slots__ = (
+        "kaid",
+        "id",
+        "email",
+        "username",
+        "nickname",
+        "coachNickname",
+        "profileRoot",
+        "studentLists",
+        "_joined",
+        "_last_activity",
+        "points",
+        "total_seconds_watched",
+    )
+
+
+class UserExercise(Record):
+    """A row of user_exercises"""
+
+    __slots__ = (
+        "exercise",
+        "kaid",
+        "exercise_model",
+        "exercise_progress",
+        "exercise_states",
+        "streak",
+        "longest_streak",
+        "total_done",
+        "total_correct",
+        "last_attempt_number",
+        "last_count_hints",
+        "_last_done",
+        "_maximum_exercise_progress_dt",
+        "_proficient_date",
+        "practiced",
+        "mastered",
+        "struggling",
+    )
+    interned = ("exercise", "kaid")
+
+
+# Converters, taking the results of the client methods
+
+
+def students(items):
+    """RecordList of Student over get_student_list or iter_students results"""
+    return RecordList(Student, items)
+
+
+def user_exercises(rows):
+    """RecordList of UserExercise over a user_exercises result"""
+    return RecordList(UserExercise, rows)
+
+
+def completion_states(result):
+    """
+    RecordList of CompletionState over a simple_completion_query response,
+    or over a list of itemCompletionStates
+    """
+    if isinstance(result, dict):
+        result = dig(result, "coach", "assignment", "itemCompletionStates")
+    return RecordList(CompletionState, result)
+
+
+def assignment(result):
+    """
+    The Assignment of a simple_completion_query response, raising
+    GraphQLError if the response has none
+    """
+    return Assignment.from_dict(dig(result, "coach", "assignment"))
+
+
+def assignments(items):
+    """
+    RecordList of Assignment over assignments, e.g. the results of
+    iter_progress_by_student or iter_coach_assignments
+    """
+    return RecordList(Assignment, items)
@@ -0,0 +1,81 @@
+import base64
+import hashlib
+import hmac
+from time import time
+from urllib.parse import quote
+
+
+def _escape(value):
+    """Percent encode a value as required by the OAuth 1.0a spec"""
+    return quote(str(value), safe="~")
+
+
+def flatten_params(params):
+    """
+    Turn a params dict, as accepted by requests, into a list of (key, value)
+    string tuples. None values are dropped and list values are repeated, the
+    same way requests encodes them.
+    """
+    pairs = []
+    for key, value in (params or {}).items():
+        if value is None:
+            continue
+        if isinstance(value, (list, tuple)):
+            pairs.extend((key, str(v)) for v in value)
+        else:
+            pairs.append((key, str(value)))
+    return pairs
+
+
+class OAuth1Signer:
+    """
+    Signs requests with HMAC-SHA1 for transports that do not go through a
+    rauth session, placing the oauth parameters in the query string just like
+    the rauth session used by KhanAPI does.
+    """
+
+    def __init__(
+        self, consumer_key, consumer_secret, access_token, access_token_secret
+    ):
+        self.consumer_key = consumer_key
+        self.consumer_secret = consumer_secret
+        self.access_token = access_token
+        self.access_token_secret = access_token_secret
+
+    def sign(self, method, url, params=None):
+        """
+        Return the query parameters for a request, with the oauth parameters
+        and signature added, as a list of (key, value) tuples.
+        :param: method, the http method, like "GET"
+        :param: url, the full url of the request without a query string
+        :param: params, dict of query parameters
+        """
+        from uuid import uuid4
+
+        query = flatten_params(params)
+        oauth_params = [
+            ("oauth_consumer_key", self.consumer_key),
+            ("oauth_nonce", uuid4().hex),
+            ("oauth_signature_method", "HMAC-SHA1"),
+            ("oauth_timestamp", str(int(time()))),
+            ("oauth_token", self.access_token),
+            ("oauth_version", "1.0"),
+        ]
+
+        normalized = "&".join(
+            "%s=%s" % pair
+            for pair in sorted(
+                (_escape(k), _escape(v)) for k, v in query + oauth_params
+            )
+        )
+        base_string = "&".join(
+            [method.upper(), _escape(url), _escape(normalized)]
+        ).encode("utf-8")
+        key = (
+            _escape(self.consumer_secret) + "&" + _escape(self.access_token_secret)
+        ).encode("utf-8")
+        signature = base64.b64encode(
+            hmac.new(key, base_string, hashlib.sha1).digest()
+        ).decode("ascii")
+
+        return query + oauth_params + [("oauth_signature", signature)]
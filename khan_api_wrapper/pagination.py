@@ -0,0 +1,112 @@
+"""
+Iterators that follow the `nextCursor` of paged GraphQL queries, so every
+page is fetched as it is needed instead of asking for one huge page.
+"""
+
+from khan_api_wrapper.graphql import dig
+
+
+def students_page(response):
+    """(students, next cursor) of a getStudentsList response"""
+    coach = dig(response, "coach")
+    if coach.get("studentList"):
+        page = coach["studentList"]["studentsPage"]
+    else:
+        page = dig(response, "coach", "studentsPage")
+    return page["students"], page.get("nextCursor")
+
+
+def assignments_page(response):
+    """
+    (assignments, next cursor) of a CoachAssignments or ProgressByStudent
+    response
+    """
+    page = dig(response, "coach", "studentList", "assignmentsPage")
+    return page["assignments"], (page.get("pageInfo") or {}).get("nextCursor")
+
+
+def students_fields(fields):
+    """
+    Projection paths of getStudentsList (see khan_api_wrapper.projection)
+    asking for `fields` of every student, and for the page cursors
+    """
+    paths = []
+    for page in ("coach.studentsPage", "coach.studentList.studentsPage"):
+        paths.append(page + ".nextCursor")
+        paths.extend("%s.students.%s" % (page, field) for field in fields)
+    return paths
+
+
+def assignments_fields(fields):
+    """
+    Projection paths of CoachAssignments or ProgressByStudent asking for
+    `fields` of every assignment, and for the page cursors
+    """
+    page = "coach.studentList.assignmentsPage"
+    return [page + ".pageInfo.nextCursor"] + [
+        "%s.assignments.%s" % (page, field) for field in fields
+    ]
+
+
+def paginate(fetch, extract, prefetch=False):
+    """
+    Yield the items of every page of a paged query.
+    :param: fetch, function of the cursor (None for the first page) returning
+        the response for that page
+    :param: extract, function of a response returning (items, next cursor)
+    :param: prefetch, fetch the next page in a background thread while the
+        items of the current one are consumed
+    """
+    pool = None
+    if prefetch:
+        from concurrent.futures import ThreadPoolExecutor
+
+        pool = ThreadPoolExecutor(max_workers=1)
+    try:
+        cursor = None
+        response = fetch(None)
+        while True:
+            items, next_cursor = extract(response)
+            # stop on a repeated cursor rather than loop forever
+            if next_cursor == cursor:
+                next_cursor = None
+            upcoming = None
+            if next_cursor and pool is not None:
+                upcoming = pool.submit(fetch, next_cursor)
+            yield from items
+            if not next_cursor:
+                return
+            cursor = next_cursor
+            response = upcoming.result() if upcoming else fetch(cursor)
+    finally:
+        if pool is not None:
+            pool.shutdown(wait=False)
+
+
+async def apaginate(fetch, extract, prefetch=False):
+    """
+    Async version of paginate, for a `fetch` returning an awaitable. Yields
+    the items as an async generator.
+    """
+    import asyncio
+
+    cursor = None
+    response = await fetch(None)
+    while True:
+        items, next_cursor = extract(response)
+        if next_cursor == cursor:
+            next_cursor = None
+        upcoming = None
+        if next_cursor and prefetch:
+            upcoming = asyncio.ensure_future(fetch(next_cursor))
+        try:
+            for item in items:
+                yield item
+        except BaseException:
+            if upcoming is not None:
+                upcoming.cancel()
+            raise
+        if not next_cursor:
+            return
+        cursor = next_cursor
+        response = await (upcoming if upcoming is not None else fetch(cursor))
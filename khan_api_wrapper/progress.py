@@ -0,0 +1,225 @@
+"""
+Progress of a whole class, fetched concurrently. Results are handed out as
+they complete, and a student whose request failed gets a result holding the
+error instead of stopping the others.
+
+Two sources are available:
+    "rest", one get_student_progress request per student
+    "graphql", the ProgressByStudent query, a few paged requests for the
+        whole class holding the completion of every assignment, regrouped
+        per student. Much cheaper for large classes, but only covers
+        assignments.
+"""
+
+REST = "rest"
+GRAPHQL = "graphql"
+AUTO = "auto"
+
+
+class StudentProgress:
+    """
+    The progress of one student.
+    :param: progress, the get_student_progress response for "rest", or the
+        list of the student's assignment completions for "graphql"
+    :param: error, the exception raised fetching it, or None
+    """
+
+    __slots__ = ("kaid", "progress", "error", "source")
+
+    def __init__(self, kaid, progress=None, error=None, source=REST):
+        self.kaid = kaid
+        self.progress = progress
+        self.error = error
+        self.source = source
+
+    @property
+    def ok(self):
+        return self.error is None
+
+    def __repr__(self):
+        status = "ok" if self.ok else "failed: %r" % (self.error,)
+        return "<StudentProgress %s %s>" % (self.kaid, status)
+
+
+class ProgressError(Exception):
+    """The response for a student was a server error"""
+
+
+def _checked(kaid, response):
+    if isinstance(response, dict) and "error" in response and len(response) == 1:
+        raise ProgressError("Server error %s for %s" % (response["error"], kaid))
+    return StudentProgress(kaid, response)
+
+
+def pick_source(source, class_id, kaids, graphql_threshold):
+    """Resolve AUTO: the graphql query once a class is big enough"""
+    if source != AUTO:
+        if source == GRAPHQL and class_id is None:
+            raise ValueError("The graphql source needs a class_id")
+        return source
+    if class_id is not None and (kaids is None or len(kaids) > graphql_threshold):
+        return GRAPHQL
+    return REST
+
+
+def iter_completed(fetch, items, max_workers):
+    """
+    Yield fetch(item) for every item as the calls complete, with at most
+    `max_workers` running at once. Stopping the iteration cancels the calls
+    not started yet.
+    """
+    from concurrent.futures import ThreadPoolExecutor, wait, FIRST_COMPLETED
+
+    items = iter(items)
+    pool = ThreadPoolExecutor(max_workers=max_workers)
+    pending = set()
+    try:
+        for item in items:
+            pending.add(pool.submit(fetch, item))
+            if len(pending) >= max_workers:
+                break
+        while pending:
+            done, pending = wait(pending, return_when=FIRST_COMPLETED)
+            for future in done:
+                for item in items:
+                    pending.add(pool.submit(fetch, item))
+                    break
+                yield future.result()
+    finally:
+        for future in pending:
+            future.cancel()
+        pool.shutdown(wait=False)
+
+
+def group_assignments(assignments, kaids=None):
+    """
+    Regroup the assignments of ProgressByStudent per student: kaid -> list of
+    {"assignment": assignment without its completion states, "completedOn",
+    "bestScore"}
+    :param: kaids, optional kaids to keep, every student found otherwise
+    """
+    wanted = set(kaids) if kaids is not None else None
+    students = {kaid: [] for kaid in kaids} if kaids is not None else {}
+    for assignment in assignments:
+        states = assignment.get("itemCompletionStates") or []
+        info = {k: v for k, v in assignment.items() if k != "itemCompletionStates"}
+        for state in states:
+            kaid = state.get("studentKaid")
+            if wanted is not None and kaid not in wanted:
+                continue
+            completion = {k: v for k, v in state.items() if k != "studentKaid"}
+            students.setdefault(kaid, []).append({"assignment": info, **completion})
+    return students
+
+
+def iter_class_progress(
+    client,
+    kaids=None,
+    class_id=None,
+    source=REST,
+    max_workers=8,
+    params=None,
+    graphql_threshold=30,
+    **graphql_kwargs
+):
+    """
+    Implementation of KhanAPI.iter_class_progress, see there
+    """
+    if kaids is None and class_id is None:
+        raise ValueError("Give a class_id or a list of kaids")
+    if kaids is not None:
+        kaids = list(kaids)
+    source = pick_source(source, class_id, kaids, graphql_threshold)
+
+    if source == GRAPHQL:
+        try:
+            assignments = list(
+                client.iter_progress_by_student(class_id, **graphql_kwargs)
+            )
+        except Exception as exc:
+            if kaids is None:
+                raise
+            for kaid in kaids:
+                yield StudentProgress(kaid, error=exc, source=GRAPHQL)
+            return
+        for kaid, completions in group_assignments(assignments, kaids).items():
+            yield StudentProgress(kaid, completions, source=GRAPHQL)
+        return
+
+    if kaids is None:
+        kaids = [
+            student["kaid"]
+            for student in client.iter_students(True, class_id, fields=["kaid"])
+        ]
+
+    def fetch(kaid):
+        try:
+            return _checked(kaid, client.get_student_progress(kaid, params or {}))
+        except Exception as exc:
+            return StudentProgress(kaid, error=exc)
+
+    yield from iter_completed(fetch, kaids, max_workers)
+
+
+async def aiter_class_progress(
+    client,
+    kaids=None,
+    class_id=None,
+    source=REST,
+    max_workers=8,
+    params=None,
+    graphql_threshold=30,
+    **graphql_kwargs
+):
+    """
+    Async generator version of iter_class_progress, for AsyncKhanAPI
+    """
+    import asyncio
+
+    if kaids is None and class_id is None:
+        raise ValueError("Give a class_id or a list of kaids")
+    if kaids is not None:
+        kaids = list(kaids)
+    source = pick_source(source, class_id, kaids, graphql_threshold)
+
+    if source == GRAPHQL:
+        try:
+            assignments = [
+                a
+                async for a in client.iter_progress_by_student(
+                    class_id, **graphql_kwargs
+                )
+            ]
+        except Exception as exc:
+            if kaids is None:
+                raise
+            for kaid in kaids:
+                yield StudentProgress(kaid, error=exc, source=GRAPHQL)
+            return
+        for kaid, completions in group_assignments(assignments, kaids).items():
+            yield StudentProgress(kaid, completions, source=GRAPHQL)
+        return
+
+    if kaids is None:
+        kaids = [
+            student["kaid"]
+            async for student in client.iter_students(True, class_id, fields=["kaid"])
+        ]
+
+    semaphore = asyncio.Semaphore(max_workers)
+
+    async def fetch(kaid):
+        async with semaphore:
+            try:
+                response = await client.get_student_progress(kaid, params or {})
+                return _checked(kaid, response)
+            except Exception as exc:
+                return StudentProgress(kaid, error=exc)
+
+    tasks = [asyncio.ensure_future(fetch(kaid)) for kaid in kaids]
+    try:
+        for task in asyncio.as_completed(tasks):
+            yield await task
+    finally:
+        for task in tasks:
+            task.cancel()
@@ -0,0 +1,499 @@
+"""
+Trimmed variants of the operations of graphql_schema, asking only for the
+fields a caller reads. The schema queries ask for everything, including
+`__typename` on every object, which makes the responses for large classes
+several times bigger than needed.
+
+    from khan_api_wrapper.projection import project
+
+    op = project("getStudentsList", [
+        "coach.studentsPage.students.kaid",
+        "coach.studentsPage.students.coachNickname",
+        "coach.studentsPage.nextCursor",
+    ])
+    kapi.graphql(op, variables)
+
+Paths are dot separated response keys (the alias of a field when it has
+one), and fragments are looked through: `students` above comes from the
+StudentField fragment. A path ending on an object keeps its whole selection.
+Fragments stay named, trimmed to the union of the fields asked for wherever
+they are used. Variables the trimmed document no longer uses are dropped
+from its definitions and from the variables sent.
+"""
+
+import re
+from functools import lru_cache
+from khan_api_wrapper.graphql import Operation, get_operation
+
+_TOKEN = re.compile(
+    r'\.\.\.|[{}()\[\]:@$!=,]|"(?:\\.|[^"\\])*"'
+    r"|-?\d+(?:\.\d+)?(?:[eE][-+]?\d+)?|[_A-Za-z]\w*"
+)
+_IGNORED = re.compile(r"(?:\s|#[^\n]*)+")
+
+
+def _tokenize(document):
+    tokens = []
+    pos = _IGNORED.match(document, 0)
+    pos = pos.end() if pos else 0
+    while pos < len(document):
+        match = _TOKEN.match(document, pos)
+        if not match:
+            raise ValueError("Invalid GraphQL at: %r" % document[pos : pos + 20])
+        tokens.append(match.group())
+        pos = match.end()
+        ignored = _IGNORED.match(document, pos)
+        if ignored:
+            pos = ignored.end()
+    return tokens
+
+
+def _is_word(token):
+    return token[0] not in "{}()[]:@$!=,."
+
+
+def _render(tokens):
+    """Render the tokens of arguments, directives or types"""
+    out = []
+    previous = ""
+    for token in tokens:
+        if token == ",":
+            out.append(", ")
+        elif token == ":":
+            out.append(": ")
+        elif token == "=":
+            out.append(" = ")
+        elif token == "@":
+            out.append(" @")
+        elif previous and _is_word(token) and _is_word(previous):
+            out.append(" " + token)
+        else:
+            out.append(token)
+        previous = token
+    return "".join(out)
+
+
+def _variables_in(tokens):
+    return {tokens[i + 1] for i, token in enumerate(tokens[:-1]) if token == "$"}
+
+
+class _Field:
+    __slots__ = ("alias", "name", "arguments", "directives", "selections")
+
+    def __init__(self, alias, name, arguments, directives, selections):
+        self.alias = alias
+        self.name = name
+        # token lists, the arguments with their parentheses
+        self.arguments = arguments
+        self.directives = directives
+        self.selections = selections
+
+    @property
+    def key(self):
+        return self.alias or self.name
+
+
+class _Spread:
+    __slots__ = ("name", "directives")
+
+    def __init__(self, name, directives):
+        self.name = name
+        self.directives = directives
+
+
+class _InlineFragment:
+    __slots__ = ("type_condition", "directives", "selections")
+
+    def __init__(self, type_condition, directives, selections):
+        self.type_condition = type_condition
+        self.directives = directives
+        self.selections = selections
+
+
+class _Parser:
+    def __init__(self, document):
+        self.tokens = _tokenize(document)
+        self.pos = 0
+
+    def peek(self):
+        return self.tokens[self.pos] if self.pos < len(self.tokens) else None
+
+    def next(self):
+        token = self.peek()
+        if token is None:
+            raise ValueError("Unexpected end of GraphQL document")
+        self.pos += 1
+        return token
+
+    def expect(self, token):
+        if self.next() != token:
+            raise ValueError(
+                "Expected %r in GraphQL document, got %r"
+                % (token, self.tokens[self.pos - 1])
+            )
+
+    def parse(self):
+        """
+        Return (operation type, name, variable definitions, directives,
+        selections, fragments) where the variable definitions are a list of
+        (name, type tokens) and fragments a dict of name ->
+        (type condition, directives, selections)
+        """
+        operation = None
+        fragments = {}
+        while self.peek() is not None:
+            if self.peek() == "fragment":
+                self.next()
+                name = self.next()
+                self.expect("on")
+                type_condition = self.next()
+                directives = self.directives()
+                fragments[name] = (type_condition, directives, self.selection_set())
+            elif operation is None:
+                kind = self.next()
+                if kind not in ("query", "mutation"):
+                    raise ValueError("Document does not start with an operation")
+                name = self.next()
+                definitions = self.variable_definitions()
+                operation = (kind, name, definitions, self.directives())
+                operation += (self.selection_set(),)
+            else:
+                raise ValueError("Only documents with a single operation are supported")
+        if operation is None:
+            raise ValueError("Document has no operation")
+        return operation + (fragments,)
+
+    def group(self):
+        """The tokens of a bracketed group, brackets included"""
+        opening = self.peek()
+        closing = {"(": ")", "[": "]", "{": "}"}[opening]
+        tokens = []
+        depth = 0
+        while True:
+            token = self.next()
+            tokens.append(token)
+            if token == opening:
+                depth += 1
+            elif token == closing:
+                depth -= 1
+                if not depth:
+                    return tokens
+
+    def variable_definitions(self):
+        if self.peek() != "(":
+            return []
+        tokens = self.group()[1:-1]
+        definitions = []
+        for token in tokens:
+            if token == "$":
+                definitions.append([None, []])
+            elif definitions and definitions[-1][0] is None:
+                definitions[-1][0] = token
+            elif definitions:
+                definitions[-1][1].append(token)
+        # drop the separating commas, and the ":" before the type
+        return [
+            (name, [t for t in type_tokens if t != ","][1:])
+            for name, type_tokens in definitions
+        ]
+
+    def directives(self):
+        directives = []
+        while self.peek() == "@":
+            tokens = [self.next(), self.next()]
+            if self.peek() == "(":
+                tokens += self.group()
+            directives.append(tokens)
+        return directives
+
+    def selection_set(self):
+        self.expect("{")
+        selections = []
+        while self.peek() != "}":
+            if self.peek() == ",":
+                self.next()
+                continue
+            selections.append(self.selection())
+        self.next()
+        return selections
+
+    def selection(self):
+        if self.peek() == "...":
+            self.next()
+            if self.peek() == "on":
+                self.next()
+                type_condition = self.next()
+                directives = self.directives()
+                return _InlineFragment(type_condition, directives, self.selection_set())
+            if self.peek() in ("@", "{"):
+                directives = self.directives()
+                return _InlineFragment(None, directives, self.selection_set())
+            return _Spread(self.next(), self.directives())
+        alias = None
+        name = self.next()
+        if self.peek() == ":":
+            self.next()
+            alias, name = name, self.next()
+        arguments = self.group() if self.peek() == "(" else []
+        directives = self.directives()
+        selections = self.selection_set() if self.peek() == "{" else None
+        return _Field(alias, name, arguments, directives, selections)
+
+
+def _normalize(fields):
+    """
+    Turn dotted paths, or nested dicts of key -> True / dict / paths, into a
+    nested dict of key -> True (keep everything) or dict
+    """
+    if fields is True:
+        return True
+    spec = {}
+    items = fields.items() if isinstance(fields, dict) else ((f, True) for f in fields)
+    for path, value in items:
+        head, _, rest = path.partition(".")
+        value = _normalize(value)
+        if rest:
+            value = _normalize({rest: value})
+        spec[head] = _merge(spec.get(head), value)
+    return spec
+
+
+def _merge(a, b):
+    if a is None:
+        return b
+    if b is None:
+        return a
+    if a is True or b is True:
+        return True
+    merged = dict(a)
+    for key, value in b.items():
+        merged[key] = _merge(merged.get(key), value)
+    return merged
+
+
+def _freeze(spec):
+    if spec is True:
+        return True
+    return tuple(sorted((key, _freeze(value)) for key, value in spec.items()))
+
+
+def _thaw(frozen):
+    if frozen is True:
+        return True
+    return {key: _thaw(value) for key, value in frozen}
+
+
+class _Projector:
+    def __init__(self, fragments, typename):
+        self.fragments = fragments
+        self.typename = typename
+        # fragment name -> union of the specs it is used with
+        self.fragment_specs = {}
+
+    def keys(self, selections, seen=()):
+        """Response keys available in a selection set, through fragments"""
+        keys = set()
+        for selection in selections:
+            if isinstance(selection, _Field):
+                keys.add(selection.key)
+            elif isinstance(selection, _Spread):
+                if selection.name not in seen:
+                    fragment = self.fragments[selection.name]
+                    keys |= self.keys(fragment[2], seen + (selection.name,))
+            else:
+                keys |= self.keys(selection.selections, seen)
+        return keys
+
+    def project(self, selections, spec, path=()):
+        if spec is not True:
+            unknown = set(spec) - self.keys(selections)
+            if unknown:
+                raise ValueError(
+                    "Unknown fields: %s"
+                    % ", ".join(sorted(".".join(path + (key,)) for key in unknown))
+                )
+        projected = []
+        for selection in selections:
+            if isinstance(selection, _Field):
+                if selection.name == "__typename":
+                    if self.typename or (spec is not True and selection.key in spec):
+                        projected.append(selection)
+                    continue
+                if spec is not True and selection.key not in spec:
+                    continue
+                sub = True if spec is True else spec[selection.key]
+                if selection.selections is None:
+                    if sub is not True:
+                        raise ValueError(
+                            "%s has no fields" % ".".join(path + (selection.key,))
+                        )
+                    projected.append(selection)
+                    continue
+                children = self.project(
+                    selection.selections, sub, path + (selection.key,)
+                )
+                if children:
+                    projected.append(
+                        _Field(
+                            selection.alias,
+                            selection.name,
+                            selection.arguments,
+                            selection.directives,
+                            children,
+                        )
+                    )
+            elif isinstance(selection, _Spread):
+                fragment = self.fragments[selection.name]
+                if spec is not True and not set(spec) & self.keys(fragment[2]):
+                    continue
+                if spec is not True:
+                    # only the part of the spec this fragment can answer
+                    keys = self.keys(fragment[2])
+                    spec_part = {k: v for k, v in spec.items() if k in keys}
+                else:
+                    spec_part = True
+                self.fragment_specs[selection.name] = _merge(
+                    self.fragment_specs.get(selection.name), spec_part
+                )
+                projected.append(selection)
+            else:
+                if spec is not True:
+                    keys = self.keys(selection.selections)
+                    spec_part = {k: v for k, v in spec.items() if k in keys}
+                    if not spec_part:
+                        continue
+                else:
+                    spec_part = True
+                children = self.project(selection.selections, spec_part, path)
+                if children:
+                    projected.append(
+                        _InlineFragment(
+                            selection.type_condition, selection.directives, children
+                        )
+                    )
+        return projected
+
+    def project_fragments(self):
+        """Project every fragment used, with the union of its specs"""
+        projected = {}
+        done = {}
+        while True:
+            pending = [
+                name
+                for name, spec in self.fragment_specs.items()
+                if done.get(name) != spec
+            ]
+            if not pending:
+                return projected
+            for name in pending:
+                spec = self.fragment_specs[name]
+                done[name] = spec
+                type_condition, directives, selections = self.fragments[name]
+                projected[name] = (
+                    type_condition,
+                    directives,
+                    self.project(selections, spec, (name,)),
+                )
+
+
+def _tokens_of(selections):
+    for selection in selections:
+        if isinstance(selection, _Field):
+            yield selection.arguments
+        for directive in selection.directives:
+            yield directive
+        if getattr(selection, "selections", None):
+            yield from _tokens_of(selection.selections)
+
+
+def _render_selections(selections, indent):
+    lines = []
+    pad = "  " * indent
+    for selection in selections:
+        directives = "".join(_render(d) for d in selection.directives)
+        if isinstance(selection, _Field):
+            head = "%s%s%s%s%s" % (
+                pad,
+                selection.alias + ": " if selection.alias else "",
+                selection.name,
+                _render(selection.arguments),
+                directives,
+            )
+        elif isinstance(selection, _Spread):
+            lines.append("%s...%s%s" % (pad, selection.name, directives))
+            continue
+        else:
+            head = "%s...%s%s" % (
+                pad,
+                " on " + selection.type_condition if selection.type_condition else "",
+                directives,
+            )
+        if selection.selections is None:
+            lines.append(head)
+        else:
+            lines.append(head + " {")
+            lines.extend(_render_selections(selection.selections, indent + 1))
+            lines.append(pad + "}")
+    return lines
+
+
+@lru_cache(maxsize=256)
+def _project(document, frozen_spec, typename):
+    kind, name, definitions, directives, selections, fragments = _Parser(
+        document
+    ).parse()
+    projector = _Projector(fragments, typename)
+    selections = projector.project(selections, _thaw(frozen_spec))
+    if not selections:
+        raise ValueError("The projection of %s selects no fields" % name)
+    fragments = projector.project_fragments()
+
+    used = set()
+    for tokens in _tokens_of(selections):
+        used |= _variables_in(tokens)
+    for directive in directives:
+        used |= _variables_in(directive)
+    for _, fragment_directives, fragment_selections in fragments.values():
+        for tokens in _tokens_of(fragment_selections):
+            used |= _variables_in(tokens)
+        for directive in fragment_directives:
+            used |= _variables_in(directive)
+    kept = [(var, type_tokens) for var, type_tokens in definitions if var in used]
+
+    header = "%s %s" % (kind, name)
+    if kept:
+        header += "(%s)" % ", ".join(
+            "$%s: %s" % (var, _render(type_tokens)) for var, type_tokens in kept
+        )
+    header += "".join(_render(d) for d in directives)
+    parts = ["\n".join([header + " {"] + _render_selections(selections, 1) + ["}"])]
+    for fragment, (
+        type_condition,
+        fragment_directives,
+        fragment_selections,
+    ) in fragments.items():
+        head = "fragment %s on %s%s {" % (
+            fragment,
+            type_condition,
+            "".join(_render(d) for d in fragment_directives),
+        )
+        parts.append(
+            "\n".join([head] + _render_selections(fragment_selections, 1) + ["}"])
+        )
+
+    op = Operation("\n\n".join(parts) + "\n", name)
+    op.unused_variables = frozenset(var for var, _ in definitions if var not in used)
+    return op
+
+
+def project(operation, fields, typename=False):
+    """
+    Return a trimmed Operation only asking for `fields`. Generated documents
+    are cached, so the same projection is only built once.
+    :param: operation, operation name or Operation
+    :param: fields, iterable of dot separated response paths, or a nested
+        dict of key -> True (the whole selection) or dict / paths
+    :param: typename, keep the `__typename` fields of the original document
+    """
+    op = get_operation(operation)
+    return _project(op.document, _freeze(_normalize(fields)), typename)
@@ -0,0 +1,213 @@
+"""
+Bulk roster changes: moving, removing and un-coaching thousands of students
+at once. Changes are grouped by the lists they touch, split into batches the
+server accepts, sent concurrently, and reported on per kaid, so a failed
+batch can be replayed on its own.
+"""
+
+TRANSFER = "transfer"
+STOP_COACHING = "stop_coaching"
+AUTO_ASSIGN = "auto_assign"
+
+# The field of the mutation response holding its result, per action
+_RESULT_FIELDS = {
+    TRANSFER: "transferStudents",
+    STOP_COACHING: "stopCoaching",
+    AUTO_ASSIGN: "updateAutoAssign",
+}
+
+
+class RosterResult:
+    """The outcome of one roster change for one student"""
+
+    __slots__ = ("action", "kaid", "target", "error")
+
+    def __init__(self, action, kaid, target, error=None):
+        self.action = action
+        self.kaid = kaid
+        # the grouping key of the change, e.g. (from list ids, to list ids)
+        self.target = target
+        self.error = error
+
+    @property
+    def ok(self):
+        return self.error is None
+
+    def __repr__(self):
+        status = "ok" if self.ok else "failed: %s" % self.error
+        return "<RosterResult %s %s %s>" % (self.action, self.kaid, status)
+
+
+class RosterReport:
+    """The results of BulkRoster.execute, one RosterResult per kaid and change"""
+
+    def __init__(self, results=()):
+        self.results = list(results)
+
+    def __len__(self):
+        return len(self.results)
+
+    def __iter__(self):
+        return iter(self.results)
+
+    @property
+    def ok(self):
+        return all(result.ok for result in self.results)
+
+    @property
+    def succeeded(self):
+        return [result for result in self.results if result.ok]
+
+    @property
+    def failed(self):
+        return [result for result in self.results if not result.ok]
+
+    def failed_kaids(self):
+        return sorted({result.kaid for result in self.failed})
+
+    def by_kaid(self):
+        """dict of kaid -> list of the RosterResults for that student"""
+        kaids = {}
+        for result in self.results:
+            kaids.setdefault(result.kaid, []).append(result)
+        return kaids
+
+
+def _response_error(response, action):
+    """The error of a mutation response, or None if it succeeded"""
+    if not isinstance(response, dict):
+        return "Unexpected response: %r" % (response,)
+    if response.get("errors"):
+        return "; ".join(
+            str(error.get("message", error)) if isinstance(error, dict) else str(error)
+            for error in response["errors"]
+        )
+    if "error" in response:
+        return "Server error %s" % response["error"]
+    data = response.get("data") or {}
+    if data.get(_RESULT_FIELDS[action]) is None:
+        return "No %s in response" % _RESULT_FIELDS[action]
+    return None
+
+
+class BulkRoster:
+    """
+    Collects roster changes and applies them in batches. Create it with
+    KhanAPI.bulk_roster():
+
+        roster = kapi.bulk_roster(batch_size=50, max_workers=4)
+        roster.transfer(kaids, to_list_ids=[new_class], from_list_ids=[old_class])
+        roster.remove(graduated_kaids, from_list_ids=[old_class])
+        report = roster.execute()
+        if not report.ok:
+            roster.requeue(report)
+            report = roster.execute()
+
+    :param: client, KhanAPI or AsyncKhanAPI
+    :param: batch_size, most kaids sent in one mutation
+    :param: max_workers, most mutations in flight at once
+    """
+
+    def __init__(self, client, batch_size=50, max_workers=4):
+        if batch_size < 1 or max_workers < 1:
+            raise ValueError("batch_size and max_workers must be at least 1")
+        self.client = client
+        self.batch_size = batch_size
+        self.max_workers = max_workers
+        # (action, target) -> kaids, in the order they were added
+        self.groups = {}
+
+    def __len__(self):
+        return sum(len(kaids) for kaids in self.groups.values())
+
+    def _add(self, action, target, kaids):
+        group = self.groups.setdefault((action, target), {})
+        for kaid in kaids:
+            group[kaid] = None
+
+    def transfer(self, kaids, to_list_ids, from_list_ids=()):
+        """
+        Move students to the lists `to_list_ids`, out of `from_list_ids`
+        :param: kaids, iterable of student kaids
+        """
+        self._add(TRANSFER, (tuple(from_list_ids), tuple(to_list_ids)), kaids)
+
+    def remove(self, kaids, from_list_ids):
+        """Remove students from the lists `from_list_ids`"""
+        self.transfer(kaids, (), from_list_ids)
+
+    def stop_coaching(self, kaids):
+        """Stop coaching students altogether"""
+        self._add(STOP_COACHING, (), kaids)
+
+    def auto_assign(self, kaids, student_list_id, auto_assign=True):
+        """Include (or exclude) students in the auto assignments of a list"""
+        self._add(AUTO_ASSIGN, (student_list_id, auto_assign), kaids)
+
+    def requeue(self, report):
+        """Add the failed changes of a report back, to retry only those"""
+        for result in report.failed:
+            self._add(result.action, result.target, (result.kaid,))
+
+    def batches(self):
+        """Yield (action, target, kaids) for every mutation to send"""
+        for (action, target), kaids in self.groups.items():
+            kaids = list(kaids)
+            for start in range(0, len(kaids), self.batch_size):
+                yield action, target, kaids[start : start + self.batch_size]
+
+    def _send(self, action, target, kaids):
+        """Call the client mutation for a batch, a coroutine for async clients"""
+        if action == TRANSFER:
+            return self.client.transfer_students(
+                list(target[0]), list(target[1]), kaids
+            )
+        if action == STOP_COACHING:
+            return self.client.stop_coaching(kaids)
+        return self.client.update_auto_assign(target[0], kaids, target[1])
+
+    def _results(self, batch, response=None, exception=None):
+        action, target, kaids = batch
+        if exception is not None:
+            error = "%s: %s" % (type(exception).__name__, exception)
+        else:
+            error = _response_error(response, action)
+        return [RosterResult(action, kaid, target, error) for kaid in kaids]
+
+    def execute(self):
+        """
+        Send every queued change and return a RosterReport. The queue is
+        emptied, failures can be put back with requeue.
+        """
+        batches = list(self.batches())
+        self.groups = {}
+
+        def run(batch):
+            try:
+                return self._results(batch, response=self._send(*batch))
+            except Exception as exc:
+                return self._results(batch, exception=exc)
+
+        from concurrent.futures import ThreadPoolExecutor
+
+        with ThreadPoolExecutor(max_workers=self.max_workers) as pool:
+            results = pool.map(run, batches)
+            return RosterReport(result for batch in results for result in batch)
+
+    async def execute_async(self):
+        """execute for an AsyncKhanAPI client"""
+        import asyncio
+
+        batches = list(self.batches())
+        self.groups = {}
+        semaphore = asyncio.Semaphore(self.max_workers)
+
+        async def run(batch):
+            async with semaphore:
+                try:
+                    return self._results(batch, response=await self._send(*batch))
+                except Exception as exc:
+                    return self._results(batch, exception=exc)
+
+        results = await asyncio.gather(*(run(batch) for batch in batches))
+        return RosterReport(result for batch in results for result in batch)
@@ -0,0 +1,319 @@
+import random
+import sys
+import threading
+from datetime import datetime, timezone
+from time import monotonic, sleep
+
+# Endpoint classes, each of which can be given its own RetryPolicy
+DOCUMENTED = "documented"
+INTERNAL = "internal"
+GRAPHQL_QUERY = "graphql_query"
+GRAPHQL_MUTATION = "graphql_mutation"
+
+
+def endpoint_class(url):
+    """Classify a REST url as DOCUMENTED (the v1 api) or INTERNAL"""
+    if url.startswith("/api/internal"):
+        return INTERNAL
+    return DOCUMENTED
+
+
+class RetryPolicy:
+    """
+    Describes when and how often a request is retried.
+    :param: max_retries, number of retries after the first attempt
+    :param: backoff_factor, base delay in seconds. Retry n waits a random time
+        between 0 and backoff_factor * 2 ** n (exponential backoff with full
+        jitter)
+    :param: max_backoff, upper bound in seconds for a single computed backoff
+    :param: retry_statuses, http status codes that are retried
+    :param: retry_on_connection_error, retry when the request could not be
+        sent or no response was received
+    :param: respect_retry_after, wait for the time asked in a Retry-After
+        header instead of the computed backoff
+    :param: max_retry_after, longest Retry-After wait in seconds accepted, or
+        None for no limit. The request gives up, returning the throttled
+        response, when the server asks for a longer wait
+    """
+
+    def __init__(
+        self,
+        max_retries=3,
+        backoff_factor=0.5,
+        max_backoff=30,
+        retry_statuses=(429, 500, 502, 503, 504),
+        retry_on_connection_error=True,
+        respect_retry_after=True,
+        max_retry_after=None,
+    ):
+        self.max_retries = max_retries
+        self.backoff_factor = backoff_factor
+        self.max_backoff = max_backoff
+        self.retry_statuses = frozenset(retry_statuses)
+        self.retry_on_connection_error = retry_on_connection_error
+        self.respect_retry_after = respect_retry_after
+        self.max_retry_after = max_retry_after
+
+    def backoff(self, retry):
+        """Seconds to wait before retry number `retry` (starting at 0)"""
+        return random.uniform(0, min(self.max_backoff, self.backoff_factor * 2**retry))
+
+    def delay(self, retry, response=None):
+        """
+        Seconds to wait before the next attempt, honouring the Retry-After
+        header of `response` if there is one. None when that header asks for
+        more than max_retry_after, meaning the request should not be retried.
+        """
+        if self.respect_retry_after and response is not None:
+            retry_after = _parse_retry_after(response.headers.get("Retry-After"))
+            if retry_after is not None:
+                if self.max_retry_after is not None:
+                    if retry_after > self.max_retry_after:
+                        return None
+                return retry_after
+        return self.backoff(retry)
+
+
+# Mutations are not idempotent, so by default they are only retried when the
+# server said it did not process them (throttled or unavailable).
+DEFAULT_POLICIES = {
+    DOCUMENTED: RetryPolicy(),
+    INTERNAL: RetryPolicy(),
+    GRAPHQL_QUERY: RetryPolicy(),
+    GRAPHQL_MUTATION: RetryPolicy(
+        retry_statuses=(429, 503), retry_on_connection_error=False
+    ),
+}
+
+
+def _parse_retry_after(value):
+    if not value:
+        return None
+    try:
+        return max(0.0, float(value))
+    except ValueError:
+        pass
+    from email.utils import parsedate_to_datetime
+
+    try:
+        date = parsedate_to_datetime(value)
+    except (TypeError, ValueError):
+        return None
+    return max(0.0, (date - datetime.now(timezone.utc)).total_seconds())
+
+
+def _transport_errors():
+    """
+    The connection errors of the http libraries loaded, requests and aiohttp.
+    They are looked up when a request fails, so neither has to be imported
+    before it is used.
+    """
+    errors = ()
+    requests = sys.modules.get("requests")
+    if requests is not None:
+        errors += (requests.ConnectionError, requests.Timeout)
+    aiohttp = sys.modules.get("aiohttp")
+    if aiohttp is not None:
+        errors += (aiohttp.ClientConnectionError, sys.modules["asyncio"].TimeoutError)
+    return errors
+
+
+class TokenBucket:
+    """
+    Thread safe token bucket rate limiter.
+    :param: rate, tokens added per second
+    :param: capacity, most tokens the bucket holds, i.e. the allowed burst.
+        Defaults to `rate`
+    """
+
+    def __init__(self, rate, capacity=None):
+        self.rate = float(rate)
+        self.capacity = float(capacity or max(rate, 1))
+        self.tokens = self.capacity
+        self.updated = monotonic()
+        self.lock = threading.Lock()
+
+    def reserve(self):
+        """
+        Take a token and return the number of seconds the caller has to wait
+        before using it.
+        """
+        with self.lock:
+            now = monotonic()
+            self.tokens = min(
+                self.capacity, self.tokens + (now - self.updated) * self.rate
+            )
+            self.updated = now
+            self.tokens -= 1
+            if self.tokens >= 0:
+                return 0.0
+            return -self.tokens / self.rate
+
+
+def _release(response):
+    # hand the connection of a discarded (possibly streamed) response back
+    close = getattr(response, "close", None)
+    if close is not None:
+        close()
+
+
+class RequestStats:
+    """
+    Counters kept by a RequestScheduler, per endpoint class.
+    :attr: requests, attempts sent (including retries)
+    :attr: retries, attempts that were retries
+    :attr: throttled_time, seconds spent waiting on the rate limiter
+    :attr: backoff_time, seconds spent waiting between retries
+    """
+
+    def __init__(self):
+        self.lock = threading.Lock()
+        self.by_class = {}
+
+    def record(self, cls, requests=0, retries=0, throttled_time=0.0, backoff_time=0.0):
+        with self.lock:
+            counts = self.by_class.setdefault(
+                cls,
+                {
+                    "requests": 0,
+                    "retries": 0,
+                    "throttled_time": 0.0,
+                    "backoff_time": 0.0,
+                },
+            )
+            counts["requests"] += requests
+            counts["retries"] += retries
+            counts["throttled_time"] += throttled_time
+            counts["backoff_time"] += backoff_time
+
+    def _total(self, key):
+        with self.lock:
+            return sum(counts[key] for counts in self.by_class.values())
+
+    @property
+    def requests(self):
+        return self._total("requests")
+
+    @property
+    def retries(self):
+        return self._total("retries")
+
+    @property
+    def throttled_time(self):
+        return self._total("throttled_time")
+
+    @property
+    def backoff_time(self):
+        return self._total("backoff_time")
+
+    @property
+    def wait_time(self):
+        return self.throttled_time + self.backoff_time
+
+    def snapshot(self):
+        """Return a copy of the counters as {endpoint_class: {counter: value}}"""
+        with self.lock:
+            return {cls: dict(counts) for cls, counts in self.by_class.items()}
+
+
+class RequestScheduler:
+    """
+    Sits between the endpoint methods and the http session. Every request is
+    sent through `send`, which waits on the rate limiter and retries failed
+    attempts according to the RetryPolicy of the endpoint class.
+    :param: rate, most requests per second, or None for no limit
+    :param: burst, requests allowed at once before the rate applies
+    :param: policies, dict of endpoint class -> RetryPolicy, merged over
+        DEFAULT_POLICIES
+    :param: retry_exceptions, exceptions raised by the transport that count as
+        a connection error. Defaults to the connection errors and timeouts of
+        requests and aiohttp
+    """
+
+    def __init__(self, rate=None, burst=None, policies=None, retry_exceptions=None):
+        self.bucket = TokenBucket(rate, burst) if rate else None
+        self.policies = {**DEFAULT_POLICIES, **(policies or {})}
+        self.retry_exceptions = retry_exceptions
+        self.stats = RequestStats()
+
+    @property
+    def retry_exceptions(self):
+        if self._retry_exceptions is None:
+            return _transport_errors()
+        return self._retry_exceptions
+
+    @retry_exceptions.setter
+    def retry_exceptions(self, exceptions):
+        self._retry_exceptions = None if exceptions is None else tuple(exceptions)
+
+    def _throttle_delay(self):
+        return self.bucket.reserve() if self.bucket else 0.0
+
+    def _should_retry(self, policy, retry, response):
+        return retry < policy.max_retries and (
+            getattr(response, "status_code", None) in policy.retry_statuses
+        )
+
+    def send(self, cls, send):
+        """
+        Call `send()` until it returns a response that should not be retried,
+        or the retries allowed for the endpoint class `cls` run out. `send`
+        must return an object with `status_code` and `headers` attributes.
+        """
+        policy = self.policies[cls]
+        retry = 0
+        while True:
+            wait = self._throttle_delay()
+            if wait:
+                sleep(wait)
+            self.stats.record(
+                cls, requests=1, retries=int(retry > 0), throttled_time=wait
+            )
+            try:
+                response = send()
+            except self.retry_exceptions:
+                if not policy.retry_on_connection_error or retry >= policy.max_retries:
+                    raise
+                delay = policy.delay(retry)
+            else:
+                if not self._should_retry(policy, retry, response):
+                    return response
+                delay = policy.delay(retry, response)
+                if delay is None:
+                    # the server asked for a longer wait than the policy allows
+                    return response
+                _release(response)
+            self.stats.record(cls, backoff_time=delay)
+            sleep(delay)
+            retry += 1
+
+    async def send_async(self, cls, send):
+        """Same as `send`, for a coroutine function `send`"""
+        import asyncio
+
+        policy = self.policies[cls]
+        retry = 0
+        while True:
+            wait = self._throttle_delay()
+            if wait:
+                await asyncio.sleep(wait)
+            self.stats.record(
+                cls, requests=1, retries=int(retry > 0), throttled_time=wait
+            )
+            try:
+                response = await send()
+            except self.retry_exceptions:
+                if not policy.retry_on_connection_error or retry >= policy.max_retries:
+                    raise
+                delay = policy.delay(retry)
+            else:
+                if not self._should_retry(policy, retry, response):
+                    return response
+                delay = policy.delay(retry, response)
+                if delay is None:
+                    # the server asked for a longer wait than the policy allows
+                    return response
+                _release(response)
+            self.stats.record(cls, backoff_time=delay)
+            await asyncio.sleep(delay)
+            retry += 1
@@ -0,0 +1,112 @@
+"""
+Single flight request coalescing: while a request is in flight, identical
+requests made from other threads (or tasks) wait for it and share its
+decoded result instead of each making their own network call.
+
+Only GET requests and GraphQL queries are coalesced. Mutations and other
+POSTs always go out on their own. As the result is shared, callers should
+not modify it in place.
+"""
+
+import hashlib
+import json
+import threading
+from khan_api_wrapper.oauth import flatten_params
+
+
+def request_key(method, url, params=None, data=None, identity=None):
+    """
+    Key identifying a request, ignoring the `_` cache busting param which
+    differs on every call
+    """
+    params = sorted((k, v) for k, v in flatten_params(params or {}) if k != "_")
+    if isinstance(data, bytes):
+        data = data.decode("utf-8")
+    elif data is not None and not isinstance(data, str):
+        data = json.dumps(data, sort_keys=True)
+    raw = json.dumps([identity, method, url, params, data])
+    return hashlib.sha256(raw.encode("utf-8")).hexdigest()
+
+
+class _Call:
+    __slots__ = ("event", "result", "error")
+
+    def __init__(self):
+        self.event = threading.Event()
+        self.result = None
+        self.error = None
+
+
+class SingleFlight:
+    """
+    Runs one call per key at a time, handing its result (or exception) to
+    every caller that asked for the same key meanwhile.
+    """
+
+    def __init__(self):
+        self.lock = threading.Lock()
+        self.calls = {}
+        # calls made, and calls answered by another caller's request
+        self.executed = 0
+        self.coalesced = 0
+
+    def do(self, key, fn):
+        with self.lock:
+            call = self.calls.get(key)
+            leader = call is None
+            if leader:
+                call = self.calls[key] = _Call()
+                self.executed += 1
+            else:
+                self.coalesced += 1
+        if not leader:
+            call.event.wait()
+            if call.error is not None:
+                raise call.error
+            return call.result
+        try:
+            call.result = fn()
+            return call.result
+        except BaseException as exc:
+            call.error = exc
+            raise
+        finally:
+            with self.lock:
+                del self.calls[key]
+            call.event.set()
+
+    def snapshot(self):
+        with self.lock:
+            return {"executed": self.executed, "coalesced": self.coalesced}
+
+
+class AsyncSingleFlight:
+    """
+    SingleFlight for coroutines, on one event loop. A caller cancelled while
+    waiting does not cancel the request for the others.
+    """
+
+    def __init__(self):
+        self.calls = {}
+        self.executed = 0
+        self.coalesced = 0
+
+    async def do(self, key, fn):
+        import asyncio
+
+        task = self.calls.get(key)
+        if task is None:
+            task = self.calls[key] = asyncio.ensure_future(fn())
+            self.executed += 1
+
+            def forget(done, key=key):
+                if self.calls.get(key) is done:
+                    del self.calls[key]
+
+            task.add_done_callback(forget)
+        else:
+            self.coalesced += 1
+        return await asyncio.shield(task)
+
+    def snapshot(self):
+        return {"executed": self.executed, "coalesced": self.coalesced}
@@ -0,0 +1,556 @@
+"""
+A local SQLite snapshot of synced Khan Academy data, so that analytical
+questions are answered from indexed tables instead of fetching the same
+students, assignments and exercises again:
+
+    store = SnapshotStore("khan.db")
+    store.save_students(kapi.get_student_list())
+    store.save_students(kapi.iter_students(True, class_id), class_id=class_id)
+    store.save_assignments(kapi.iter_progress_by_student(class_id), class_id)
+    store.save_completion(kapi.simple_completion_query(assignment_id))
+    store.save_user_exercises(kapi.user_exercises({"kaid": kaid}))
+    store.save_topic_tree(kapi.get_topic_tree_index())
+
+    store.students_not_completed(assignment_id)
+
+Saving is an upsert: a row already stored is updated in place with the
+columns whose fields are in the new data. A field missing from it (e.g. one
+left out by a projection) keeps its stored value, while a field given as null
+clears it. The `data` column holds the whole item as last saved. Completion
+states are the exception, the latest one replacing the stored one whole.
+Every row records when it was last refreshed, in `refreshed_at`, in the api
+timestamp format, and stale() lists the rows older than a given age.
+"""
+
+import threading
+from functools import lru_cache
+from datetime import datetime, timedelta
+from khan_api_wrapper import codec
+from khan_api_wrapper.pagination import assignments_page
+from khan_api_wrapper.sync import format_time
+
+SCHEMA = """
+CREATE TABLE IF NOT EXISTS students (
+    kaid TEXT PRIMARY KEY,
+    username TEXT,
+    nickname TEXT,
+    coach_nickname TEXT,
+    email TEXT,
+    joined TEXT,
+    last_activity TEXT,
+    data TEXT,
+    refreshed_at TEXT NOT NULL
+);
+CREATE TABLE IF NOT EXISTS class_students (
+    class_id TEXT NOT NULL,
+    kaid TEXT NOT NULL,
+    refreshed_at TEXT NOT NULL,
+    PRIMARY KEY (class_id, kaid)
+);
+CREATE INDEX IF NOT EXISTS class_students_kaid ON class_students (kaid);
+CREATE TABLE IF NOT EXISTS assignments (
+    id TEXT PRIMARY KEY,
+    class_id TEXT,
+    assigned_date TEXT,
+    due_date TEXT,
+    is_draft INTEGER,
+    content_ids TEXT,
+    titles TEXT,
+    data TEXT,
+    refreshed_at TEXT NOT NULL
+);
+CREATE INDEX IF NOT EXISTS assignments_class ON assignments (class_id, due_date);
+CREATE TABLE IF NOT EXISTS assignment_students (
+    assignment_id TEXT NOT NULL,
+    kaid TEXT NOT NULL,
+    refreshed_at TEXT NOT NULL,
+    PRIMARY KEY (assignment_id, kaid)
+);
+CREATE INDEX IF NOT EXISTS assignment_students_kaid ON assignment_students (kaid);
+CREATE TABLE IF NOT EXISTS completions (
+    assignment_id TEXT NOT NULL,
+    kaid TEXT NOT NULL,
+    state TEXT,
+    completed_on TEXT,
+    num_correct INTEGER,
+    num_attempted INTEGER,
+    refreshed_at TEXT NOT NULL,
+    PRIMARY KEY (assignment_id, kaid)
+);
+CREATE INDEX IF NOT EXISTS completions_kaid ON completions (kaid);
+CREATE TABLE IF NOT EXISTS user_exercises (
+    kaid TEXT NOT NULL,
+    exercise TEXT NOT NULL,
+    level TEXT,
+    total_done INTEGER,
+    total_correct INTEGER,
+    streak INTEGER,
+    longest_streak INTEGER,
+    practiced INTEGER,
+    mastered INTEGER,
+    last_done TEXT,
+    proficient_date TEXT,
+    refreshed_at TEXT NOT NULL,
+    PRIMARY KEY (kaid, exercise)
+);
+CREATE INDEX IF NOT EXISTS user_exercises_exercise ON user_exercises (exercise);
+CREATE TABLE IF NOT EXISTS topic_nodes (
+    id TEXT PRIMARY KEY,
+    kind TEXT,
+    name TEXT,
+    slug TEXT,
+    title TEXT,
+    parent_id TEXT,
+    data TEXT,
+    refreshed_at TEXT NOT NULL
+);
+CREATE INDEX IF NOT EXISTS topic_nodes_name ON topic_nodes (kind, name);
+CREATE INDEX IF NOT EXISTS topic_nodes_parent ON topic_nodes (parent_id);
+"""
+
+# table -> its key columns, for stale()
+KEYS = {
+    "students": ("kaid",),
+    "class_students": ("class_id", "kaid"),
+    "assignments": ("id",),
+    "assignment_students": ("assignment_id", "kaid"),
+    "completions": ("assignment_id", "kaid"),
+    "user_exercises": ("kaid", "exercise"),
+    "topic_nodes": ("id",),
+}
+
+
+@lru_cache(maxsize=128)
+def _upsert(table, columns, keys):
+    """
+    INSERT of a row that updates the row with the same keys instead, setting
+    only the columns given
+    """
+    updates = ", ".join(
+        "%s = excluded.%s" % (column, column)
+        for column in columns
+        if column not in keys
+    )
+    return "INSERT INTO %s (%s) VALUES (%s) ON CONFLICT (%s) DO UPDATE SET %s" % (
+        table,
+        ", ".join(columns),
+        ", ".join("?" * len(columns)),
+        ", ".join(keys),
+        updates,
+    )
+
+
+def _upserts(table, keys, rows):
+    """
+    (sql, rows) pairs upserting rows given as dicts of the columns present in
+    the api data, in order, one statement per run of rows with the same columns
+    """
+    runs = []
+    for row in rows:
+        columns = tuple(row)
+        if not runs or runs[-1][0] != columns:
+            runs.append((columns, []))
+        runs[-1][1].append(tuple(row.values()))
+    return [(_upsert(table, columns, keys), values) for columns, values in runs]
+
+
+def _present(item, fields):
+    """column -> value of the (column, api key) pairs whose key is in item"""
+    return {column: item[key] for column, key in fields if key in item}
+
+
+def _plain(item):
+    """The dict of an api item or of a khan_api_wrapper.models record"""
+    return item.to_dict() if hasattr(item, "to_dict") else item
+
+
+def _flag(value):
+    return None if value is None else int(bool(value))
+
+
+STUDENT_FIELDS = (
+    ("username", "username"),
+    ("nickname", "nickname"),
+    ("coach_nickname", "coachNickname"),
+    ("email", "email"),
+    ("joined", "joined"),
+    ("last_activity", "last_activity"),
+)
+
+USER_EXERCISE_FIELDS = (
+    ("total_done", "total_done"),
+    ("total_correct", "total_correct"),
+    ("streak", "streak"),
+    ("longest_streak", "longest_streak"),
+    ("last_done", "last_done"),
+    ("proficient_date", "proficient_date"),
+)
+
+
+def _students(result):
+    """The students of get_student_list, iter_students or a getStudentsList page"""
+    if isinstance(result, dict):
+        coach = (result.get("data") or {}).get("coach") or {}
+        page = (coach.get("studentList") or coach).get("studentsPage") or {}
+        return page.get("students") or ()
+    return result
+
+
+class SnapshotStore:
+    """
+    Keeps the snapshot in the SQLite database at `path` (":memory:" for one
+    that lives as long as the store). One connection is shared by the
+    threads using the store, each save running in a single transaction.
+    """
+
+    def __init__(self, path, timeout=60):
+        import sqlite3
+
+        self.path = path
+        self.lock = threading.RLock()
+        self.db = sqlite3.connect(path, timeout=timeout, check_same_thread=False)
+        self.db.row_factory = sqlite3.Row
+        if path != ":memory:":
+            # readers in other processes do not block the writer
+            self.db.execute("PRAGMA journal_mode=WAL")
+            self.db.execute("PRAGMA synchronous=NORMAL")
+        with self.db:
+            self.db.executescript(SCHEMA)
+
+    def __enter__(self):
+        return self
+
+    def __exit__(self, *exc_info):
+        self.close()
+
+    def close(self):
+        self.db.close()
+
+    def now(self):
+        """The refreshed_at stamp of rows saved now"""
+        return format_time(datetime.utcnow())
+
+    def _write(self, statements):
+        """Run (sql, rows) pairs with executemany, in one transaction"""
+        with self.lock, self.db:
+            for sql, rows in statements:
+                self.db.executemany(sql, rows)
+
+    def query(self, sql, params=()):
+        """Rows of any query on the snapshot, as dicts"""
+        with self.lock:
+            return [dict(row) for row in self.db.execute(sql, params)]
+
+    # Saving
+
+    def save_students(self, students, class_id=None):
+        """
+        Upsert students.
+        :param: students, the result of get_student_list or iter_students, or
+            a get_students_list response
+        :param: class_id, the class the students were listed for, to record
+            that they belong to it
+        Returns the number of students saved.
+        """
+        now = self.now()
+        rows = []
+        for student in map(_plain, _students(students)):
+            kaid = student.get("kaid")
+            if not kaid:
+                continue
+            rows.append(
+                {
+                    "kaid": kaid,
+                    **_present(student, STUDENT_FIELDS),
+                    "data": codec.dumps(student),
+                    "refreshed_at": now,
+                }
+            )
+        statements = _upserts("students", ("kaid",), rows)
+        if class_id is not None:
+            statements.append(
+                (
+                    _upsert(
+                        "class_students",
+                        ("class_id", "kaid", "refreshed_at"),
+                        ("class_id", "kaid"),
+                    ),
+                    [(class_id, row["kaid"], now) for row in rows],
+                )
+            )
+        self._write(statements)
+        return len(rows)
+
+    def save_assignments(self, assignments, class_id=None):
+        """
+        Upsert assignments, with the completion states they carry.
+        :param: assignments, a coach_assignments or get_progress_by_student
+            response (the class id is then read from it), or assignments such
+            as those of iter_coach_assignments and iter_progress_by_student
+        :param: class_id, the class of the assignments
+        Returns the number of assignments saved.
+        """
+        if isinstance(assignments, dict):
+            student_list = ((assignments.get("data") or {}).get("coach") or {}).get(
+                "studentList"
+            ) or {}
+            class_id = class_id or student_list.get("id")
+            assignments = assignments_page(assignments)[0]
+        now = self.now()
+        rows = []
+        members = []
+        completions = []
+        for assignment in map(_plain, assignments):
+            assignment_id = assignment.get("id")
+            if not assignment_id:
+                continue
+            row = {"id": assignment_id}
+            if class_id or "studentList" in assignment:
+                row["class_id"] = class_id or (assignment["studentList"] or {}).get(
+                    "id"
+                )
+            row.update(
+                _present(
+                    assignment,
+                    (("assigned_date", "assignedDate"), ("due_date", "dueDate")),
+                )
+            )
+            if "isDraft" in assignment:
+                row["is_draft"] = _flag(assignment["isDraft"])
+            if "contents" in assignment:
+                contents = assignment["contents"] or []
+                row["content_ids"] = (
+                    ",".join(c["id"] for c in contents if c.get("id")) or None
+                )
+                row["titles"] = (
+                    " / ".join(
+                        c.get("translatedTitle") or c.get("title") or ""
+                        for c in contents
+                    )
+                    or None
+                )
+            row["data"] = codec.dumps(
+                {k: v for k, v in assignment.items() if k != "itemCompletionStates"}
+            )
+            row["refreshed_at"] = now
+            rows.append(row)
+            for kaid in assignment.get("studentKaids") or ():
+                members.append((assignment_id, kaid, now))
+            for state in assignment.get("itemCompletionStates") or ():
+                row = self._completion_row(assignment_id, state, now)
+                if row is not None:
+                    completions.append(row)
+                    members.append((assignment_id, row[1], now))
+        self._write(
+            _upserts("assignments", ("id",), rows)
+            + [
+                (
+                    _upsert(
+                        "assignment_students",
+                        ("assignment_id", "kaid", "refreshed_at"),
+                        ("assignment_id", "kaid"),
+                    ),
+                    members,
+                ),
+                (
+                    _upsert(
+                        "completions",
+                        (
+                            "assignment_id",
+                            "kaid",
+                            "state",
+                            "completed_on",
+                            "num_correct",
+                            "num_attempted",
+                            "refreshed_at",
+                        ),
+                        ("assignment_id", "kaid"),
+                    ),
+                    completions,
+                ),
+            ]
+        )
+        return len(rows)
+
+    def _completion_row(self, assignment_id, state, now):
+        state = _plain(state)
+        kaid = state.get("studentKaid") or (state.get("student") or {}).get("kaid")
+        if not kaid:
+            return None
+        score = state.get("bestScore") or {}
+        return (
+            assignment_id,
+            kaid,
+            state.get("state"),
+            state.get("completedOn"),
+            score.get("numCorrect"),
+            score.get("numAttempted"),
+            now,
+        )
+
+    def save_completion(self, response, class_id=None):
+        """
+        Upsert the assignment of a simple_completion_query response and the
+        completion state of each of its students
+        """
+        assignment = ((response.get("data") or {}).get("coach") or {}).get("assignment")
+        if not assignment:
+            return 0
+        return self.save_assignments([assignment], class_id)
+
+    def save_user_exercises(self, rows):
+        """
+        Upsert the rows of user_exercises or get_many_exercises, of one or
+        many students. Returns the number of rows saved.
+        """
+        now = self.now()
+        values = []
+        for row in map(_plain, rows):
+            if not row.get("kaid") or not row.get("exercise"):
+                continue
+            value = {"kaid": row["kaid"], "exercise": row["exercise"]}
+            if "exercise_progress" in row:
+                value["level"] = (row["exercise_progress"] or {}).get("level")
+            value.update(_present(row, USER_EXERCISE_FIELDS))
+            for flag in ("practiced", "mastered"):
+                if flag in row:
+                    value[flag] = _flag(row[flag])
+            value["refreshed_at"] = now
+            values.append(value)
+        self._write(_upserts("user_exercises", ("kaid", "exercise"), values))
+        return len(values)
+
+    def save_topic_tree(self, tree):
+        """
+        Upsert the nodes of the topic tree, with the first parent each is
+        found under.
+        :param: tree, a TopicTree (see get_topic_tree_index) or a decoded tree
+            such as the result of topictree
+        Returns the number of nodes saved.
+        """
+        from khan_api_wrapper.topic_tree import TopicTree
+
+        if not isinstance(tree, TopicTree):
+            tree = TopicTree.from_tree(tree)
+        now = self.now()
+        rows = []
+        for node_id, node in tree.nodes.items():
+            path = tree.paths.get(node_id) or ()
+            row = {
+                "id": node_id,
+                **_present(node, (("kind", "kind"), ("name", "name"))),
+            }
+            if "slug" in node or "node_slug" in node:
+                row["slug"] = node.get("slug") or node.get("node_slug")
+            if "translated_title" in node or "title" in node:
+                row["title"] = node.get("translated_title") or node.get("title")
+            row["parent_id"] = path[-1] if path else None
+            row["data"] = codec.dumps(node)
+            row["refreshed_at"] = now
+            rows.append(row)
+        self._write(_upserts("topic_nodes", ("id",), rows))
+        return len(rows)
+
+    # Questions
+
+    def students_not_completed(self, assignment_id):
+        """
+        The students assigned to the assignment who have not completed it,
+        with their names when the students were saved too
+        """
+        return self.query(
+            "SELECT a.kaid, s.username, s.nickname, s.coach_nickname, c.state,"
+            " c.num_correct, c.num_attempted"
+            " FROM assignment_students a"
+            " LEFT JOIN completions c"
+            " ON c.assignment_id = a.assignment_id AND c.kaid = a.kaid"
+            " LEFT JOIN students s ON s.kaid = a.kaid"
+            " WHERE a.assignment_id = ? AND c.completed_on IS NULL"
+            " ORDER BY a.kaid",
+            (assignment_id,),
+        )
+
+    def completion(self, assignment_id):
+        """The completion state of every student of the assignment"""
+        return self.query(
+            "SELECT * FROM completions WHERE assignment_id = ? ORDER BY kaid",
+            (assignment_id,),
+        )
+
+    def assignments(self, class_id=None, due_after=None, due_before=None):
+        """Assignments, of a class and due within a window if given, by due date"""
+        where = []
+        params = []
+        for condition, value in (
+            ("class_id = ?", class_id),
+            ("due_date >= ?", due_after),
+            ("due_date < ?", due_before),
+        ):
+            if value is not None:
+                where.append(condition)
+                params.append(value)
+        return self.query(
+            "SELECT id, class_id, assigned_date, due_date, is_draft, content_ids,"
+            " titles, refreshed_at FROM assignments"
+            + (" WHERE " + " AND ".join(where) if where else "")
+            + " ORDER BY due_date",
+            params,
+        )
+
+    def class_students(self, class_id):
+        """The students saved for a class"""
+        return self.query(
+            "SELECT s.kaid, s.username, s.nickname, s.coach_nickname, s.email,"
+            " s.refreshed_at FROM class_students c"
+            " JOIN students s ON s.kaid = c.kaid"
+            " WHERE c.class_id = ? ORDER BY s.kaid",
+            (class_id,),
+        )
+
+    def student_exercises(self, kaid, mastered=None):
+        """The user exercise rows of a student, only the (not) mastered ones if given"""
+        sql = "SELECT * FROM user_exercises WHERE kaid = ?"
+        params = [kaid]
+        if mastered is not None:
+            sql += " AND COALESCE(mastered, 0) = ?"
+            params.append(int(mastered))
+        return self.query(sql + " ORDER BY exercise", params)
+
+    def exercise_students(self, exercise, mastered=None):
+        """The user exercise rows of every student for an exercise"""
+        sql = "SELECT * FROM user_exercises WHERE exercise = ?"
+        params = [exercise]
+        if mastered is not None:
+            sql += " AND COALESCE(mastered, 0) = ?"
+            params.append(int(mastered))
+        return self.query(sql + " ORDER BY kaid", params)
+
+    def topic_children(self, parent_id):
+        """The nodes of the topic tree first found under a node"""
+        return self.query(
+            "SELECT id, kind, name, slug, title FROM topic_nodes"
+            " WHERE parent_id = ? ORDER BY id",
+            (parent_id,),
+        )
+
+    def exercise_node(self, name):
+        """The topic tree node of an exercise, by name, or None"""
+        rows = self.query(
+            "SELECT * FROM topic_nodes WHERE kind = 'Exercise' AND name = ?", (name,)
+        )
+        return rows[0] if rows else None
+
+    def stale(self, table, max_age):
+        """
+        The keys of the rows of `table` refreshed more than `max_age` seconds
+        ago, to know what to fetch again
+        """
+        keys = KEYS[table]
+        cutoff = format_time(datetime.utcnow() - timedelta(seconds=max_age))
+        return [
+            tuple(row.values()) if len(keys) > 1 else row[keys[0]]
+            for row in self.query(
+                "SELECT %s FROM %s WHERE refreshed_at < ?" % (", ".join(keys), table),
+                (cutoff,),
+            )
+        ]
@@ -0,0 +1,299 @@
+"""
+Incremental JSON parsing, so the multi megabyte topic tree responses can be
+walked without materialising the whole document. Uses ijson when it is
+installed, and a pure python tokenizer otherwise. Both produce the same
+(event, value) pairs as ijson.basic_parse:
+    start_map, map_key, end_map, start_array, end_array,
+    string, number, boolean, null
+
+The pure python tokenizer is slow: about 15 to 30 times slower than decoding
+the whole body with json.loads (0.4 to 0.6s against 0.02 to 0.03s for a 3MB
+topic tree). It is only worth it when memory matters more than time, so
+KhanAPI only streams without ijson when asked to (`fallback=True`), and
+otherwise decodes the body whole and walks it with iter_value_events.
+"""
+
+import codecs
+import re
+from importlib.util import find_spec
+from json.decoder import scanstring
+
+_NUMBER = re.compile(r"-?(?:0|[1-9]\d*)(\.\d+)?([eE][-+]?\d+)?")
+_CONSTANTS = {
+    "true": ("boolean", True),
+    "false": ("boolean", False),
+    "null": ("null", None),
+}
+_CONSTANTS_START = {word[0] for word in _CONSTANTS}
+_TOKEN = re.compile(r"[-+.\w]*")
+_WHITESPACE = " \t\n\r,:"
+
+
+class _ChunkReader:
+    """File like object over an iterable of byte chunks, for ijson"""
+
+    def __init__(self, chunks):
+        self.chunks = iter(chunks)
+        self.buffer = b""
+
+    def read(self, size=-1):
+        while size < 0 or len(self.buffer) < size:
+            chunk = next(self.chunks, None)
+            if chunk is None:
+                break
+            self.buffer += chunk
+        if size < 0:
+            size = len(self.buffer)
+        data, self.buffer = self.buffer[:size], self.buffer[size:]
+        return data
+
+
+def has_ijson():
+    """True if ijson is installed, so that iter_events parses at C speed"""
+    return find_spec("ijson") is not None
+
+
+def iter_events(chunks):
+    """
+    Yield the parse events of a JSON document given as an iterable of byte
+    chunks, e.g. response.iter_content(65536). Without ijson the events come
+    from the much slower pure python tokenizer, see the module docstring.
+    """
+    try:
+        import ijson
+    except ImportError:
+        return _iter_events(chunks)
+    try:
+        return ijson.basic_parse(_ChunkReader(chunks), use_float=True)
+    except TypeError:
+        # ijson < 3.1 has no use_float
+        return ijson.basic_parse(_ChunkReader(chunks))
+
+
+def _iter_events(chunks):
+    decoder = codecs.getincrementaldecoder("utf-8")()
+    chunks = iter(chunks)
+    buf = ""
+    pos = 0
+    eof = False
+    # one entry per open container: True for a map expecting a key next
+    stack = []
+
+    while True:
+        # skip separators. ',' puts a map back to expecting a key
+        while pos < len(buf) and buf[pos] in _WHITESPACE:
+            if buf[pos] == "," and stack and stack[-1] is not None:
+                stack[-1] = True
+            elif buf[pos] == ":":
+                stack[-1] = False
+            pos += 1
+
+        if pos >= len(buf) or _incomplete(buf, pos, eof):
+            if eof:
+                # a body cut short, e.g. by a dropped connection
+                if pos < len(buf) or stack:
+                    raise ValueError("Incomplete JSON document")
+                return
+            chunk = next(chunks, None)
+            if chunk is None:
+                eof = True
+                buf = buf[pos:] + decoder.decode(b"", final=True)
+            else:
+                buf = buf[pos:] + decoder.decode(chunk)
+            pos = 0
+            continue
+
+        char = buf[pos]
+        if char == "{":
+            stack.append(True)
+            pos += 1
+            yield "start_map", None
+        elif char == "}":
+            stack.pop()
+            pos += 1
+            yield "end_map", None
+        elif char == "[":
+            stack.append(None)
+            pos += 1
+            yield "start_array", None
+        elif char == "]":
+            stack.pop()
+            pos += 1
+            yield "end_array", None
+        elif char == '"':
+            value, pos = scanstring(buf, pos + 1)
+            if stack and stack[-1]:
+                yield "map_key", value
+            else:
+                yield "string", value
+        elif char in _CONSTANTS_START:
+            for word, event in _CONSTANTS.items():
+                if buf.startswith(word, pos):
+                    pos += len(word)
+                    yield event
+                    break
+            else:
+                raise ValueError("Invalid JSON at: %r" % buf[pos : pos + 20])
+        else:
+            match = _NUMBER.match(buf, pos)
+            if not match:
+                raise ValueError("Invalid JSON at: %r" % buf[pos : pos + 20])
+            pos = match.end()
+            if match.group(1) or match.group(2):
+                yield "number", float(match.group())
+            else:
+                yield "number", int(match.group())
+
+
+_SCALAR_EVENTS = {
+    str: "string",
+    int: "number",
+    float: "number",
+    bool: "boolean",
+    type(None): "null",
+}
+
+
+def iter_value_events(value):
+    """
+    Yield the parse events of an already decoded JSON value, so the functions
+    of this module also walk a body that was decoded whole
+    """
+    # one (iterator, closing event) per open container
+    stack = [(iter((value,)), None)]
+    while stack:
+        items, end = stack[-1]
+        for item in items:
+            if end == "end_map":
+                key, item = item
+                yield "map_key", key
+            cls = item.__class__
+            if cls is dict:
+                yield "start_map", None
+                stack.append((iter(item.items()), "end_map"))
+                break
+            if cls is list:
+                yield "start_array", None
+                stack.append((iter(item), "end_array"))
+                break
+            yield _SCALAR_EVENTS[cls], item
+        else:
+            stack.pop()
+            if end is not None:
+                yield end, None
+
+
+def _incomplete(buf, pos, eof):
+    """True if the token starting at pos may continue in the next chunk"""
+    if eof:
+        return False
+    char = buf[pos]
+    if char == '"':
+        end = pos + 1
+        while True:
+            end = buf.find('"', end)
+            if end < 0:
+                return True
+            # count the backslashes escaping this quote
+            backslashes = 0
+            while buf[end - 1 - backslashes] == "\\":
+                backslashes += 1
+            if backslashes % 2 == 0:
+                return False
+            end += 1
+    if char in "{}[]":
+        return False
+    # numbers and constants end at a delimiter
+    match = _TOKEN.match(buf, pos)
+    return match.end() == len(buf)
+
+
+def _build(events, first):
+    """Build the python value starting with the event `first`"""
+    event, value = first
+    if event == "start_map":
+        obj = {}
+        for event, value in events:
+            if event == "end_map":
+                return obj
+            obj[value] = _build(events, next(events))
+    if event == "start_array":
+        arr = []
+        for event, value in events:
+            if event == "end_array":
+                return arr
+            arr.append(_build(events, (event, value)))
+    return value
+
+
+def iter_items(events, prefix):
+    """
+    Yield the values found at `prefix`, a dot separated path where `item`
+    stands for an array element, like ijson.items. For example the exercises
+    of the v2 topic tree are at "exercises.item"
+    """
+    events = iter(events)
+    target = prefix.split(".") if prefix else []
+    # the key (or "item" inside an array) leading to the current position
+    path = []
+    for event, value in events:
+        if event == "map_key":
+            path[-1] = value
+        elif event in ("end_map", "end_array"):
+            path.pop()
+        elif path == target:
+            yield _build(events, (event, value))
+        elif event == "start_map":
+            path.append(None)
+        elif event == "start_array":
+            path.append("item")
+
+
+def iter_tree_nodes(events, children_key="children", with_depth=False):
+    """
+    Yield every node of a tree of maps nested through `children_key` lists,
+    such as the v1 topic tree, with its children list left out. Nodes are
+    yielded as soon as they are complete, so children come before their
+    parent, and memory only grows with the depth of the tree.
+    :param: with_depth, yield (depth, node) tuples instead, which is enough to
+        rebuild the tree structure
+    """
+    events = iter(events)
+    first = next(events, None)
+    if first is None:
+        return
+    if first[0] == "start_array":
+        nodes = _iter_node_list(events, children_key, 0)
+    elif first[0] == "start_map":
+        nodes = _iter_node(events, children_key, 0)
+    else:
+        return
+    if with_depth:
+        yield from nodes
+    else:
+        for depth, node in nodes:
+            yield node
+
+
+def _iter_node_list(events, children_key, depth):
+    for event, value in events:
+        if event == "end_array":
+            return
+        if event == "start_map":
+            yield from _iter_node(events, children_key, depth)
+        else:
+            # not a node, skip it
+            _build(events, (event, value))
+
+
+def _iter_node(events, children_key, depth):
+    node = {}
+    for event, key in events:
+        if event == "end_map":
+            yield depth, node
+            return
+        first = next(events)
+        if key == children_key and first[0] == "start_array":
+            yield from _iter_node_list(events, children_key, depth + 1)
+        else:
+            node[key] = _build(events, first)
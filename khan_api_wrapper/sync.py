@@ -0,0 +1,521 @@
+"""
+Incremental synchronisation: instead of asking for a whole history on every
+run, remember up to when the last run got data (its high-water mark), only
+ask for what changed since, and merge it into a snapshot kept locally
+(RosterSync) or hand out only the new events (ActivitySync).
+"""
+
+import hashlib
+import json
+import os
+import threading
+from contextlib import contextmanager, nullcontext
+from datetime import datetime, timedelta
+
+EPOCH = "1970-01-01T00:00:00.000Z"
+
+
+def format_time(dt):
+    """The `dt_start` / `dt_end` format of the internal api"""
+    return dt.replace(microsecond=0).isoformat() + "Z"
+
+
+def parse_time(value):
+    return datetime.strptime(value.rstrip("Z").split(".")[0], "%Y-%m-%dT%H:%M:%S")
+
+
+class JsonStateStore:
+    """
+    Keeps sync state in a json file, one value per key. Writes go to a
+    temporary file renamed into place, so a crash never leaves it half
+    written. Within batch(), saves and deletes are staged in memory and the
+    file is rewritten once, instead of once per key.
+    """
+
+    def __init__(self, path):
+        self.path = path
+        self.lock = threading.RLock()
+        # key -> value, or _DELETED, while a batch is open
+        self.staged = None
+        self._batches = 0
+
+    def _read(self):
+        try:
+            with open(self.path, "r", encoding="utf-8") as f:
+                return json.load(f)
+        except (OSError, ValueError):
+            return {}
+
+    def _write(self, changes):
+        with self.lock:
+            state = self._read()
+            for key, value in changes.items():
+                if value is _DELETED:
+                    state.pop(key, None)
+                else:
+                    state[key] = value
+            tmp = "%s.%d.%d.tmp" % (self.path, os.getpid(), threading.get_ident())
+            with open(tmp, "w", encoding="utf-8") as f:
+                json.dump(state, f)
+            os.replace(tmp, self.path)
+
+    def load(self, key):
+        with self.lock:
+            if self.staged is not None and key in self.staged:
+                value = self.staged[key]
+                return None if value is _DELETED else value
+        return self._read().get(key)
+
+    def save(self, key, value):
+        with self.lock:
+            if self.staged is not None:
+                self.staged[key] = value
+            else:
+                self._write({key: value})
+
+    def delete(self, key):
+        with self.lock:
+            if self.staged is not None:
+                self.staged[key] = _DELETED
+            elif key in self._read():
+                self._write({key: _DELETED})
+
+    def flush(self):
+        """Write the changes staged by the open batch"""
+        with self.lock:
+            if self.staged:
+                self._write(self.staged)
+                self.staged.clear()
+
+    @contextmanager
+    def batch(self):
+        """Stage every save and delete made inside, writing them once at the end"""
+        with self.lock:
+            self._batches += 1
+            if self.staged is None:
+                self.staged = {}
+        try:
+            yield self
+        finally:
+            with self.lock:
+                self._batches -= 1
+                if not self._batches:
+                    try:
+                        self.flush()
+                    finally:
+                        self.staged = None
+
+
+_DELETED = object()
+
+
+class MemoryStateStore:
+    """Keeps sync state in memory, for a single process"""
+
+    def __init__(self):
+        self.state = {}
+
+    def load(self, key):
+        return self.state.get(key)
+
+    def save(self, key, value):
+        self.state[key] = value
+
+    def delete(self, key):
+        self.state.pop(key, None)
+
+
+def _student_key(student):
+    return student.get("kaid") or student.get("id") or student.get("email")
+
+
+class RosterDelta:
+    """
+    What a RosterSync run changed.
+    :param: added, students not in the snapshot before
+    :param: updated, students whose data changed
+    :param: removed, kaids dropped from the snapshot, only known after a
+        full sync
+    :param: roster, the whole snapshot after the run, kaid -> student
+    """
+
+    def __init__(self, added, updated, removed, roster, window):
+        self.added = added
+        self.updated = updated
+        self.removed = removed
+        self.roster = roster
+        # (dt_start, dt_end) asked for
+        self.window = window
+
+    def __bool__(self):
+        return bool(self.added or self.updated or self.removed)
+
+    def __repr__(self):
+        return "<RosterDelta +%d ~%d -%d of %d>" % (
+            len(self.added),
+            len(self.updated),
+            len(self.removed),
+            len(self.roster),
+        )
+
+
+class RosterSync:
+    """
+    Keeps a local snapshot of a coach's student list up to date with
+    get_student_list, only asking for the window since the previous sync.
+    Create it with KhanAPI.roster_sync():
+
+        sync = kapi.roster_sync(JsonStateStore("sync.json"))
+        delta = sync.sync()  # await sync.sync_async() with AsyncKhanAPI
+        for student in delta.added: ...
+        students = sync.roster
+
+    :param: client, KhanAPI or AsyncKhanAPI
+    :param: store, JsonStateStore or any object with load/save/delete
+    :param: coach, name of the snapshot, defaults to the client identity
+    :param: overlap, seconds the window reaches back before the high-water
+        mark, so changes recorded late on the server are not missed
+    :param: full_every, optional seconds after which a sync rescans the
+        whole history, the only way to notice students who left
+    """
+
+    def __init__(self, client, store, coach=None, overlap=300, full_every=None):
+        self.client = client
+        self.store = store
+        self.key = "roster:%s" % (coach or client.identity or "public")
+        self.overlap = overlap
+        self.full_every = full_every
+
+    def _state(self):
+        return self.store.load(self.key) or {
+            "watermark": None,
+            "full_sync": None,
+            "students": {},
+        }
+
+    @property
+    def roster(self):
+        """The local snapshot, kaid -> student"""
+        return self._state()["students"]
+
+    @property
+    def watermark(self):
+        return self._state()["watermark"]
+
+    def _window(self, state, full, now):
+        full = (
+            full
+            or state["watermark"] is None
+            or (
+                self.full_every is not None
+                and (
+                    state["full_sync"] is None
+                    or now - parse_time(state["full_sync"])
+                    > timedelta(seconds=self.full_every)
+                )
+            )
+        )
+        if full:
+            start = EPOCH
+        else:
+            start = format_time(
+                parse_time(state["watermark"]) - timedelta(seconds=self.overlap)
+            )
+        return full, {"dt_start": start, "dt_end": format_time(now)}
+
+    def _merge(self, state, students, full, window):
+        roster = dict(state["students"]) if not full else {}
+        previous = state["students"]
+        added = []
+        updated = []
+        for student in students:
+            key = _student_key(student)
+            if key is None:
+                continue
+            if not full and key in previous:
+                # the window may only hold the fields that changed
+                student = {**previous[key], **student}
+            roster[key] = student
+            if key not in previous:
+                added.append(student)
+            elif previous[key] != student:
+                updated.append(student)
+        removed = [key for key in previous if key not in roster] if full else []
+        new_state = {
+            "watermark": window["dt_end"],
+            "full_sync": window["dt_end"] if full else state["full_sync"],
+            "students": roster,
+        }
+        self.store.save(self.key, new_state)
+        return RosterDelta(
+            added, updated, removed, roster, (window["dt_start"], window["dt_end"])
+        )
+
+    def sync(self, full=False):
+        """
+        Fetch the students changed since the last sync and merge them into
+        the snapshot. Returns a RosterDelta.
+        :param: full, rescan the whole history and replace the snapshot
+        """
+        state = self._state()
+        full, window = self._window(state, full, datetime.utcnow())
+        students = self.client.get_student_list(window)
+        return self._merge(state, students, full, window)
+
+    async def sync_async(self, full=False):
+        """sync for an AsyncKhanAPI client"""
+        state = self._state()
+        full, window = self._window(state, full, datetime.utcnow())
+        students = await self.client.get_student_list(window)
+        return self._merge(state, students, full, window)
+
+    def reset(self):
+        """Forget the snapshot, the next sync starts from scratch"""
+        self.store.delete(self.key)
+
+
+def _time_key(value):
+    """Sortable form of an api timestamp, with or without fractions"""
+    value = value.rstrip("Z")
+    if "." in value:
+        value, fraction = value.split(".", 1)
+    else:
+        fraction = ""
+    return value + "." + fraction.ljust(6, "0")[:6]
+
+
+def _fingerprint(event):
+    return hashlib.sha1(json.dumps(event, sort_keys=True).encode("utf-8")).hexdigest()
+
+
+class _Cursor:
+    """
+    The latest timestamp seen in a stream of events, and the fingerprints of
+    the events at exactly that time, so events sharing the last timestamp
+    are neither lost nor delivered twice.
+    """
+
+    def __init__(self, state=None):
+        state = state or {}
+        self.time = state.get("time")
+        self.seen = set(state.get("seen", ()))
+
+    def is_new(self, event_time, event):
+        if self.time is None:
+            return True
+        key, cursor_key = _time_key(event_time), _time_key(self.time)
+        if key != cursor_key:
+            return key > cursor_key
+        return _fingerprint(event) not in self.seen
+
+    def advance(self, event_time, event):
+        if self.time is None or _time_key(event_time) > _time_key(self.time):
+            self.time = event_time
+            self.seen = set()
+        if _time_key(event_time) == _time_key(self.time):
+            self.seen.add(_fingerprint(event))
+
+    def state(self):
+        return {"time": self.time, "seen": sorted(self.seen)}
+
+
+class ActivitySync:
+    """
+    Delivers only the progress changes and problem logs that are new since
+    the previous run, keeping the latest timestamp seen for every (student,
+    exercise) in a state store. The api is asked for the window since the
+    cursors (reaching back `overlap` seconds), and anything older than the
+    cursors is filtered out.
+
+        activity = kapi.activity_sync(JsonStateStore("activity.json"))
+        for kaid, change in activity.iter_progress_changes(kaids):
+            ...
+        activity.sync_problem_logs(kaid, exercises, callback=handle_log)
+
+    With AsyncKhanAPI use aiter_progress_changes, aiter_problem_logs and the
+    sync_*_async methods.
+
+    Cursors of a student (or of an exercise for problem logs) are saved once
+    all its new events have been handed out, so events are delivered at
+    least once: stopping part way through re-delivers that student's events
+    on the next run. A store with a batch() context manager (JsonStateStore)
+    gets the cursors of a run in one batch, flushed every `flush_every`
+    students or exercises and when the run ends.
+    :param: client, KhanAPI
+    :param: store, JsonStateStore or any object with load/save/delete
+    :param: overlap, seconds the requested window reaches back before the
+        cursors, for changes recorded late on the server
+    :param: flush_every, cursors saved between two writes of a batching store
+    """
+
+    def __init__(self, client, store, overlap=300, flush_every=500):
+        self.client = client
+        self.store = store
+        self.overlap = overlap
+        self.flush_every = flush_every
+        self._unflushed = 0
+
+    def _load(self, kind, kaid):
+        return self.store.load("%s:%s" % (kind, kaid)) or {
+            "since": None,
+            "cursors": {},
+        }
+
+    def _save(self, kind, kaid, state):
+        self.store.save("%s:%s" % (kind, kaid), state)
+        self._unflushed += 1
+        if self._unflushed >= self.flush_every and hasattr(self.store, "flush"):
+            self.store.flush()
+            self._unflushed = 0
+
+    def _batch(self):
+        batch = getattr(self.store, "batch", None)
+        return batch() if batch is not None else nullcontext()
+
+    def _window(self, since, now):
+        params = {"dt_end": format_time(now)}
+        if since is not None:
+            start = parse_time(since) - timedelta(seconds=self.overlap)
+            params["dt_start"] = format_time(start)
+        return params
+
+    def _new_events(self, events, cursors, time_field, exercise_field=None):
+        """The events newer than their cursor, oldest first, advancing them"""
+        new = []
+        for event in sorted(events, key=lambda e: _time_key(e.get(time_field) or "")):
+            event_time = event.get(time_field)
+            if not event_time:
+                continue
+            exercise = event.get(exercise_field) if exercise_field else ""
+            if exercise is None:
+                # a None key would be saved as "null" and never match again
+                exercise = ""
+            cursor = cursors.setdefault(exercise, _Cursor())
+            if cursor.is_new(event_time, event):
+                cursor.advance(event_time, event)
+                new.append(event)
+        return new
+
+    def _progress_window(self, kaid):
+        state = self._load("progress_changes", kaid)
+        now = datetime.utcnow()
+        params = {"kaid": kaid, **self._window(state["since"], now)}
+        cursors = {
+            exercise: _Cursor(cursor) for exercise, cursor in state["cursors"].items()
+        }
+        return now, params, cursors
+
+    def _save_progress(self, kaid, now, cursors):
+        self._save(
+            "progress_changes",
+            kaid,
+            {
+                "since": format_time(now),
+                "cursors": {ex: c.state() for ex, c in cursors.items()},
+            },
+        )
+
+    def _problem_log_window(self, kaid, state, exercise):
+        cursor_state = state["cursors"].get(exercise)
+        since = cursor_state.get("since") if cursor_state else None
+        now = datetime.utcnow()
+        params = {"kaid": kaid, **self._window(since, now)}
+        return now, params, {"": _Cursor(cursor_state)}
+
+    def _save_problem_logs(self, kaid, state, exercise, now, cursors):
+        state["cursors"][exercise] = {
+            **cursors[""].state(),
+            "since": format_time(now),
+        }
+        self._save("problem_logs", kaid, state)
+
+    def iter_progress_changes(self, kaids):
+        """
+        Yield (kaid, progress change) for every mastery change of the students
+        newer than the previous run, per student in date order.
+        """
+        with self._batch():
+            for kaid in kaids:
+                now, params, cursors = self._progress_window(kaid)
+                events = self.client.user_exercises_progress_changes(params)
+                for event in self._new_events(events, cursors, "date", "exercise_name"):
+                    yield kaid, event
+                self._save_progress(kaid, now, cursors)
+
+    async def aiter_progress_changes(self, kaids):
+        """iter_progress_changes as an async generator, for AsyncKhanAPI"""
+        with self._batch():
+            for kaid in kaids:
+                now, params, cursors = self._progress_window(kaid)
+                events = await self.client.user_exercises_progress_changes(params)
+                for event in self._new_events(events, cursors, "date", "exercise_name"):
+                    yield kaid, event
+                self._save_progress(kaid, now, cursors)
+
+    def iter_problem_logs(self, kaid, exercises):
+        """
+        Yield (exercise, problem log) for every problem a student did in the
+        given exercises since the previous run, per exercise in time order.
+        """
+        state = self._load("problem_logs", kaid)
+        with self._batch():
+            for exercise in exercises:
+                now, params, cursors = self._problem_log_window(kaid, state, exercise)
+                events = self.client.user_exercises_log(exercise, params)
+                for event in self._new_events(events, cursors, "time_done"):
+                    yield exercise, event
+                self._save_problem_logs(kaid, state, exercise, now, cursors)
+
+    async def aiter_problem_logs(self, kaid, exercises):
+        """iter_problem_logs as an async generator, for AsyncKhanAPI"""
+        state = self._load("problem_logs", kaid)
+        with self._batch():
+            for exercise in exercises:
+                now, params, cursors = self._problem_log_window(kaid, state, exercise)
+                events = await self.client.user_exercises_log(exercise, params)
+                for event in self._new_events(events, cursors, "time_done"):
+                    yield exercise, event
+                self._save_problem_logs(kaid, state, exercise, now, cursors)
+
+    def sync_progress_changes(self, kaids, callback):
+        """
+        Call callback(kaid, change) for every new progress change, return the
+        number of changes delivered
+        """
+        count = 0
+        for kaid, event in self.iter_progress_changes(kaids):
+            callback(kaid, event)
+            count += 1
+        return count
+
+    async def sync_progress_changes_async(self, kaids, callback):
+        """sync_progress_changes for AsyncKhanAPI"""
+        count = 0
+        async for kaid, event in self.aiter_progress_changes(kaids):
+            callback(kaid, event)
+            count += 1
+        return count
+
+    def sync_problem_logs(self, kaid, exercises, callback):
+        """
+        Call callback(kaid, exercise, log) for every new problem log, return
+        the number of logs delivered
+        """
+        count = 0
+        for exercise, event in self.iter_problem_logs(kaid, exercises):
+            callback(kaid, exercise, event)
+            count += 1
+        return count
+
+    async def sync_problem_logs_async(self, kaid, exercises, callback):
+        """sync_problem_logs for AsyncKhanAPI"""
+        count = 0
+        async for exercise, event in self.aiter_problem_logs(kaid, exercises):
+            callback(kaid, exercise, event)
+            count += 1
+        return count
+
+    def reset(self, kaid):
+        """Forget the cursors of a student, the next run starts over"""
+        self.store.delete("progress_changes:%s" % kaid)
+        self.store.delete("problem_logs:%s" % kaid)
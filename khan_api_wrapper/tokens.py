@@ -0,0 +1,290 @@
+"""
+Access tokens kept on disk and shared by every thread and process using
+them, so a worker starting up reuses the tokens of the previous ones instead
+of going through the whole KhanAcademySignIn login again.
+
+    manager = TokenManager(
+        KhanAcademySignIn(consumer_key, consumer_secret, identifier, password),
+        FileTokenStore("tokens.json"),
+    )
+    kapi = KhanAPI(consumer_key, consumer_secret, tokens=manager)
+
+Tokens are refreshed `refresh_margin` seconds before they expire. The
+refresh happens under a lock held across processes, and the store is read
+again once the lock is held, so parallel workers log in only once.
+"""
+
+import json
+import os
+import threading
+from contextlib import contextmanager
+from time import time
+
+try:
+    import fcntl
+except ImportError:  # Windows
+    fcntl = None
+    try:
+        import msvcrt
+    except ImportError:
+        msvcrt = None
+
+DAY = 24 * 3600
+# Access tokens have been found to stay valid for about two weeks
+TOKEN_LIFETIME = 14 * DAY
+
+
+@contextmanager
+def _file_lock(path):
+    """Exclusive lock on `path`, held across processes"""
+    with open(path, "a+b") as f:
+        if fcntl is not None:
+            fcntl.flock(f.fileno(), fcntl.LOCK_EX)
+        elif msvcrt is not None:
+            f.seek(0)
+            msvcrt.locking(f.fileno(), msvcrt.LK_LOCK, 1)
+        try:
+            yield
+        finally:
+            if fcntl is not None:
+                fcntl.flock(f.fileno(), fcntl.LOCK_UN)
+            elif msvcrt is not None:
+                f.seek(0)
+                msvcrt.locking(f.fileno(), msvcrt.LK_UNLCK, 1)
+
+
+class FileTokenStore:
+    """
+    Stores tokens in a json file, one record per key. Writes go to a
+    temporary file renamed into place, and refreshes are serialised with a
+    lock on `path + ".lock"`.
+    """
+
+    def __init__(self, path):
+        self.path = path
+        self.thread_lock = threading.Lock()
+
+    def _read(self):
+        try:
+            with open(self.path, "r", encoding="utf-8") as f:
+                return json.load(f)
+        except (OSError, ValueError):
+            return {}
+
+    def load(self, key):
+        return self._read().get(key)
+
+    def save(self, key, record):
+        with self.thread_lock:
+            records = self._read()
+            records[key] = record
+            tmp = "%s.%d.%d.tmp" % (self.path, os.getpid(), threading.get_ident())
+            with open(tmp, "w", encoding="utf-8") as f:
+                json.dump(records, f)
+            os.replace(tmp, self.path)
+
+    def delete(self, key):
+        with self.thread_lock:
+            records = self._read()
+            if records.pop(key, None) is not None:
+                tmp = "%s.%d.%d.tmp" % (self.path, os.getpid(), threading.get_ident())
+                with open(tmp, "w", encoding="utf-8") as f:
+                    json.dump(records, f)
+                os.replace(tmp, self.path)
+
+    def lock(self, key):
+        return _file_lock(self.path + ".lock")
+
+
+class SQLiteTokenStore:
+    """
+    Stores tokens in a SQLite database, which can be shared with other data
+    of the application. Refreshes are serialised with an immediate
+    transaction, which holds the database write lock; reads and writes made
+    while it is held go through that same transaction.
+    """
+
+    def __init__(self, path, timeout=60):
+        self.path = path
+        self.timeout = timeout
+        # the connection holding the lock, per thread
+        self.local = threading.local()
+        db = self._connect()
+        try:
+            with db:
+                db.execute(
+                    "CREATE TABLE IF NOT EXISTS khan_tokens ("
+                    "key TEXT PRIMARY KEY, record TEXT NOT NULL)"
+                )
+        finally:
+            db.close()
+
+    def _connect(self):
+        import sqlite3
+
+        return sqlite3.connect(self.path, timeout=self.timeout)
+
+    @contextmanager
+    def _db(self):
+        db = getattr(self.local, "db", None)
+        if db is not None:
+            yield db
+            return
+        db = self._connect()
+        try:
+            with db:
+                yield db
+        finally:
+            db.close()
+
+    def load(self, key):
+        with self._db() as db:
+            row = db.execute(
+                "SELECT record FROM khan_tokens WHERE key = ?", (key,)
+            ).fetchone()
+        return json.loads(row[0]) if row else None
+
+    def save(self, key, record):
+        with self._db() as db:
+            db.execute(
+                "INSERT OR REPLACE INTO khan_tokens (key, record) VALUES (?, ?)",
+                (key, json.dumps(record)),
+            )
+
+    def delete(self, key):
+        with self._db() as db:
+            db.execute("DELETE FROM khan_tokens WHERE key = ?", (key,))
+
+    @contextmanager
+    def lock(self, key):
+        db = self._connect()
+        db.isolation_level = None
+        try:
+            db.execute("BEGIN IMMEDIATE")
+            self.local.db = db
+            try:
+                yield
+            except BaseException:
+                db.execute("ROLLBACK")
+                raise
+            else:
+                db.execute("COMMIT")
+            finally:
+                self.local.db = None
+        finally:
+            db.close()
+
+
+class TokenManager:
+    """
+    Hands out access tokens, logging in with `sign_in` only when the stored
+    ones are missing or about to expire.
+    :param: sign_in, a KhanAcademySignIn, or any object with an
+        authorize_self() method returning (token, secret)
+    :param: store, FileTokenStore, SQLiteTokenStore or None to only keep the
+        tokens in memory
+    :param: key, name of the tokens in the store, defaults to the consumer key
+        and identifier of `sign_in`
+    :param: lifetime, seconds a token stays valid after it is obtained
+    :param: refresh_margin, seconds before the expiry at which it is replaced
+    :param: relogin_interval, seconds a new token is trusted for: the server
+        rejecting it sooner does not cause another login
+    """
+
+    def __init__(
+        self,
+        sign_in,
+        store=None,
+        key=None,
+        lifetime=TOKEN_LIFETIME,
+        refresh_margin=DAY,
+        relogin_interval=60,
+    ):
+        self.sign_in = sign_in
+        self.store = store
+        if key is None:
+            consumer_key = getattr(
+                getattr(sign_in, "service", None), "consumer_key", ""
+            )
+            key = "%s:%s" % (consumer_key, getattr(sign_in, "khan_identifier", ""))
+        self.key = key
+        self.lifetime = lifetime
+        self.refresh_margin = refresh_margin
+        self.relogin_interval = relogin_interval
+        self.lock = threading.Lock()
+        self.record = None
+        # number of logins done by this manager
+        self.refreshes = 0
+
+    def _fresh(self, record):
+        return (
+            record is not None
+            and record.get("expires_at", 0) - self.refresh_margin > time()
+        )
+
+    def needs_refresh(self):
+        """True if the next call to get() will have to look past memory"""
+        return not self._fresh(self.record)
+
+    def get(self):
+        """Return fresh (access token, access token secret)"""
+        record = self.record
+        if not self._fresh(record):
+            with self.lock:
+                record = self._refresh()
+        return record["token"], record["secret"]
+
+    def _refresh(self):
+        if self._fresh(self.record):
+            return self.record
+        if self.store is None:
+            self.record = self._login()
+            return self.record
+        record = self.store.load(self.key)
+        if not self._fresh(record):
+            with self.store.lock(self.key):
+                # another process may have logged in while we waited
+                record = self.store.load(self.key)
+                if not self._fresh(record):
+                    record = self._login()
+                    self.store.save(self.key, record)
+        self.record = record
+        return record
+
+    def _login(self):
+        token, secret = self.sign_in.authorize_self()
+        self.refreshes += 1
+        now = time()
+        return {
+            "token": token,
+            "secret": secret,
+            "obtained_at": now,
+            "expires_at": now + self.lifetime,
+        }
+
+    def rejected(self, token):
+        """
+        Report that the server rejected `token` (a 401), e.g. because it was
+        revoked before its expiry. The token is forgotten, so the next get()
+        logs in again, unless it was obtained less than `relogin_interval`
+        seconds ago. Returns True if get() now hands out other tokens, worth
+        retrying the request with.
+        """
+        with self.lock:
+            record = self.record
+            if record is not None and record["token"] != token:
+                # already replaced, e.g. by another thread seeing the same 401
+                return True
+            if (
+                record is not None
+                and time() - record.get("obtained_at", 0) < self.relogin_interval
+            ):
+                return False
+            self.record = None
+            if self.store is not None:
+                with self.store.lock(self.key):
+                    stored = self.store.load(self.key)
+                    # other processes may have replaced it already
+                    if stored is not None and stored.get("token") == token:
+                        self.store.delete(self.key)
+            return True
@@ -0,0 +1,180 @@
+import gzip
+import json
+import os
+
+
+def _node_id(node, fallback):
+    return node.get("id") or node.get("slug") or node.get("name") or fallback
+
+
+def _link(children, linked, parent_id, child_id):
+    """Append child_id to the children of parent_id, unless it already is one"""
+    if (parent_id, child_id) not in linked:
+        linked.add((parent_id, child_id))
+        children.setdefault(parent_id, []).append(child_id)
+
+
+class TopicTree:
+    """
+    Index over the v1 topic tree, built in a single pass, with constant time
+    lookups of nodes by id, slug and exercise name. Nodes are the dicts of the
+    topic tree without their "children" list, and every node appearing more
+    than once in the tree (exercises often do) is stored once.
+
+    Build it with KhanAPI.get_topic_tree_index, or from data already loaded
+    with TopicTree.from_tree(kapi.topictree("Exercise")). save() and load()
+    keep it on disk so workers can start with a warm index.
+    """
+
+    FORMAT_VERSION = 1
+
+    def __init__(self, nodes, children, roots):
+        """
+        :param: nodes, dict of node id -> node
+        :param: children, dict of node id -> list of child ids
+        :param: roots, list of the ids of the top level nodes
+        """
+        self.nodes = nodes
+        self.children_ids = children
+        self.roots = roots
+        self.slugs = {}
+        self.exercise_ids = {}
+        # node id -> ids of its ancestors, from the root down, along the first
+        # place the node is found in the tree
+        self.paths = {}
+        self._index()
+
+    def _index(self):
+        for node_id, node in self.nodes.items():
+            slug = node.get("slug") or node.get("node_slug")
+            if slug:
+                self.slugs.setdefault(slug, node_id)
+            if node.get("kind") == "Exercise" and node.get("name"):
+                self.exercise_ids.setdefault(node["name"], node_id)
+
+        stack = [(root, ()) for root in reversed(self.roots)]
+        while stack:
+            node_id, path = stack.pop()
+            if node_id in self.paths:
+                continue
+            self.paths[node_id] = path
+            child_path = path + (node_id,)
+            for child in reversed(self.children_ids.get(node_id, ())):
+                if child not in self.paths:
+                    stack.append((child, child_path))
+
+    @classmethod
+    def from_tree(cls, data, children_key="children"):
+        """Build the index from a decoded topic tree (a node or list of nodes)"""
+        nodes = {}
+        children = {}
+        linked = set()
+        items = data if isinstance(data, list) else [data]
+        stack = [(None, item) for item in reversed(items)]
+        while stack:
+            parent_id, item = stack.pop()
+            node = {k: v for k, v in item.items() if k != children_key}
+            node_id = _node_id(node, "_%d" % len(nodes))
+            nodes.setdefault(node_id, node)
+            # the roots are linked under None. A topic listed twice keeps a
+            # single copy of each of its children.
+            _link(children, linked, parent_id, node_id)
+            for child in reversed(item.get(children_key) or []):
+                stack.append((node_id, child))
+        return cls(nodes, children, children.pop(None, []))
+
+    @classmethod
+    def from_depth_nodes(cls, depth_nodes):
+        """
+        Build the index from the (depth, node) tuples yielded by
+        streaming.iter_tree_nodes(..., with_depth=True), so the tree is never
+        held in memory as a whole.
+        """
+        nodes = {}
+        children = {}
+        linked = set()
+        # depth -> ids of the nodes seen at that depth still waiting for their
+        # parent, which is yielded after them
+        pending = {}
+        for depth, node in depth_nodes:
+            node_id = _node_id(node, "_%d" % len(nodes))
+            nodes.setdefault(node_id, node)
+            # merged, for a topic listed twice
+            for child_id in pending.pop(depth + 1, ()):
+                _link(children, linked, node_id, child_id)
+            pending.setdefault(depth, []).append(node_id)
+        roots = []
+        for node_id in pending.get(0, ()):
+            if node_id not in roots:
+                roots.append(node_id)
+        return cls(nodes, children, roots)
+
+    def __len__(self):
+        return len(self.nodes)
+
+    def __contains__(self, node_id):
+        return node_id in self.nodes
+
+    def node(self, node_id):
+        return self.nodes.get(node_id)
+
+    def by_slug(self, slug):
+        """Return the node with the given slug, or None"""
+        return self.nodes.get(self.slugs.get(slug))
+
+    def exercise(self, name):
+        """Return the exercise node with the given name, or None"""
+        return self.nodes.get(self.exercise_ids.get(name))
+
+    def children(self, node_id):
+        """Return the child nodes of a node"""
+        return [self.nodes[child] for child in self.children_ids.get(node_id, ())]
+
+    def ancestors(self, node_id):
+        """Return the nodes from the root down to the parent of a node"""
+        return [self.nodes[ancestor] for ancestor in self.paths.get(node_id, ())]
+
+    def exercise_path(self, name):
+        """Return the ancestors of the exercise with the given name"""
+        return self.ancestors(self.exercise_ids.get(name))
+
+    def exercises(self):
+        """Iterate over the exercise nodes, in the order of the tree"""
+        return (self.nodes[node_id] for node_id in self.exercise_ids.values())
+
+    def save(self, path):
+        """
+        Write the index to `path` as gzipped json, with nodes stored once in a
+        list and the structure as lists of node positions.
+        """
+        ids = list(self.nodes)
+        position = {node_id: i for i, node_id in enumerate(ids)}
+        data = {
+            "version": self.FORMAT_VERSION,
+            "ids": ids,
+            "nodes": [self.nodes[node_id] for node_id in ids],
+            "children": {
+                str(position[parent]): [position[child] for child in child_ids]
+                for parent, child_ids in self.children_ids.items()
+            },
+            "roots": [position[root] for root in self.roots],
+        }
+        tmp = "%s.%d.tmp" % (path, os.getpid())
+        with gzip.open(tmp, "wt", encoding="utf-8") as f:
+            json.dump(data, f, separators=(",", ":"))
+        os.replace(tmp, path)
+
+    @classmethod
+    def load(cls, path):
+        """Read an index written by save()"""
+        with gzip.open(path, "rt", encoding="utf-8") as f:
+            data = json.load(f)
+        if data.get("version") != cls.FORMAT_VERSION:
+            raise ValueError("Unsupported topic tree index version in %s" % path)
+        ids = data["ids"]
+        nodes = dict(zip(ids, data["nodes"]))
+        children = {
+            ids[int(parent)]: [ids[child] for child in child_positions]
+            for parent, child_positions in data["children"].items()
+        }
+        return cls(nodes, children, [ids[root] for root in data["roots"]])
@@ -14,6 +14,12 @@ setuptools.setup(
     url="https://github.com/jb-1980/khan_api_wrapper",
     packages=setuptools.find_packages(),
     install_requires=["requests", "rauth>=0.7.3"],
+    extras_require={
+        "async": ["aiohttp>=3.6"],
+        "streaming": ["ijson>=3.1"],
+        "fast": ["orjson>=3"],
+        "columnar": ["numpy", "pyarrow"],
+    },
     classifiers=[
         "Programming Language :: Python :: 3",
         "License :: OSI Approved :: MIT License",
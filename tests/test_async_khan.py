@@ -0,0 +1,113 @@
+"""AsyncKhanAPI against benchmarks/mock_server.py, over real HTTP"""
+
+import asyncio
+
+import pytest
+
+pytest.importorskip("aiohttp")
+
+from benchmarks.fixtures import Dataset
+from benchmarks.mock_server import MockKhanServer
+from khan_api_wrapper.async_khan import AsyncKhanAPI
+from khan_api_wrapper.khan import KhanAPI
+from khan_api_wrapper.sync import MemoryStateStore
+
+
+def _public_methods(cls):
+    return {
+        name
+        for name in dir(cls)
+        if not name.startswith("_") and callable(getattr(cls, name))
+    }
+
+
+def test_same_public_methods_as_khan_api():
+    assert _public_methods(KhanAPI) - _public_methods(AsyncKhanAPI) == set()
+
+
+@pytest.fixture(scope="module")
+def dataset():
+    return Dataset("small", 0)
+
+
+@pytest.fixture
+def server(dataset):
+    with MockKhanServer(dataset) as server:
+        yield server
+
+
+def _run(server, calls, **kwargs):
+    async def run():
+        async with AsyncKhanAPI(server_url=server.url, **kwargs) as api:
+            return await calls(api)
+
+    return asyncio.run(run())
+
+
+def test_rest_calls(server, dataset):
+    kaids = dataset.kaids[:3]
+
+    async def calls(api):
+        return await asyncio.gather(*(api.get_student_progress(k) for k in kaids))
+
+    assert [p["kaid"] for p in _run(server, calls)] == kaids
+    assert server.stats()["total_requests"] == 3
+
+
+def test_exercise_names_match_the_sync_client(server):
+    async def calls(api):
+        names = await api.get_all_exercise_names_and_titles()
+        streamed = [e async for e in api.iter_all_exercise_names_and_titles(True)]
+        return names, streamed
+
+    names, streamed = _run(server, calls)
+    expected = KhanAPI(server_url=server.url).get_all_exercise_names_and_titles()
+    assert names == streamed == expected
+
+
+def test_tree_readers(server):
+    async def calls(api):
+        exercises = [e async for e in api.iter_exercises_v2(fallback=True)]
+        topics = [t async for t in api.iter_topics_v2(fallback=True)]
+        tree = await api.get_topic_tree_index(fallback=True)
+        events = [e async for e in api.stream("/api/v1/topictree", chunk_size=512)]
+        return exercises, topics, tree, events
+
+    exercises, topics, tree, events = _run(server, calls)
+    sync_api = KhanAPI(server_url=server.url)
+    v2 = sync_api.get_resource("/api/v2/topics/topictree")
+    assert exercises == v2["exercises"]
+    assert topics == v2["topics"]
+    expected = sync_api.get_topic_tree_index(fallback=True)
+    assert list(tree.exercises()) == list(expected.exercises())
+    assert events == list(sync_api.stream("/api/v1/topictree"))
+
+
+def test_cache_serves_repeated_catalog_calls(server):
+    async def calls(api):
+        first = await api.get_resource("/api/v1/topictree", {"kind": "Topic"})
+        second = await api.get_resource("/api/v1/topictree", {"kind": "Topic"})
+        return first, second
+
+    first, second = _run(server, calls, cache=True)
+    assert first == second
+    assert server.stats()["total_requests"] == 1
+
+
+def test_activity_sync_and_batch(server, dataset):
+    kaid = dataset.kaids[0]
+    store = MemoryStateStore()
+
+    async def calls(api):
+        activity = api.activity_sync(store)
+        changes = [c async for c in activity.aiter_progress_changes([kaid])]
+        again = await activity.sync_progress_changes_async([kaid], print)
+        async with api.batch() as batch:
+            batch.add("getStudentsList", {})
+            batch.add("getStudentsList", {})
+        return changes, again, batch.results
+
+    changes, again, results = _run(server, calls)
+    assert changes and all(k == kaid for k, _ in changes)
+    assert again == 0
+    assert len(results) == 2 and results[0] == results[1]
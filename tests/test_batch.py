@@ -0,0 +1,69 @@
+import pytest
+
+from khan_api_wrapper.graphql import (
+    Operation,
+    get_operation,
+    merge_operations,
+    merged_variables,
+    split_merged_response,
+)
+from khan_api_wrapper.batch import plan_batches
+from khan_api_wrapper.projection import project
+
+DOCUMENT = """query userName($kaid: String!) {
+  user(kaid: $kaid) {
+    ...UserFields
+  }
+}
+
+fragment UserFields on User {
+  id
+  nickname
+}
+"""
+
+
+def test_merge_and_split_round_trip():
+    ops = [Operation(DOCUMENT), Operation(DOCUMENT)]
+    merged = merge_operations(ops)
+    assert merged.name == "batch_2_userName"
+    assert "$kaid_0: String!" in merged.document
+    assert "b1_user: user(kaid: $kaid_1)" in merged.document
+    # the shared fragment is only defined once
+    assert merged.document.count("fragment UserFields") == 1
+    assert merged_variables([{"kaid": "a"}, {"kaid": "b"}]) == {
+        "kaid_0": "a",
+        "kaid_1": "b",
+    }
+
+    response = {
+        "data": {"b0_user": {"id": "a"}, "b1_user": None},
+        "errors": [
+            {"message": "Not found", "path": ["b1_user", "id"]},
+            {"message": "Slow down"},
+        ],
+    }
+    first, second = split_merged_response(response, 2)
+    assert first["data"] == {"user": {"id": "a"}}
+    assert first["errors"] == [{"message": "Slow down"}]
+    assert second["data"] == {"user": None}
+    assert second["errors"][0] == {"message": "Not found", "path": ["user", "id"]}
+
+
+def test_queries_and_mutations_do_not_merge():
+    with pytest.raises(ValueError):
+        merge_operations(
+            [get_operation("getStudentsList"), get_operation("stopCoaching")]
+        )
+
+
+def test_split_keeps_an_error_body_that_is_not_graphql():
+    response = {"error": 500, "message": "Internal error"}
+    for result in split_merged_response(response, 3):
+        assert result == {"error": 500, "message": "Internal error", "data": None}
+
+
+def test_merged_variables_leave_out_the_unused_ones():
+    op = project("getStudentsList", ["coach.studentsPage.students.kaid"])
+    (request,) = plan_batches([(op, {"hasClassId": False, "classId": "c1"})] * 2)
+    assert request.merged_variables() == {"hasClassId_0": False, "hasClassId_1": False}
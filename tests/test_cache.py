@@ -0,0 +1,94 @@
+from khan_api_wrapper.cache import DAY, DiskCache, MemoryCache, ResponseCache
+
+
+def _entry(body, expires=0):
+    return {"body": body, "expires": expires}
+
+
+def test_ttls_longest_prefix_wins_and_per_user_urls_are_not_cached():
+    cache = ResponseCache(ttls={"/api/v1/exercises/addition": 60})
+    assert cache.ttl("/api/v1/topictree") == DAY
+    assert cache.ttl("/api/v1/exercises/counting") == DAY
+    assert cache.ttl("/api/v1/exercises/addition_1") == 60
+    assert cache.ttl("/api/v1/user") is None
+    assert (
+        ResponseCache(ttls={"/api/v1/topictree": None}).ttl("/api/v1/topictree") is None
+    )
+
+
+def test_keys():
+    cache = ResponseCache()
+    key = cache.key("/api/v1/topictree", {"kind": "Exercise"}, "me")
+    assert key == cache.key("/api/v1/topictree", {"kind": "Exercise", "_": 1}, "me")
+    assert key != cache.key("/api/v1/topictree", {"kind": "Exercise"}, "other")
+    assert key != cache.key("/api/v1/topictree", {"kind": "Topic"}, "me")
+
+
+def test_lookup_and_set():
+    cache = ResponseCache()
+    key = cache.key("/api/v1/topictree", {}, None)
+    assert cache.lookup(key) == (None, False)
+    cache.set(key, b"{}", 60)
+    entry, fresh = cache.lookup(key)
+    assert fresh and entry["body"] == b"{}"
+    assert cache.get(key) is entry
+    cache.set(key, b"[]", 0)
+    entry, fresh = cache.lookup(key)
+    # a stale entry is still handed out, to be revalidated
+    assert not fresh and entry["body"] == b"[]"
+    assert cache.get(key) is None
+    snapshot = cache.stats.snapshot()
+    assert snapshot["stores"] == 2
+    assert snapshot["hits"] == 2 and snapshot["misses"] == 3
+
+
+def test_memory_cache_evicts_the_least_recently_used():
+    cache = MemoryCache(maxsize=2)
+    cache.set("a", _entry(b"1"))
+    cache.set("b", _entry(b"2"))
+    cache.get("a")
+    cache.set("c", _entry(b"3"))
+    assert cache.get("b") is None
+    assert cache.get("a") is not None and cache.get("c") is not None
+
+
+def test_memory_cache_bounds_the_bytes():
+    cache = MemoryCache(max_bytes=5)
+    cache.set("a", _entry(b"123"))
+    cache.set("b", _entry(b"456"))
+    assert cache.get("a") is None
+    assert cache.size == 3
+    cache.delete("b")
+    assert cache.size == 0
+
+
+def test_disk_cache(tmp_path):
+    cache = DiskCache(str(tmp_path), max_entries=1)
+    assert cache.get("a") is None
+    cache.set("a", {"body": b"\x00raw\n", "expires": 5, "etag": None})
+    assert cache.get("a") == {"body": b"\x00raw\n", "expires": 5, "etag": None}
+    # another instance over the same directory sees the entry
+    assert DiskCache(str(tmp_path)).get("a")["body"] == b"\x00raw\n"
+    cache.set("b", _entry(b"2"))
+    assert len(list(tmp_path.iterdir())) == 1
+    cache.clear()
+    assert cache.get("b") is None
+
+
+def test_conditional_headers_and_revalidation():
+    cache = ResponseCache()
+    key = cache.key("/api/v1/topictree", {}, None)
+    cache.set(key, b"{}", 0, {"ETag": '"v1"', "Last-Modified": "yesterday"})
+    entry, fresh = cache.lookup(key)
+    assert not fresh
+    assert cache.conditional_headers(entry) == {
+        "If-None-Match": '"v1"',
+        "If-Modified-Since": "yesterday",
+    }
+    assert cache.conditional_headers(None) is None
+
+    cache.revalidated(key, entry, 60, {"ETag": '"v2"'})
+    entry, fresh = cache.lookup(key)
+    assert fresh and entry["body"] == b"{}"
+    assert entry["etag"] == '"v2"' and entry["last_modified"] == "yesterday"
+    assert cache.stats.revalidations == 1
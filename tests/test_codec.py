@@ -0,0 +1,90 @@
+import json
+
+import pytest
+
+from khan_api_wrapper import codec
+from khan_api_wrapper.khan import KhanAPI
+
+PAYLOAD = {
+    "kaid": "kaid_1",
+    "nickname": "Zoë 🦉",
+    "points": 12,
+    "ratio": 0.25,
+    "mastered": True,
+    "last_done": None,
+    "exercises": [{"name": "addition_1", "streak": 3}, []],
+    1: "int keys become strings",
+}
+
+
+@pytest.fixture(autouse=True)
+def restore_codec():
+    previous = codec._codec
+    yield
+    codec._codec = previous
+
+
+def test_stdlib_codec():
+    stdlib = codec.set_codec("stdlib")
+    assert codec.get_codec() is stdlib
+    text = codec.dumps(PAYLOAD)
+    assert text == json.dumps(PAYLOAD)
+    assert codec.loads(text.encode("utf-8")) == codec.loads(text)
+    assert codec.loads(text)["1"] == "int keys become strings"
+
+
+def test_orjson_and_stdlib_agree():
+    pytest.importorskip("orjson")
+    fast, stdlib = codec.OrjsonCodec(), codec.StdlibCodec()
+    fast_text, stdlib_text = fast.dumps(PAYLOAD), stdlib.dumps(PAYLOAD)
+    assert isinstance(fast_text, str)
+    # orjson leaves out the spaces, the documents are the same
+    assert fast_text == json.dumps(PAYLOAD, separators=(",", ":"), ensure_ascii=False)
+    for text in (fast_text, stdlib_text):
+        body = text.encode("utf-8")
+        assert fast.loads(body) == stdlib.loads(body) == stdlib.loads(stdlib_text)
+    assert codec.set_codec("auto").name == "orjson"
+
+
+class Recording(codec.StdlibCodec):
+    name = "recording"
+
+    def __init__(self):
+        self.calls = []
+
+    def loads(self, data):
+        self.calls.append("loads")
+        return super().loads(data)
+
+    def dumps(self, obj):
+        self.calls.append("dumps")
+        return super().dumps(obj)
+
+
+class Response:
+    status_code = 200
+    headers = {"content-type": "application/json"}
+
+    def __init__(self, content):
+        self.content = content
+
+
+class Session:
+    def __init__(self):
+        self.bodies = []
+
+    def post(self, url, data=None, params=None, headers=None):
+        self.bodies.append(data)
+        return Response(b'{"data": {"user": {"kaid": "kaid_1"}}}')
+
+
+def test_set_codec_is_used_by_graphql():
+    recording = codec.set_codec(Recording())
+    api = KhanAPI()
+    session = api._session = Session()
+    response = api.graphql("getStudentsList", {"hasClassId": False})
+    assert response == {"data": {"user": {"kaid": "kaid_1"}}}
+    assert recording.calls == ["dumps", "loads"]
+    assert json.loads(session.bodies[0])["variables"] == {"hasClassId": False}
+    with pytest.raises(KeyError):
+        codec.set_codec("nope")
@@ -0,0 +1,141 @@
+import csv
+import io
+
+import pytest
+
+from khan_api_wrapper import columnar
+
+ROWS = [
+    {
+        "kaid": "kaid_1",
+        "exercise": "addition_1",
+        "exercise_progress": {"level": "mastery3"},
+        "total_done": 12,
+        "total_correct": 10,
+        "streak": 3,
+        "longest_streak": 5,
+        "practiced": True,
+        "mastered": False,
+        "last_done": "2019-01-08T06:59:59Z",
+        "proficient_date": None,
+        "maximum_exercise_progress_dt": "2019-01-08T06:59:59.250Z",
+    },
+    {
+        "kaid": "kaid_2",
+        "exercise": "addition_1",
+        "exercise_progress": {"level": "practiced"},
+        "total_done": 4,
+        "total_correct": None,
+        "practiced": None,
+        "mastered": True,
+        "last_done": None,
+    },
+]
+
+
+def test_dates_round_trip_through_epoch_milliseconds():
+    ms = columnar.epoch_ms("2019-01-08T06:59:59.250Z")
+    assert ms == 1546930799250
+    assert columnar.format_ms(ms) == "2019-01-08T06:59:59.250Z"
+    assert columnar.format_ms(columnar.epoch_ms("2019-01-08T06:59:59Z")) == (
+        "2019-01-08T06:59:59Z"
+    )
+    assert columnar.epoch_ms(None) == columnar.NAT
+    assert columnar.epoch_ms("not a date") == columnar.NAT
+    assert columnar.format_ms(columnar.NAT) is None
+
+
+def test_columns_keep_their_kind():
+    ids = columnar.Column("kaid", columnar.DICTIONARY)
+    for value in ("a", "b", "a", None):
+        ids.append(value)
+    assert list(ids.data) == [0, 1, 0, -1]
+    assert ids.categories == ["a", "b"]
+    assert ids.values() == ["a", "b", "a", None]
+
+    flags = columnar.Column("mastered", columnar.BOOLEAN)
+    numbers = columnar.Column("streak", columnar.NUMBER)
+    for value in (True, None, False):
+        flags.append(value)
+        numbers.append(None if value is None else 2.5 if value else 3)
+    assert flags.values() == [True, None, False]
+    assert numbers.values() == [2.5, None, 3]
+    with pytest.raises(ValueError):
+        columnar.Column("x", "nope")
+
+
+def test_progress_tables():
+    response = {
+        "data": {
+            "coach": {
+                "assignment": {
+                    "id": "as1",
+                    "dueDate": "2019-01-08T06:59:59Z",
+                    "itemCompletionStates": [
+                        {
+                            "student": {"kaid": "kaid_1"},
+                            "state": "COMPLETED",
+                            "completedOn": "2019-01-07T10:00:00Z",
+                            "bestScore": {"numCorrect": 4, "numAttempted": 5},
+                        },
+                        {"studentKaid": "kaid_2", "state": "UNSTARTED"},
+                    ],
+                }
+            }
+        }
+    }
+    table = columnar.completion_table(response)
+    assert table.names == [name for name, _ in columnar.COMPLETION_SCHEMA]
+    due = "2019-01-08T06:59:59Z"
+    assert list(table.rows()) == [
+        ("as1", due, "kaid_1", "COMPLETED", "2019-01-07T10:00:00Z", 4, 5),
+        ("as1", due, "kaid_2", "UNSTARTED", None, None, None),
+    ]
+    assignments = [response["data"]["coach"]["assignment"]] * 3
+    chunks = list(columnar.iter_progress_tables(assignments, chunk_size=4))
+    assert [len(chunk) for chunk in chunks] == [4, 2]
+    assert len(columnar.progress_table([])) == 0
+
+
+def test_to_numpy():
+    numpy = pytest.importorskip("numpy")
+
+    arrays = columnar.user_exercises_table(ROWS).to_numpy()
+    assert arrays["kaid"].dtype == numpy.int32
+    assert list(arrays["kaid"]) == [0, 1]
+    assert numpy.isnan(arrays["total_correct"][1])
+    assert arrays["last_done"].dtype == numpy.dtype("datetime64[ms]")
+    assert numpy.isnat(arrays["last_done"][1])
+
+
+def test_write_csv_header_once_after_an_empty_table():
+    empty = columnar.Table(columnar.USER_EXERCISES_SCHEMA)
+    tables = [empty] + list(columnar.iter_user_exercise_tables(ROWS, chunk_size=1))
+    out = io.StringIO()
+    assert columnar.write_csv(tables, out) == 2
+    lines = list(csv.reader(io.StringIO(out.getvalue())))
+    assert lines[0] == [name for name, _ in columnar.USER_EXERCISES_SCHEMA]
+    assert len(lines) == 3
+    assert lines[1][:3] == ["kaid_1", "addition_1", "mastery3"]
+    # missing values are empty
+    assert lines[2][4] == ""
+
+
+def test_to_arrow_and_write_parquet(tmp_path):
+    pyarrow = pytest.importorskip("pyarrow")
+    pytest.importorskip("pyarrow.parquet")
+
+    table = columnar.user_exercises_table(ROWS)
+    arrow = table.to_arrow()
+    assert arrow.num_rows == 2
+    assert pyarrow.types.is_dictionary(arrow.schema.field("kaid").type)
+    assert arrow.schema.field("last_done").type == pyarrow.timestamp("ms", tz="UTC")
+    assert arrow.column("total_correct").to_pylist() == [10.0, None]
+    assert arrow.column("practiced").to_pylist() == [True, None]
+
+    path = str(tmp_path / "exercises.parquet")
+    tables = columnar.iter_user_exercise_tables(ROWS, chunk_size=1)
+    assert columnar.write_parquet(tables, path) == 2
+    written = pyarrow.parquet.read_table(path)
+    assert written.num_rows == 2
+    assert written.column("kaid").to_pylist() == ["kaid_1", "kaid_2"]
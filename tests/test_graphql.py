@@ -0,0 +1,79 @@
+import hashlib
+import json
+
+import pytest
+
+from khan_api_wrapper import graphql
+from khan_api_wrapper.graphql import (
+    PERSISTED_QUERY_NOT_FOUND,
+    PERSISTED_QUERY_NOT_SUPPORTED,
+    GraphQLError,
+    Operation,
+    dig,
+    get_operation,
+    persisted_query_error,
+)
+
+DOCUMENT = """query userName($kaid: String!) {
+  user(kaid: $kaid) {
+    ...UserFields
+  }
+}
+
+fragment UserFields on User {
+  id
+  nickname
+}
+"""
+
+
+def test_operation_payloads():
+    op = Operation(DOCUMENT)
+    assert op.name == "userName" and not op.is_mutation
+    assert op.sha256 == hashlib.sha256(DOCUMENT.encode("utf-8")).hexdigest()
+    persisted = {"persistedQuery": {"version": 1, "sha256Hash": op.sha256}}
+    full = json.loads(op.payload({"kaid": "k1"}))
+    assert full == {
+        "operationName": "userName",
+        "query": DOCUMENT,
+        "variables": {"kaid": "k1"},
+    }
+    hashed = json.loads(op.payload({"kaid": "k1"}, mode="hash"))
+    assert "query" not in hashed and hashed["extensions"] == persisted
+    registered = json.loads(op.payload({}, mode="register"))
+    assert registered["query"] == DOCUMENT
+    assert registered["extensions"] == persisted
+
+
+def test_operation_needs_a_name():
+    with pytest.raises(ValueError):
+        Operation("{ user { id } }")
+
+
+def test_operations_are_built_on_first_use():
+    assert "getStudentsList" in graphql.OPERATIONS
+    op = get_operation("getStudentsList")
+    assert op is graphql.OPERATIONS["getStudentsList"]
+    assert get_operation(op) is op
+    assert get_operation("publishAssignment").is_mutation
+    with pytest.raises(ValueError):
+        get_operation("nope")
+
+
+def test_dig():
+    response = {"data": {"coach": {"assignment": {"id": "a1"}}}}
+    assert dig(response, "coach", "assignment", "id") == "a1"
+    failed = {"data": {"coach": None}, "errors": [{"message": "Forbidden"}]}
+    with pytest.raises(GraphQLError) as error:
+        dig(failed, "coach", "assignment")
+    assert "Forbidden" in str(error.value)
+    assert error.value.response is failed
+
+
+def test_persisted_query_error():
+    not_found = {"errors": [{"message": "PersistedQueryNotFound"}]}
+    assert persisted_query_error(not_found) == PERSISTED_QUERY_NOT_FOUND
+    by_code = {"errors": [{"extensions": {"code": "PERSISTED_QUERY_NOT_SUPPORTED"}}]}
+    assert persisted_query_error(by_code) == PERSISTED_QUERY_NOT_SUPPORTED
+    assert persisted_query_error({"errors": [{"message": "Forbidden"}]}) is None
+    assert persisted_query_error(None) is None
@@ -0,0 +1,96 @@
+from khan_api_wrapper.instrumentation import OTHER, CallRecord, Instrumentation
+from khan_api_wrapper.khan import KhanAPI
+from khan_api_wrapper.tokens import TokenManager
+
+
+def test_operation_tags():
+    instrumentation = Instrumentation(templates=["/api/v1/custom/{id}"])
+    tag = instrumentation.operation
+    assert tag("GET", "/api/v1/topic/math?x=1") == "/api/v1/topic/{slug}"
+    assert tag("GET", "/api/v1/user/exercises/addition_1/log") == (
+        "/api/v1/user/exercises/{name}/log"
+    )
+    assert tag("GET", "/api/v1/user") == "/api/v1/user"
+    assert tag("GET", "/api/v1/custom/42") == "/api/v1/custom/{id}"
+    # unknown paths never carry their kaids or names into the tags
+    assert tag("GET", "/api/v1/unknown/kaid_123") == OTHER
+    assert tag("GET", "/api/internal/user/kaid_123/unknown") == OTHER
+    assert tag("GET", "/api/internal/user/joinclass/ABC12") == (
+        "/api/internal/user/joinclass/{class_code}"
+    )
+    graphql = '{"operationName":"getStudentsList","query":"..."}'
+    assert tag("POST", "/api/internal/graphql", graphql) == "getStudentsList"
+    assert tag("POST", "/api/internal/graphql", graphql.encode()) == ("getStudentsList")
+    assert tag("POST", "/api/internal/graphql", "[]") == "/api/internal/graphql"
+
+
+def test_no_probe_without_callbacks():
+    instrumentation = Instrumentation()
+    assert instrumentation.probe("GET", "/api/v1/user") is None
+    records = []
+    callback = instrumentation.add_callback(records.append)
+    assert instrumentation.probe("GET", "/api/v1/user") is not None
+    instrumentation.remove_callback(callback)
+    assert instrumentation.probe("GET", "/api/v1/user") is None
+
+
+class SignIn:
+    def __init__(self):
+        self.logins = 0
+
+    def authorize_self(self):
+        self.logins += 1
+        return "token%d" % self.logins, "secret%d" % self.logins
+
+
+class Response:
+    def __init__(self, status_code):
+        self.status_code = status_code
+        self.headers = {"content-type": "application/json"}
+        self.content = b'{"kaid": "kaid_1"}'
+
+    def close(self):
+        pass
+
+
+class Session:
+    """Rejects the first token, like a server on which it was revoked"""
+
+    access_token = None
+    access_token_secret = None
+
+    def get(self, url, **kwargs):
+        return Response(401 if self.access_token == "token1" else 200)
+
+
+def test_the_attempt_after_a_401_is_counted():
+    tokens = TokenManager(SignIn(), relogin_interval=0)
+    api = KhanAPI("key", "secret", tokens=tokens)
+    session = api._session = Session()
+    session.access_token, session.access_token_secret = tokens.get()
+    records = []
+    api.instrumentation.add_callback(records.append)
+    summary = api.instrumentation.add_summary()
+    assert api.get("/api/v1/user") == {"kaid": "kaid_1"}
+    (record,) = records
+    assert record.operation == "/api/v1/user"
+    assert record.status == 200
+    assert (record.attempts, record.retries) == (2, 1)
+    assert record.error is None and record.total >= record.decode >= 0
+    assert summary.summary()["/api/v1/user"]["retries"] == 1
+
+
+def test_summary_report():
+    instrumentation = Instrumentation()
+    summary = instrumentation.add_summary()
+    for status, total in ((200, 0.01), (500, 0.2)):
+        record = CallRecord("getStudentsList", "POST", "/api/internal/graphql")
+        record.status = status
+        record.attempts = 1
+        record.total = total
+        instrumentation.emit(record)
+    stats = summary.summary()["getStudentsList"]
+    assert stats["count"] == 2
+    assert stats["statuses"] == {200: 1, 500: 1}
+    assert stats["phases"]["total"]["p50"] == 0.016
+    assert summary.report().splitlines()[1].startswith("getStudentsList")
@@ -0,0 +1,82 @@
+from time import sleep
+
+import pytest
+
+from khan_api_wrapper.khan import (
+    KhanAPI,
+    PartialResultError,
+    _exercise_chunks,
+    _merge_chunk_results,
+)
+
+
+def test_pool_settings_reach_the_adapter():
+    api = KhanAPI(pool_connections=3, pool_maxsize=25, pool_block=True)
+    for prefix in ("https://", "http://"):
+        adapter = api.session.get_adapter(prefix + "www.khanacademy.org")
+        assert adapter._pool_connections == 3
+        assert adapter._pool_maxsize == 25
+        assert adapter._pool_block is True
+        assert adapter.poolmanager.connection_pool_kw["maxsize"] == 25
+
+
+def test_exercise_chunks_stay_below_the_limit():
+    exercises = ["exercise_%03d" % i for i in range(300)]
+    chunks = list(_exercise_chunks(list(reversed(exercises)) + exercises[:10], 100))
+    # sorted, without the duplicates, and every chunk fits the limit
+    assert [e for chunk in chunks for e in chunk] == exercises
+    assert all(len(",".join(chunk)) < 100 for chunk in chunks)
+    # a chunk is only cut when the next name would not fit
+    assert all(
+        len(",".join(chunk + [nxt[0]])) + 1 >= 100
+        for chunk, nxt in zip(chunks, chunks[1:])
+    )
+    assert list(_exercise_chunks([])) == []
+
+
+def _stub_client(fail=()):
+    api = KhanAPI()
+    calls = []
+
+    def get_resource(url, params):
+        chunk = params["exercises"].split(",")
+        calls.append(chunk)
+        # later chunks answer first, the results still come back in order
+        sleep(0.001 * (len(calls) % 3))
+        if set(chunk) & set(fail):
+            raise ValueError(params["exercises"])
+        return [{"exercise": e, "kaid": params["kaid"]} for e in chunk]
+
+    api.get_resource = get_resource
+    return api, calls
+
+
+def test_get_many_exercises_keeps_order_and_drops_duplicates():
+    exercises = ["exercise_%04d" % i for i in range(400)]
+    api, calls = _stub_client()
+    shuffled = exercises[::-1] + exercises[::7]
+    result = api.get_many_exercises(shuffled, "kaid_1", max_workers=4)
+    assert len(calls) > 1
+    assert [r["exercise"] for r in result] == exercises
+    assert all(r["kaid"] == "kaid_1" for r in result)
+
+
+def test_failed_chunk_raises_with_the_partial_result():
+    exercises = ["exercise_%04d" % i for i in range(400)]
+    api, calls = _stub_client(fail=["exercise_0000"])
+    with pytest.raises(PartialResultError) as info:
+        api.get_many_exercises(exercises, "kaid_1")
+    (failed,) = info.value.errors
+    assert failed[0] == "exercise_0000"
+    assert isinstance(info.value.errors[failed], ValueError)
+    assert [r["exercise"] for r in info.value.results] == exercises[len(failed) :]
+
+
+def test_merge_chunk_results():
+    chunks = [["a"], ["b"], ["c"]]
+    assert _merge_chunk_results(chunks, [[1], [2], [3]]) == [1, 2, 3]
+    error = {"error": "nope"}
+    with pytest.raises(PartialResultError) as info:
+        _merge_chunk_results(chunks, [[1], error, [3]])
+    assert info.value.results == [1, 3]
+    assert info.value.errors == {("b",): error}
@@ -0,0 +1,94 @@
+"""The client against benchmarks/mock_server.py, over real HTTP"""
+
+from urllib.request import Request, urlopen
+
+import pytest
+
+from benchmarks.fixtures import Dataset
+from benchmarks.mock_server import MockKhanServer
+from khan_api_wrapper.cache import ResponseCache
+from khan_api_wrapper.khan import KhanAPI
+from khan_api_wrapper.scheduler import DOCUMENTED, INTERNAL, RetryPolicy
+
+
+@pytest.fixture(scope="module")
+def dataset():
+    return Dataset("small", 0)
+
+
+@pytest.fixture
+def server(dataset):
+    with MockKhanServer(dataset) as server:
+        yield server
+
+
+def _client(server, **kwargs):
+    return KhanAPI(server_url=server.url, **kwargs)
+
+
+def test_rest_call(server, dataset):
+    kaid = dataset.kaids[0]
+    api = _client(server)
+    assert api.get_student_progress(kaid)["kaid"] == kaid
+    assert server.stats()["total_requests"] == 1
+
+
+def test_etag_and_not_modified(server):
+    url = server.url + "/api/v1/topictree?kind=Topic"
+    with urlopen(url) as response:
+        etag = response.headers["ETag"]
+        body = response.read()
+    assert etag and body
+    request = Request(url, headers={"If-None-Match": "W/%s" % etag})
+    with pytest.raises(Exception) as error:
+        urlopen(request)
+    # urllib reports a 304 as an HTTPError
+    assert error.value.code == 304
+    assert server.stats()["not_modified"] == 1
+
+
+def test_cache_revalidates_with_the_server(server):
+    cache = ResponseCache(ttls={"/api/v1/topictree": 0})
+    api = _client(server, cache=cache)
+    first = api.topictree("Topic")
+    sent = server.stats()["bytes_sent"]
+    assert api.topictree("Topic") == first
+    stats = server.stats()
+    assert stats["not_modified"] == 1
+    assert stats["bytes_sent"] == sent
+    assert cache.stats.revalidations == 1
+
+
+def test_injected_errors_are_retried(dataset):
+    with MockKhanServer(dataset, error_rate=0.3, seed=1) as server:
+        policy = RetryPolicy(max_retries=10, backoff_factor=0)
+        api = _client(server)
+        api.scheduler.policies.update({DOCUMENTED: policy, INTERNAL: policy})
+        for kaid in dataset.kaids[:20]:
+            assert api.get_student_progress(kaid)["kaid"] == kaid
+        errors = server.stats()["errors"]
+    assert errors > 0
+    assert api.stats.retries == errors
+
+
+def test_graphql_single_batched_and_persisted(server, dataset):
+    ids = list(dataset.assignments_by_id)[:5]
+    api = _client(server)
+    single = [api.simple_completion_query(i) for i in ids]
+    assert [r["data"]["coach"]["assignment"]["id"] for r in single] == ids
+    before = server.stats()["total_requests"]
+    assert api.simple_completion_queries(ids, max_batch_size=5) == single
+    assert server.stats()["total_requests"] == before + 1
+
+    persisted = _client(server, persisted_queries=True)
+    assert persisted.simple_completion_query(ids[0]) == single[0]
+    assert persisted.simple_completion_query(ids[1]) == single[1]
+
+
+def test_streamed_topic_tree_matches_the_decoded_one(server):
+    api = _client(server)
+    tree = api.topictree("Exercise")
+    streamed = list(api.iter_topictree("Exercise", fallback=True))
+    assert streamed == list(api.iter_topictree("Exercise"))
+    assert streamed[-1]["id"] == tree["id"]
+    assert "children" not in streamed[-1]
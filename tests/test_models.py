@@ -0,0 +1,117 @@
+import gc
+import json
+import tracemalloc
+from datetime import datetime, timezone
+
+import pytest
+
+from khan_api_wrapper import models
+
+STUDENT = {
+    "kaid": "kaid_1",
+    "nickname": "Ann",
+    "joined": "2019-01-08T06:59:59.250Z",
+    "last_activity": "not a date",
+    "points": 12,
+    "__typename": "Student",
+    "badgeCounts": {"1": 2},
+}
+
+
+def test_dates_are_parsed_on_first_access():
+    student = models.Student.from_dict(STUDENT)
+    slot = models.Student.__dict__["_joined"]
+    assert slot.__get__(student) == "2019-01-08T06:59:59.250Z"
+    joined = student.joined
+    assert joined == datetime(2019, 1, 8, 6, 59, 59, 250000, tzinfo=timezone.utc)
+    # the datetime replaces the string
+    assert slot.__get__(student) is joined
+    assert student.last_activity == "not a date"
+    assert student.to_dict()["joined"] == "2019-01-08T06:59:59.250Z"
+    assert models.parse_date("2019-01-08T06:59:59Z").tzinfo == timezone.utc
+    assert models.parse_date(None) is None
+
+
+def test_missing_and_unknown_fields():
+    student = models.Student.from_dict(STUDENT)
+    assert student.email is None
+    assert "email" not in student and "kaid" in student
+    assert student.get("email", "none") == "none"
+    assert student["kaid"] == "kaid_1"
+    assert student.typename == student["__typename"] == "Student"
+    # keys the model does not know are kept
+    assert student.extra == {"badgeCounts": {"1": 2}}
+    assert student["badgeCounts"] == {"1": 2}
+    with pytest.raises(KeyError):
+        student["nope"]
+    assert student.to_dict() == STUDENT
+    assert models.Student.from_dict(student.to_dict()) == student
+
+
+def test_record_list_converts_lazily():
+    response = {
+        "data": {
+            "coach": {
+                "assignment": {
+                    "itemCompletionStates": [
+                        {"student": {"kaid": "kaid_1"}, "state": "COMPLETED"},
+                        {"studentKaid": "kaid_2", "bestScore": None},
+                    ]
+                }
+            }
+        }
+    }
+    states = models.completion_states(response)
+    assert len(states) == 2
+    assert all(item.__class__ is dict for item in states.items)
+    assert states[1].kaid == "kaid_2" and states[1].bestScore is None
+    assert states.items[0].__class__ is dict
+    assert [state.kaid for state in states.materialize()] == ["kaid_1", "kaid_2"]
+    assert not hasattr(states[0], "__dict__")
+
+
+def _memory(text, convert):
+    """Bytes held by the decoded JSON, and by its records"""
+    tracemalloc.start()
+    try:
+        decoded = json.loads(text)
+        raw = tracemalloc.get_traced_memory()[0]
+        del decoded
+        gc.collect()
+        start = tracemalloc.get_traced_memory()[0]
+        records = convert(json.loads(text))
+        gc.collect()
+        held = tracemalloc.get_traced_memory()[0] - start
+    finally:
+        tracemalloc.stop()
+    assert len(records)
+    return raw, held
+
+
+def test_records_take_less_memory_than_the_json():
+    states = [
+        {
+            "studentKaid": "kaid_%d" % (i % 30),
+            "state": "COMPLETED",
+            "completedOn": "2019-01-08T06:59:59.250Z",
+            "bestScore": {"numCorrect": 4, "numAttempted": 5},
+        }
+        for i in range(5000)
+    ]
+    convert = lambda items: models.completion_states(items).materialize()
+    raw, held = _memory(json.dumps(states), convert)
+    assert held < raw / 2
+
+    students = [
+        {
+            "kaid": "kaid_%d" % i,
+            "email": "student%d@example.com" % i,
+            "nickname": "Student %d" % i,
+            "joined": "2019-01-08T06:59:59Z",
+            "points": i,
+        }
+        for i in range(5000)
+    ]
+    convert = lambda items: models.students(items).materialize()
+    raw, held = _memory(json.dumps(students), convert)
+    assert held < raw
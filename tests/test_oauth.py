@@ -0,0 +1,30 @@
+from unittest import mock
+
+from khan_api_wrapper import oauth
+from khan_api_wrapper.oauth import OAuth1Signer, flatten_params
+
+
+def test_sign_matches_the_spec_example():
+    # the example request of the OAuth 1.0 spec, appendix A.5
+    signer = OAuth1Signer(
+        "dpf43f3p2l4k3l03", "kd94hf93k423kf44", "nnch734d00sl2jdk", "pfkkdhi9sl3r4s00"
+    )
+    with mock.patch.object(oauth, "time", return_value=1191242096), mock.patch(
+        "uuid.uuid4", return_value=mock.Mock(hex="kllo9940pd9333jh")
+    ):
+        query = signer.sign(
+            "get",
+            "http://photos.example.net/photos",
+            {"file": "vacation.jpg", "size": "original"},
+        )
+    assert query[:2] == [("file", "vacation.jpg"), ("size", "original")]
+    assert dict(query)["oauth_nonce"] == "kllo9940pd9333jh"
+    assert query[-1] == ("oauth_signature", "tR3+Ty81lMeYAr/Fid0kMTYa/WM=")
+
+
+def test_flatten_params():
+    assert flatten_params({"a": None, "b": [1, 2], "c": "x"}) == [
+        ("b", "1"),
+        ("b", "2"),
+        ("c", "x"),
+    ]
@@ -0,0 +1,125 @@
+import asyncio
+import threading
+from time import sleep
+
+from khan_api_wrapper.progress import (
+    GRAPHQL,
+    REST,
+    ProgressError,
+    aiter_class_progress,
+    iter_class_progress,
+    iter_completed,
+    pick_source,
+)
+
+
+def test_results_arrive_as_they_complete():
+    release = threading.Event()
+
+    def fetch(item):
+        if item == "slow":
+            assert release.wait(5)
+        return item
+
+    results = iter_completed(fetch, ["slow", "fast"], max_workers=2)
+    assert next(results) == "fast"
+    release.set()
+    assert list(results) == ["slow"]
+
+
+class Counter:
+    """Records how many calls run at the same time"""
+
+    def __init__(self):
+        self.lock = threading.Lock()
+        self.running = 0
+        self.most = 0
+
+    def __enter__(self):
+        with self.lock:
+            self.running += 1
+            self.most = max(self.most, self.running)
+
+    def __exit__(self, *exc_info):
+        with self.lock:
+            self.running -= 1
+
+
+def test_concurrency_bound():
+    counter = Counter()
+
+    def fetch(item):
+        with counter:
+            sleep(0.005)
+        return item
+
+    assert sorted(iter_completed(fetch, range(20), max_workers=3)) == list(range(20))
+    assert counter.most == 3
+
+
+class Client:
+    def __init__(self):
+        self.counter = Counter()
+
+    def get_student_progress(self, kaid, params):
+        with self.counter:
+            sleep(0.002)
+        if kaid == "kaid_raise":
+            raise ConnectionError("reset")
+        if kaid == "kaid_error":
+            return {"error": 500}
+        return {"kaid": kaid}
+
+
+class AsyncClient(Client):
+    async def get_student_progress(self, kaid, params):
+        with self.counter:
+            await asyncio.sleep(0.002)
+        return Client.get_student_progress(self, kaid, params)
+
+
+KAIDS = ["kaid_%d" % i for i in range(10)] + ["kaid_raise", "kaid_error"]
+
+
+def _check(results):
+    by_kaid = {result.kaid: result for result in results}
+    assert sorted(by_kaid) == sorted(KAIDS)
+    assert isinstance(by_kaid["kaid_raise"].error, ConnectionError)
+    assert isinstance(by_kaid["kaid_error"].error, ProgressError)
+    assert by_kaid["kaid_3"].ok and by_kaid["kaid_3"].progress == {"kaid": "kaid_3"}
+    assert sum(result.ok for result in results) == 10
+
+
+def test_failures_are_reported_not_raised():
+    client = Client()
+    _check(list(iter_class_progress(client, KAIDS, max_workers=4)))
+    assert client.counter.most <= 4
+
+
+def test_async_class_progress():
+    client = AsyncClient()
+
+    async def collect():
+        return [r async for r in aiter_class_progress(client, KAIDS, max_workers=4)]
+
+    _check(asyncio.run(collect()))
+    assert 1 < client.counter.most <= 4
+
+
+def test_async_results_arrive_as_they_complete():
+    class Slow:
+        async def get_student_progress(self, kaid, params):
+            await asyncio.sleep(0.05 if kaid == "slow" else 0)
+            return {"kaid": kaid}
+
+    async def collect():
+        progress = aiter_class_progress(Slow(), ["slow", "fast"], max_workers=2)
+        return [r.kaid async for r in progress]
+
+    assert asyncio.run(collect()) == ["fast", "slow"]
+
+
+def test_pick_source():
+    assert pick_source("auto", "class", None, 30) == GRAPHQL
+    assert pick_source("auto", "class", ["k"] * 5, 30) == REST
+    assert pick_source("auto", None, ["k"] * 50, 30) == REST
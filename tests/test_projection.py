@@ -0,0 +1,44 @@
+import json
+
+import pytest
+
+from khan_api_wrapper.graphql import get_operation
+from khan_api_wrapper.projection import project
+
+STUDENT_FIELDS = [
+    "coach.studentsPage.students.kaid",
+    "coach.studentsPage.nextCursor",
+]
+
+
+def test_project_trims_the_fragments_and_variables():
+    op = project("getStudentsList", STUDENT_FIELDS)
+    full = get_operation("getStudentsList")
+    assert op.name == full.name
+    assert len(op.document) < len(full.document)
+    assert "coachNickname" not in op.document
+    assert "__typename" not in op.document
+    assert "fragment StudentField on StudentsPage" in op.document
+    assert "kaid" in op.document and "nextCursor" in op.document
+    # classId is only used by the part that was trimmed away
+    assert "$classId" not in op.document
+    assert op.unused_variables == {"classId"}
+    payload = json.loads(op.payload({"hasClassId": False, "classId": "c1"}))
+    assert payload["variables"] == {"hasClassId": False}
+
+
+def test_nested_dict_fields_and_the_cache():
+    nested = project("getStudentsList", {"coach": {"studentsPage": ["nextCursor"]}})
+    paths = project("getStudentsList", ["coach.studentsPage.nextCursor"])
+    assert nested.document == paths.document
+    assert project("getStudentsList", ["coach.studentsPage.nextCursor"]) is paths
+
+
+def test_typename_is_kept_on_request():
+    op = project("getStudentsList", STUDENT_FIELDS, typename=True)
+    assert "__typename" in op.document
+
+
+def test_unknown_fields_are_refused():
+    with pytest.raises(ValueError):
+        project("getStudentsList", ["coach.nope"])
@@ -0,0 +1,96 @@
+import asyncio
+
+from khan_api_wrapper.roster import STOP_COACHING, TRANSFER, BulkRoster
+
+
+class Client:
+    """Answers the roster mutations, failing the batches holding a `bad` kaid"""
+
+    def __init__(self, bad=()):
+        self.bad = set(bad)
+        self.sent = []
+
+    def _answer(self, field, kaids):
+        self.sent.append(list(kaids))
+        if "raise" in kaids:
+            raise ConnectionError("reset")
+        if self.bad & set(kaids):
+            return {"errors": [{"message": "Forbidden"}], "data": {field: None}}
+        return {"data": {field: {"ok": True}}}
+
+    def transfer_students(self, from_list_ids, to_list_ids, kaids):
+        return self._answer("transferStudents", kaids)
+
+    def stop_coaching(self, kaids):
+        return self._answer("stopCoaching", kaids)
+
+    def update_auto_assign(self, list_id, kaids, auto_assign):
+        return self._answer("updateAutoAssign", kaids)
+
+
+class AsyncClient(Client):
+    async def transfer_students(self, *args):
+        await asyncio.sleep(0)
+        return Client.transfer_students(self, *args)
+
+    async def stop_coaching(self, kaids):
+        await asyncio.sleep(0)
+        return Client.stop_coaching(self, kaids)
+
+    async def update_auto_assign(self, *args):
+        await asyncio.sleep(0)
+        return Client.update_auto_assign(self, *args)
+
+
+def _queue(client):
+    roster = BulkRoster(client, batch_size=2, max_workers=3)
+    roster.transfer(["k1", "k2", "k3", "bad", "k4"], ["new"], ["old"])
+    roster.stop_coaching(["k5", "raise", "k5"])
+    return roster
+
+
+def _summary(report):
+    return sorted((r.action, r.kaid, r.ok) for r in report)
+
+
+def test_failures_are_reported_per_kaid():
+    client = Client(bad=["bad"])
+    roster = _queue(client)
+    assert len(roster) == 7
+    report = roster.execute()
+    assert len(roster) == 0
+    assert len(report) == 7 and not report.ok
+    # the batches are [k1, k2], [k3, bad], [k4] and [k5, raise]
+    assert report.failed_kaids() == ["bad", "k3", "k5", "raise"]
+    by_kaid = report.by_kaid()
+    assert by_kaid["k3"][0].error == "Forbidden"
+    assert by_kaid["k3"][0].target == (("old",), ("new",))
+    assert by_kaid["raise"][0].error == "ConnectionError: reset"
+    assert by_kaid["raise"][0].action == STOP_COACHING
+    assert {r.kaid for r in report.succeeded} == {"k1", "k2", "k4"}
+
+
+def test_requeue_retries_only_the_failed_kaids():
+    client = Client(bad=["bad"])
+    roster = _queue(client)
+    report = roster.execute()
+    client.bad.clear()
+    client.sent.clear()
+    roster.requeue(report)
+    assert len(roster) == 4
+    retried = roster.execute()
+    assert sorted(k for sent in client.sent for k in sent) == [
+        "bad",
+        "k3",
+        "k5",
+        "raise",
+    ]
+    assert retried.failed_kaids() == ["k5", "raise"]
+    assert [r.action for r in retried.succeeded] == [TRANSFER, TRANSFER]
+
+
+def test_execute_async_matches_execute():
+    report = _queue(Client(bad=["bad"])).execute()
+    async_report = asyncio.run(_queue(AsyncClient(bad=["bad"])).execute_async())
+    assert _summary(async_report) == _summary(report)
+    assert [r.error for r in async_report.failed] == [r.error for r in report.failed]
@@ -0,0 +1,174 @@
+import asyncio
+from email.utils import format_datetime
+from datetime import datetime, timedelta, timezone
+
+import pytest
+
+from khan_api_wrapper.scheduler import (
+    DOCUMENTED,
+    GRAPHQL_MUTATION,
+    INTERNAL,
+    RequestScheduler,
+    RetryPolicy,
+    TokenBucket,
+    endpoint_class,
+)
+
+
+class Response:
+    def __init__(self, status_code, headers=None):
+        self.status_code = status_code
+        self.headers = headers or {}
+        self.closed = False
+
+    def close(self):
+        self.closed = True
+
+
+def _responses(*statuses):
+    responses = [Response(status) for status in statuses]
+    sent = []
+
+    def send():
+        sent.append(responses[len(sent)])
+        return sent[-1]
+
+    return send, sent
+
+
+def _scheduler(**policy):
+    policy = RetryPolicy(backoff_factor=0, **policy)
+    return RequestScheduler(policies={DOCUMENTED: policy, GRAPHQL_MUTATION: policy})
+
+
+def test_endpoint_class():
+    assert endpoint_class("/api/v1/user") == DOCUMENTED
+    assert endpoint_class("/api/internal/graphql") == INTERNAL
+
+
+def test_backoff_stays_within_the_exponential_bound():
+    policy = RetryPolicy(backoff_factor=0.5, max_backoff=3)
+    for retry in range(6):
+        for _ in range(50):
+            assert 0 <= policy.backoff(retry) <= min(3, 0.5 * 2**retry)
+
+
+def test_delay_honours_retry_after():
+    policy = RetryPolicy(max_backoff=30)
+    assert policy.delay(0, Response(429, {"Retry-After": "2"})) == 2
+    # honoured in full, max_backoff only bounds the computed backoff
+    assert policy.delay(0, Response(429, {"Retry-After": "120"})) == 120
+    later = datetime.now(timezone.utc) + timedelta(seconds=10)
+    delay = policy.delay(0, Response(503, {"Retry-After": format_datetime(later)}))
+    assert 0 < delay <= 10
+    ignored = RetryPolicy(backoff_factor=0, respect_retry_after=False)
+    assert ignored.delay(0, Response(429, {"Retry-After": "2"})) == 0
+
+
+def test_retry_after_over_the_cap_gives_up():
+    policy = RetryPolicy(max_retry_after=60)
+    assert policy.delay(0, Response(429, {"Retry-After": "60"})) == 60
+    assert policy.delay(0, Response(429, {"Retry-After": "61"})) is None
+
+    scheduler = _scheduler(max_retry_after=60)
+    send, sent = _responses(503, 429, 200)
+    sent_headers = [{}, {"Retry-After": "3600"}]
+
+    def send_with_headers():
+        response = send()
+        response.headers = sent_headers[len(sent) - 1]
+        return response
+
+    # the throttled response is handed back instead of waiting an hour
+    assert scheduler.send(DOCUMENTED, send_with_headers).status_code == 429
+    assert len(sent) == 2
+    assert not sent[1].closed
+
+
+def test_retries_a_retryable_status_until_it_succeeds():
+    scheduler = _scheduler()
+    send, sent = _responses(503, 502, 200)
+    assert scheduler.send(DOCUMENTED, send).status_code == 200
+    assert len(sent) == 3
+    # the connections of the discarded responses are released
+    assert sent[0].closed and sent[1].closed
+    assert scheduler.stats.requests == 3
+    assert scheduler.stats.retries == 2
+
+
+def test_gives_up_after_max_retries():
+    scheduler = _scheduler(max_retries=2)
+    send, sent = _responses(503, 503, 503, 200)
+    assert scheduler.send(DOCUMENTED, send).status_code == 503
+    assert len(sent) == 3
+
+
+def test_other_statuses_are_not_retried():
+    scheduler = _scheduler(retry_statuses=(429, 503))
+    send, sent = _responses(500, 200)
+    assert scheduler.send(GRAPHQL_MUTATION, send).status_code == 500
+    assert len(sent) == 1
+
+
+def test_connection_errors():
+    scheduler = _scheduler()
+    scheduler.retry_exceptions = (ConnectionError,)
+    attempts = []
+
+    def send():
+        attempts.append(1)
+        if len(attempts) < 3:
+            raise ConnectionError()
+        return Response(200)
+
+    assert scheduler.send(DOCUMENTED, send).status_code == 200
+    assert len(attempts) == 3
+
+    strict = _scheduler(retry_on_connection_error=False)
+    strict.retry_exceptions = (ConnectionError,)
+    attempts.clear()
+    with pytest.raises(ConnectionError):
+        strict.send(DOCUMENTED, send)
+    assert len(attempts) == 1
+
+
+def test_default_retry_exceptions_are_the_transport_errors():
+    import requests
+
+    scheduler = RequestScheduler()
+    assert requests.ConnectionError in scheduler.retry_exceptions
+    assert requests.Timeout in scheduler.retry_exceptions
+    aiohttp = pytest.importorskip("aiohttp")
+    assert aiohttp.ClientConnectionError in scheduler.retry_exceptions
+    assert asyncio.TimeoutError in scheduler.retry_exceptions
+    assert RequestScheduler(retry_exceptions=()).retry_exceptions == ()
+
+
+def test_send_async():
+    scheduler = _scheduler()
+    send, sent = _responses(429, 200)
+
+    async def send_async():
+        return send()
+
+    response = asyncio.run(scheduler.send_async(DOCUMENTED, send_async))
+    assert response.status_code == 200
+    assert len(sent) == 2
+
+
+def test_token_bucket_allows_the_burst_then_spaces_requests():
+    bucket = TokenBucket(rate=10, capacity=3)
+    assert [bucket.reserve() for _ in range(3)] == [0.0, 0.0, 0.0]
+    waits = [bucket.reserve() for _ in range(3)]
+    # each further token comes 1/rate seconds after the previous one
+    assert waits[0] == pytest.approx(0.1, abs=0.02)
+    assert waits[2] == pytest.approx(0.3, abs=0.02)
+
+
+def test_token_bucket_refills_up_to_its_capacity():
+    bucket = TokenBucket(rate=1000, capacity=2)
+    bucket.reserve()
+    bucket.reserve()
+    bucket.updated -= 10
+    assert bucket.reserve() == 0.0
+    assert bucket.tokens == pytest.approx(1, abs=0.1)
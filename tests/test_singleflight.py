@@ -0,0 +1,128 @@
+import asyncio
+import json
+import threading
+from time import monotonic, sleep
+
+from khan_api_wrapper.khan import KhanAPI
+from khan_api_wrapper.singleflight import AsyncSingleFlight, SingleFlight, request_key
+
+THREADS = 8
+
+
+class Response:
+    def __init__(self, body):
+        self.status_code = 200
+        self.headers = {"content-type": "application/json"}
+        self.content = json.dumps(body).encode("utf-8")
+
+
+def _wait_for(condition):
+    deadline = monotonic() + 5
+    while not condition():
+        assert monotonic() < deadline
+        sleep(0.001)
+
+
+class Session:
+    """Answers once every other thread is waiting on the call in flight"""
+
+    def __init__(self, api, waiters):
+        self.api = api
+        self.waiters = waiters
+        self.calls = []
+
+    def get(self, url, params=None, headers=None):
+        self.calls.append(url)
+        _wait_for(lambda: self.api.singleflight.coalesced >= self.waiters)
+        return Response({"calls": len(self.calls)})
+
+    def post(self, url, data=None, params=None, headers=None):
+        self.calls.append(url)
+        sleep(0.01)
+        return Response({"data": {"ok": True}})
+
+
+def _in_threads(fn):
+    results = [None] * THREADS
+
+    def run(i):
+        try:
+            results[i] = fn()
+        except Exception as exc:
+            results[i] = exc
+
+    threads = [threading.Thread(target=run, args=(i,)) for i in range(THREADS)]
+    for thread in threads:
+        thread.start()
+    for thread in threads:
+        thread.join()
+    return results
+
+
+def test_identical_gets_share_one_call():
+    api = KhanAPI(coalesce=True)
+    api._session = Session(api, THREADS - 1)
+    results = _in_threads(lambda: api.get("/api/v1/exercises", {"lang": "en"}))
+    assert len(api._session.calls) == 1
+    assert all(result is results[0] for result in results)
+    assert api.singleflight.snapshot() == {"executed": 1, "coalesced": THREADS - 1}
+
+
+def test_an_exception_reaches_every_waiter():
+    flight = SingleFlight()
+
+    def fail():
+        _wait_for(lambda: flight.coalesced >= THREADS - 1)
+        raise ConnectionError("reset")
+
+    results = _in_threads(lambda: flight.do("key", fail))
+    assert all(isinstance(result, ConnectionError) for result in results)
+    assert flight.executed == 1
+    # the key is free again once the call is over
+    assert flight.do("key", lambda: 1) == 1
+
+
+def test_mutations_are_never_coalesced():
+    api = KhanAPI(coalesce=True)
+    api._session = Session(api, 0)
+    data = '{"operationName":"stopCoaching","variables":{}}'
+    _in_threads(lambda: api.post_graphql(data=data, mutation=True))
+    assert len(api._session.calls) == THREADS
+    assert api.singleflight.snapshot() == {"executed": 0, "coalesced": 0}
+
+
+def test_request_key():
+    key = request_key("GET", "/api/v1/user", {"kaid": "k", "_": 1, "a": "b"})
+    assert key == request_key("GET", "/api/v1/user", {"a": "b", "kaid": "k", "_": 2})
+    assert key != request_key("GET", "/api/v1/user", {"kaid": "k2", "a": "b"})
+    assert key != request_key("GET", "/api/v1/user", {"kaid": "k", "a": "b"}, None, "t")
+    assert request_key("POST", "/g", None, b'{"a":1}') == request_key(
+        "POST", "/g", None, '{"a":1}'
+    )
+
+
+def test_async_single_flight():
+    flight = AsyncSingleFlight()
+    calls = []
+
+    async def fetch():
+        calls.append(1)
+        await asyncio.sleep(0.01)
+        return {"calls": len(calls)}
+
+    async def fail():
+        await asyncio.sleep(0.01)
+        raise ConnectionError("reset")
+
+    async def run():
+        results = await asyncio.gather(*(flight.do("a", fetch) for _ in range(5)))
+        errors = await asyncio.gather(
+            *(flight.do("b", fail) for _ in range(5)), return_exceptions=True
+        )
+        return results, errors
+
+    results, errors = asyncio.run(run())
+    assert len(calls) == 1 and all(r is results[0] for r in results)
+    assert all(isinstance(error, ConnectionError) for error in errors)
+    assert flight.snapshot() == {"executed": 2, "coalesced": 8}
+    assert not flight.calls
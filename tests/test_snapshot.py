@@ -0,0 +1,123 @@
+import pytest
+
+from khan_api_wrapper.snapshot import SnapshotStore
+
+OLD = "2019-01-01T00:00:00Z"
+
+
+@pytest.fixture
+def store():
+    with SnapshotStore(":memory:") as store:
+        yield store
+
+
+def _student(store, kaid):
+    (row,) = store.query("SELECT * FROM students WHERE kaid = ?", (kaid,))
+    return row
+
+
+def test_partial_rows_keep_the_stored_columns(store):
+    store.save_students([{"kaid": "k1", "nickname": "Ann", "email": "ann@example.com"}])
+    # a projection without the email
+    store.save_students([{"kaid": "k1", "nickname": "Annie"}])
+    row = _student(store, "k1")
+    assert (row["nickname"], row["email"]) == ("Annie", "ann@example.com")
+    # a field cleared on the server is cleared here too
+    store.save_students([{"kaid": "k1", "email": None}])
+    row = _student(store, "k1")
+    assert (row["nickname"], row["email"]) == ("Annie", None)
+
+    store.save_user_exercises(
+        [{"kaid": "k1", "exercise": "e1", "mastered": True, "streak": 3}]
+    )
+    store.save_user_exercises([{"kaid": "k1", "exercise": "e1", "streak": 4}])
+    (row,) = store.student_exercises("k1")
+    assert (row["mastered"], row["streak"]) == (1, 4)
+    assert store.student_exercises("k1", mastered=False) == []
+
+
+def test_rows_of_different_shapes_keep_their_order(store):
+    saved = store.save_students(
+        [
+            {"kaid": "k1", "nickname": "Ann", "email": "a@example.com"},
+            {"kaid": "k1", "nickname": "Annie"},
+            {"kaid": "k1", "email": "b@example.com", "nickname": "Ann B"},
+            {"nickname": "no kaid"},
+        ]
+    )
+    assert saved == 3
+    row = _student(store, "k1")
+    assert (row["nickname"], row["email"]) == ("Ann B", "b@example.com")
+
+
+ASSIGNMENT = {
+    "id": "as1",
+    "dueDate": "2019-01-08T06:59:59Z",
+    "contents": [{"id": "c1", "translatedTitle": "Addition"}],
+    "studentKaids": ["k1", "k2", "k3"],
+    "itemCompletionStates": [
+        {
+            "studentKaid": "k1",
+            "state": "COMPLETED",
+            "completedOn": "2019-01-07T10:00:00Z",
+            "bestScore": {"numCorrect": 4, "numAttempted": 5},
+        },
+        {"studentKaid": "k2", "state": "STARTED"},
+    ],
+}
+
+
+def test_students_not_completed(store):
+    store.save_students([{"kaid": "k2", "nickname": "Bob"}])
+    assert store.save_assignments([ASSIGNMENT], "class1") == 1
+    not_completed = store.students_not_completed("as1")
+    assert [(r["kaid"], r["nickname"], r["state"]) for r in not_completed] == [
+        ("k2", "Bob", "STARTED"),
+        ("k3", None, None),
+    ]
+    (assignment,) = store.assignments("class1", due_after="2019-01-01")
+    assert (assignment["content_ids"], assignment["titles"]) == ("c1", "Addition")
+
+    # the latest completion state replaces the stored one whole
+    completed = {"studentKaid": "k1", "state": "STARTED"}
+    store.save_assignments([{"id": "as1", "itemCompletionStates": [completed]}])
+    assert [r["kaid"] for r in store.students_not_completed("as1")] == [
+        "k1",
+        "k2",
+        "k3",
+    ]
+    assert store.completion("as1")[0]["num_correct"] is None
+    # the assignment keeps the fields missing from the second save
+    (assignment,) = store.assignments("class1")
+    assert assignment["due_date"] == "2019-01-08T06:59:59Z"
+
+
+def test_stale(store):
+    store.now = lambda: OLD
+    store.save_students([{"kaid": "k1"}, {"kaid": "k2"}], class_id="class1")
+    del store.now
+    store.save_students([{"kaid": "k2"}], class_id="class1")
+    assert store.stale("students", 3600) == ["k1"]
+    assert store.stale("class_students", 3600) == [("class1", "k1")]
+    assert store.stale("students", 100 * 365 * 24 * 3600) == []
+
+
+def test_reopen_an_existing_database(tmp_path):
+    path = str(tmp_path / "khan.db")
+    with SnapshotStore(path) as store:
+        store.save_students([{"kaid": "k1", "nickname": "Ann"}], class_id="c1")
+        store.save_topic_tree(
+            {
+                "id": "root",
+                "kind": "Topic",
+                "slug": "root",
+                "children": [
+                    {"id": "x1", "kind": "Exercise", "name": "e1", "title": "E1"}
+                ],
+            }
+        )
+    with SnapshotStore(path) as store:
+        assert [r["nickname"] for r in store.class_students("c1")] == ["Ann"]
+        assert store.exercise_node("e1")["parent_id"] == "root"
+        store.save_students([{"kaid": "k1", "email": "ann@example.com"}])
+        assert _student(store, "k1")["nickname"] == "Ann"
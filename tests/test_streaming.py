@@ -0,0 +1,77 @@
+import json
+
+import pytest
+
+from khan_api_wrapper import streaming
+
+DOCUMENT = {
+    "topics": [{"id": "t1", "title": "Math é", "children": []}],
+    "exercises": [
+        {"name": "addition_1", "points": 5, "ratio": 0.5, "live": True},
+        {"name": "counting-1", "points": -1e3, "ratio": None, "live": False},
+    ],
+}
+
+
+def test_iter_value_events_matches_the_parser():
+    body = json.dumps(DOCUMENT).encode()
+    chunks = [body[i : i + 5] for i in range(0, len(body), 5)]
+    parsed = list(streaming.iter_events(chunks))
+    assert list(streaming.iter_value_events(DOCUMENT)) == parsed
+    items = streaming.iter_items(
+        streaming.iter_value_events(DOCUMENT), "exercises.item"
+    )
+    assert list(items) == DOCUMENT["exercises"]
+
+
+def _chunked(body, size):
+    return [body[i : i + size] for i in range(0, len(body), size)]
+
+
+def test_fallback_parser_across_chunk_boundaries():
+    document = {
+        "text": 'quote " backslash \\ unicode é ☃  ',
+        "numbers": [0, -12, 3.25, 1e-7, 12345678901234567890],
+        "constants": [True, False, None],
+        "nested": [[], {}, [{"a": []}]],
+    }
+    body = json.dumps(document, ensure_ascii=False).encode("utf-8")
+    expected = list(streaming.iter_value_events(json.loads(body)))
+    # every split, including inside multi byte characters and escapes
+    for size in (1, 2, 3, 7, len(body)):
+        events = list(streaming._iter_events(_chunked(body, size)))
+        assert events == expected
+
+
+def test_fallback_parser_rejects_invalid_documents():
+    for body in (b'{"a": tru}', b'{"a": [1, 2', b"[@]"):
+        with pytest.raises(ValueError):
+            list(streaming._iter_events([body]))
+
+
+def test_iter_items():
+    events = streaming.iter_value_events(DOCUMENT)
+    topics = list(streaming.iter_items(events, "topics.item.title"))
+    assert topics == ["Math é"]
+    events = streaming.iter_value_events([DOCUMENT, DOCUMENT])
+    assert len(list(streaming.iter_items(events, "item.exercises.item"))) == 4
+
+
+def test_iter_tree_nodes_yields_children_first():
+    tree = {
+        "id": "root",
+        "children": [
+            {"id": "a", "children": [{"id": "a1"}, {"id": "a2"}]},
+            {"id": "b", "children": []},
+        ],
+    }
+    events = streaming.iter_events(_chunked(json.dumps(tree).encode(), 4))
+    nodes = list(streaming.iter_tree_nodes(events, with_depth=True))
+    assert [(depth, node["id"]) for depth, node in nodes] == [
+        (2, "a1"),
+        (2, "a2"),
+        (1, "a"),
+        (1, "b"),
+        (0, "root"),
+    ]
+    assert all("children" not in node for _, node in nodes)
@@ -0,0 +1,138 @@
+import json
+from unittest import mock
+
+from khan_api_wrapper import sync
+from khan_api_wrapper.sync import (
+    JsonStateStore,
+    MemoryStateStore,
+    RosterSync,
+    _Cursor,
+    _time_key,
+)
+
+EARLY = {"exercise": "addition_1", "date": "2019-01-08T06:00:00Z"}
+LATE_A = {"exercise": "addition_1", "date": "2019-01-08T07:00:00.5Z"}
+LATE_B = {"exercise": "counting-1", "date": "2019-01-08T07:00:00.500000Z"}
+
+
+def test_time_key_orders_fractions():
+    assert _time_key("2019-01-08T07:00:00Z") < _time_key("2019-01-08T07:00:00.1Z")
+    assert _time_key("2019-01-08T07:00:00.5Z") == _time_key(
+        "2019-01-08T07:00:00.500000Z"
+    )
+
+
+def test_cursor_keeps_the_events_sharing_the_last_timestamp():
+    cursor = _Cursor()
+    assert cursor.is_new(EARLY["date"], EARLY)
+    cursor.advance(EARLY["date"], EARLY)
+    cursor.advance(LATE_A["date"], LATE_A)
+    assert cursor.time == LATE_A["date"]
+    assert len(cursor.seen) == 1
+
+    assert not cursor.is_new(EARLY["date"], EARLY)
+    assert not cursor.is_new(LATE_A["date"], LATE_A)
+    # same instant, written differently, but another event
+    assert cursor.is_new(LATE_B["date"], LATE_B)
+    cursor.advance(LATE_B["date"], LATE_B)
+    assert len(cursor.seen) == 2
+
+
+def test_cursor_state_round_trips_through_json():
+    cursor = _Cursor()
+    cursor.advance(LATE_A["date"], LATE_A)
+    restored = _Cursor(json.loads(json.dumps(cursor.state())))
+    assert restored.time == cursor.time
+    assert not restored.is_new(LATE_A["date"], LATE_A)
+    assert restored.is_new(LATE_B["date"], LATE_B)
+
+
+def test_json_state_store(tmp_path):
+    path = str(tmp_path / "state.json")
+    store = JsonStateStore(path)
+    assert store.load("a") is None
+    store.save("a", {"time": "t"})
+    store.save("b", 1)
+    store.delete("b")
+    assert JsonStateStore(path).load("a") == {"time": "t"}
+    assert JsonStateStore(path).load("b") is None
+
+
+def test_json_state_store_batch_writes_once(tmp_path):
+    path = str(tmp_path / "state.json")
+    store = JsonStateStore(path)
+    store.save("old", 1)
+    with mock.patch.object(sync.os, "replace", wraps=sync.os.replace) as replace:
+        with store.batch():
+            for i in range(50):
+                store.save("k%d" % i, i)
+            store.delete("old")
+            with store.batch():
+                store.save("nested", True)
+            # staged values are visible before they are written
+            assert store.load("k3") == 3
+            assert store.load("old") is None
+            assert replace.call_count == 0
+    assert replace.call_count == 1
+    written = JsonStateStore(path)
+    assert written.load("k49") == 49
+    assert written.load("nested") is True
+    assert written.load("old") is None
+
+
+class StudentList:
+    """Answers get_student_list with the next queued response"""
+
+    identity = "coach"
+
+    def __init__(self, *responses):
+        self.responses = list(responses)
+        self.windows = []
+
+    def get_student_list(self, window):
+        self.windows.append(window)
+        return self.responses.pop(0)
+
+
+def test_incremental_roster_sync_merges_the_changed_fields():
+    full = [
+        {"kaid": "k1", "nickname": "Ann", "email": "ann@example.com", "points": 10},
+        {"kaid": "k2", "nickname": "Bob", "points": 5},
+    ]
+    client = StudentList(full, [{"kaid": "k1", "points": 12}, {"kaid": "k3"}], [])
+    roster = RosterSync(client, MemoryStateStore())
+    assert len(roster.sync().added) == 2
+
+    delta = roster.sync()
+    assert client.windows[1]["dt_start"] != sync.EPOCH
+    assert [s["kaid"] for s in delta.added] == ["k3"]
+    # the stored fields missing from the window are kept
+    assert delta.updated == [{**full[0], "points": 12}]
+    assert roster.roster["k1"] == {**full[0], "points": 12}
+    assert roster.roster["k2"] == full[1]
+
+    # a full sync replaces the snapshot
+    delta = roster.sync(full=True)
+    assert sorted(delta.removed) == ["k1", "k2", "k3"]
+    assert roster.roster == {}
+
+
+class ProgressChanges:
+    def __init__(self, events):
+        self.events = events
+
+    def user_exercises_progress_changes(self, params):
+        return [dict(event) for event in self.events]
+
+
+def test_changes_without_an_exercise_are_not_redelivered(tmp_path):
+    events = [
+        {"date": "2019-01-07T10:00:00Z", "exercise_name": None, "to_progress": "x"},
+        {"date": "2019-01-07T11:00:00Z", "exercise_name": "addition_1"},
+    ]
+    path = str(tmp_path / "activity.json")
+    activity = sync.ActivitySync(ProgressChanges(events), JsonStateStore(path))
+    assert len(list(activity.iter_progress_changes(["k1"]))) == 2
+    # a new store reads the cursors back from the file
+    activity = sync.ActivitySync(ProgressChanges(events), JsonStateStore(path))
+    assert list(activity.iter_progress_changes(["k1"])) == []
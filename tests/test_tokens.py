@@ -0,0 +1,66 @@
+from khan_api_wrapper.khan import KhanAPI
+from khan_api_wrapper.tokens import FileTokenStore, TokenManager
+
+
+class SignIn:
+    def __init__(self):
+        self.logins = 0
+
+    def authorize_self(self):
+        self.logins += 1
+        return "token%d" % self.logins, "secret%d" % self.logins
+
+
+class Response:
+    def __init__(self, status_code):
+        self.status_code = status_code
+        self.closed = False
+
+    def close(self):
+        self.closed = True
+
+
+class Session:
+    """Rejects the first token, like a server on which it was revoked"""
+
+    def __init__(self):
+        self.access_token = None
+        self.access_token_secret = None
+        self.sent = []
+
+    def get(self, url, **kwargs):
+        self.sent.append(self.access_token)
+        return Response(401 if self.access_token == "token1" else 200)
+
+
+def test_rejected_forgets_the_token(tmp_path):
+    store = FileTokenStore(str(tmp_path / "tokens.json"))
+    sign_in = SignIn()
+    tokens = TokenManager(sign_in, store, key="k", relogin_interval=0)
+    token, _ = tokens.get()
+    assert tokens.rejected(token)
+    assert store.load("k") is None
+    assert tokens.get()[0] == "token2"
+    # a token already replaced is worth retrying with the new one
+    assert tokens.rejected("token1")
+    assert sign_in.logins == 2
+
+
+def test_a_new_token_is_not_replaced_right_away():
+    tokens = TokenManager(SignIn(), relogin_interval=60)
+    token, _ = tokens.get()
+    assert not tokens.rejected(token)
+    assert tokens.get()[0] == token
+
+
+def test_client_logs_in_again_and_retries_once_on_a_401():
+    sign_in = SignIn()
+    tokens = TokenManager(sign_in, relogin_interval=0)
+    api = KhanAPI("key", "secret", tokens=tokens)
+    session = api._session = Session()
+    session.access_token, session.access_token_secret = tokens.get()
+    send = api._renewing(lambda: api.session.get("/api/v1/user"))
+    assert send().status_code == 200
+    assert session.sent == ["token1", "token2"]
+    assert session.access_token_secret == "secret2"
+    assert sign_in.logins == 2
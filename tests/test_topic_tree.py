@@ -0,0 +1,39 @@
+import json
+
+from khan_api_wrapper import streaming
+from khan_api_wrapper.topic_tree import TopicTree
+
+EXERCISE = {"id": "x1", "kind": "Exercise", "name": "addition_1", "slug": "add"}
+# the "basics" topic is listed twice, as topics often are
+BASICS = {"id": "t2", "kind": "Topic", "slug": "basics", "children": [EXERCISE]}
+TREE = {
+    "id": "root",
+    "kind": "Topic",
+    "slug": "root",
+    "children": [
+        BASICS,
+        {"id": "t3", "kind": "Topic", "slug": "more", "children": [BASICS]},
+        BASICS,
+    ],
+}
+
+
+def _check(tree):
+    assert len(tree) == 4
+    assert tree.roots == ["root"]
+    assert tree.children_ids["t2"] == ["x1"]
+    assert tree.children_ids["root"] == ["t2", "t3"]
+    assert tree.children_ids["t3"] == ["t2"]
+    assert tree.by_slug("add")["name"] == "addition_1"
+
+
+def test_from_tree_links_a_repeated_topic_once():
+    _check(TopicTree.from_tree(TREE))
+
+
+def test_from_depth_nodes_merges_a_repeated_topic():
+    body = json.dumps(TREE).encode()
+    events = streaming.iter_events([body[:7], body[7:]])
+    _check(
+        TopicTree.from_depth_nodes(streaming.iter_tree_nodes(events, with_depth=True))
+    )